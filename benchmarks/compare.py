@@ -0,0 +1,58 @@
+"""
+Compares two benchmarks/suite.py results, printing every measure that changed by more than the threshold
+(default 10%) and marking the ones that got worse. Exits with status 1 if any did.
+
+Usage: python benchmarks/compare.py <baseline.json> <results.json> [threshold percent]
+"""
+import json
+import sys
+
+# Measures where a larger number is better, anything else is a time or a size
+higher_is_better = ("values_per_second", "compression_ratio", "encode_mb_per_second", "decode_mb_per_second")
+# Recorded for context but not compared
+ignored = ("trends", "days", "values", "raw_bytes", "build_seconds", "file_bytes")
+
+
+def measures(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(measures(value, f"{prefix}{key}/"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in ignored:
+            flat[prefix + key] = value
+    return flat
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    with open(sys.argv[1]) as baseline_file, open(sys.argv[2]) as results_file:
+        baseline_results = json.load(baseline_file)
+        results = json.load(results_file)
+    threshold = float(sys.argv[3]) / 100 if len(sys.argv) > 3 else 0.1
+
+    print(f"Version {baseline_results.get('stsd_version')} to {results.get('stsd_version')}")
+    baseline = {name: value for name, value in measures(baseline_results).items() if name.split("/")[0] != "stsd_version"}
+    current = measures(results)
+    regressions = 0
+    for name in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[name], current[name]
+        if before == 0:
+            continue
+        change = (after - before) / before
+        if abs(change) <= threshold:
+            continue
+        worse = change < 0 if name.endswith(higher_is_better) else change > 0
+        regressions += worse
+        print(f"{'WORSE' if worse else 'better':<7} {name:<70} {before:>12.4g} {after:>12.4g} {change:>+8.1%}")
+
+    for name in sorted(baseline.keys() - current.keys()):
+        print(f"missing {name}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Measures bulk load throughput of stsd.load as the number of worker processes grows.
+
+Each run loads the same rows, minute data for a mix of numeric and status trends, into a new database.
+0 workers is the serial path.
+
+Usage: python benchmarks/parallel_load.py [num_days] [max_workers]
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stsd
+
+
+def rows(num_days: int) -> list[tuple[datetime.datetime, str, str]]:
+    random.seed(0)
+    start = datetime.datetime(2024, 1, 1)
+    result = []
+    for minute in range(1440 * num_days):
+        timestamp = start + datetime.timedelta(minutes=minute)
+        for i in range(5):
+            result.append((timestamp, f"AHU-{i}/Supply Temp", f"{random.uniform(50, 60):.2f}"))
+            result.append((timestamp, f"AHU-{i}/Status", "On" if 6 <= timestamp.hour < 20 else "Off"))
+    return result
+
+
+def run(load_rows: list[tuple[datetime.datetime, str, str]], workers: int) -> float:
+    """Returns values loaded per second"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "bench.db")
+        stsd.init(file)
+        start_time = time.perf_counter()
+        num_values = stsd.load(file, load_rows, workers=workers)
+        return num_values / (time.perf_counter() - start_time)
+
+
+def main():
+    num_days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    load_rows = rows(num_days)
+
+    print(f"{len(load_rows)} values, {num_days} days of minute data, {os.cpu_count()} CPUs")
+    print(f"{'Workers':>10} {'Values/s':>12} {'Speedup':>8}")
+    baseline = None
+    for workers in [0] + [2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers]:
+        throughput = run(load_rows, workers)
+        baseline = baseline or throughput
+        print(f"{workers:>10} {throughput:>12.0f} {throughput / baseline:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
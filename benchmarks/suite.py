@@ -0,0 +1,203 @@
+"""
+Runs the ingest, codec, and query benchmarks over the synthetic workloads and writes the results as JSON,
+to keep alongside results from other versions and compare with benchmarks/compare.py.
+
+- ingest: write_data throughput and bytes on disk per value, for each workload
+- codecs: encode and decode throughput in MB/s of the raw values, and compression ratio, for each encoding
+  that fits a workload, plus "auto", the encoding encode_day_values picks
+- queries: read_range latency percentiles for one day and one week of a random trend, on databases of
+  1, 100, and 10,000 trends of 15 minute data. The decoded day cache is cleared before each query, so every
+  query decodes its days from the pages.
+
+Throughput is measured on the raw values joined with the record separator, the same measure as the codec stats.
+A summary is printed to stderr as each benchmark finishes.
+
+Usage: python benchmarks/suite.py [output.json] [--quick]
+"""
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stsd
+from workloads import workloads
+
+start_date = datetime.date(2024, 1, 1)
+
+
+def log(message: str):
+    print(message, file=sys.stderr)
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {"p50": percentile(50), "p90": percentile(90), "p99": percentile(99), "max": ordered[-1]}
+
+
+def day_lists(values: list[tuple[datetime.datetime, str]]) -> list[list[str]]:
+    days: dict[datetime.date, list[str]] = {}
+    for timestamp, value in values:
+        days.setdefault(timestamp.date(), []).append(value)
+    return list(days.values())
+
+
+def raw_size(day_values: list[str]) -> int:
+    return len("\x1E".join(day_values).encode('utf-8'))
+
+
+def bench_ingest(num_trends: int, num_days: int) -> dict:
+    results = {}
+    for workload_name, generate in workloads.items():
+        trend_values = [generate(start_date, num_days, seed) for seed in range(num_trends)]
+        num_values = sum(len(values) for values in trend_values)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "bench.db")
+            stsd.init(file)
+            start_time = time.perf_counter()
+            for i, values in enumerate(trend_values):
+                stsd.write_data(file, f"{workload_name}/{i}", values)
+            elapsed = time.perf_counter() - start_time
+            file_size = os.path.getsize(file)
+
+        results[workload_name] = {
+            "trends": num_trends,
+            "days": num_days,
+            "values": num_values,
+            "values_per_second": num_values / elapsed,
+            "bytes_per_value": file_size / num_values,
+        }
+        log(f"ingest   {workload_name:<26} {num_values / elapsed:>12.0f} values/s {file_size / num_values:>8.2f} bytes/value")
+    return results
+
+
+def encode_with(encoding, day_values: list[str]):
+    if encoding == "auto":
+        return stsd.encode_day_values(day_values)
+    if encoding == stsd.dictionary_encoding_type:
+        return stsd.encode_dictionary_values(day_values)
+    if encoding == stsd.huffman_encoding_type:
+        code_lengths = stsd.huffman_code_lengths(stsd.huffman_symbol_counts(day_values))
+        return stsd.encode_huffman_values(day_values, code_lengths)
+    return stsd.encode_numeric_values(day_values)
+
+
+encoding_names = {
+    stsd.dictionary_encoding_type: "dictionary",
+    stsd.huffman_encoding_type: "huffman",
+    stsd.numeric_encoding_type: "numeric",
+    "auto": "auto",
+}
+
+
+def bench_codecs(num_days: int, repeat: int) -> dict:
+    results = {}
+    for workload_name, generate in workloads.items():
+        days = day_lists(generate(start_date, num_days, 0))
+        raw_bytes = sum(raw_size(day_values) for day_values in days)
+        results[workload_name] = {}
+        for encoding, encoding_name in encoding_names.items():
+            # Numeric encoding only fits plain decimal values
+            if any(encode_with(encoding, day_values) is None for day_values in days):
+                continue
+
+            encode_time = float("inf")
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                encoded_days = [bytes(encode_with(encoding, day_values)) for day_values in days]
+                encode_time = min(encode_time, time.perf_counter() - start_time)
+
+            decode_time = float("inf")
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                decoded_days = [stsd.decode_day_values(encoded)[0] for encoded in encoded_days]
+                decode_time = min(decode_time, time.perf_counter() - start_time)
+            assert decoded_days == days, f"{encoding_name} did not round trip {workload_name}"
+
+            encoded_bytes = sum(len(encoded) for encoded in encoded_days)
+            results[workload_name][encoding_name] = {
+                "raw_bytes": raw_bytes,
+                "encoded_bytes": encoded_bytes,
+                "compression_ratio": raw_bytes / encoded_bytes,
+                "encode_mb_per_second": raw_bytes / encode_time / 1e6,
+                "decode_mb_per_second": raw_bytes / decode_time / 1e6,
+            }
+            log(f"codec    {workload_name:<26} {encoding_name:<10} {raw_bytes / encoded_bytes:>6.2f}x "
+                f"encode {raw_bytes / encode_time / 1e6:>7.2f} MB/s decode {raw_bytes / decode_time / 1e6:>7.2f} MB/s")
+    return results
+
+
+def bench_queries(trend_counts: list[int], num_days: int, num_queries: int) -> dict:
+    results = {}
+    generate = workloads["quarter_hour_analog"]
+    # A handful of distinct series is enough, every trend is still encoded and stored on its own
+    series = [generate(start_date, num_days, seed) for seed in range(10)]
+    for num_trends in trend_counts:
+        trend_names = [f"Building {i // 1000}/AHU-{i // 10 % 100}/Point {i % 10}" for i in range(num_trends)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "bench.db")
+            stsd.init(file)
+            build_start = time.perf_counter()
+            for batch_start in range(0, num_trends, 500):
+                stsd.write_many(file, {name: series[i % len(series)] for i, name in
+                                       enumerate(trend_names[batch_start:batch_start + 500], batch_start)})
+            build_time = time.perf_counter() - build_start
+
+            rng = random.Random(0)
+            result = {"trends": num_trends, "days": num_days, "build_seconds": build_time,
+                      "file_bytes": os.path.getsize(file)}
+            with stsd.use_pager(file, writable=False) as pager:
+                database = stsd.Database(pager)
+                for query_name, query_days in [("one_day", 1), ("one_week", 7)]:
+                    latencies = []
+                    for _ in range(num_queries):
+                        trend_name = rng.choice(trend_names)
+                        first_day = start_date + datetime.timedelta(days=rng.randrange(num_days - query_days + 1))
+                        database.day_cache.clear()
+                        start_time = time.perf_counter()
+                        list(database.read_range(trend_name, first_day, first_day + datetime.timedelta(days=query_days - 1)))
+                        latencies.append((time.perf_counter() - start_time) * 1000)
+                    result[query_name + "_ms"] = percentiles(latencies)
+                    log(f"query    {num_trends:>6} trends {query_name:<9} " +
+                        " ".join(f"{name} {value:.3f} ms" for name, value in result[query_name + "_ms"].items()))
+        results[str(num_trends)] = result
+    return results
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--quick"]
+    quick = "--quick" in sys.argv[1:]
+    output_path = args[0] if args else None
+
+    results = {
+        "stsd_version": stsd.current_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "quick": quick,
+        "ingest": bench_ingest(num_trends=2 if quick else 10, num_days=2 if quick else 7),
+        "codecs": bench_codecs(num_days=2 if quick else 7, repeat=1 if quick else 3),
+        "queries": bench_queries([1, 100] if quick else [1, 100, 10000], num_days=7, num_queries=20 if quick else 200),
+    }
+
+    if output_path is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output_path, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+            output_file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Synthetic trend data for the benchmarks, shaped like what building automation systems log.
+
+Each generator returns one trend's values for num_days days from start, seeded so runs are repeatable.
+"""
+import datetime
+import random
+from typing import Callable
+
+
+def minute_analog(start: datetime.date, num_days: int, seed: int = 0) -> list[tuple[datetime.datetime, str]]:
+    """A temperature sampled every minute, a slow random walk with 2 decimals"""
+    rng = random.Random(seed)
+    first = datetime.datetime(start.year, start.month, start.day)
+    value = rng.uniform(50, 60)
+    values = []
+    for minute in range(1440 * num_days):
+        value = min(max(value + rng.gauss(0, 0.05), 40), 70)
+        values.append((first + datetime.timedelta(minutes=minute), f"{value:.2f}"))
+    return values
+
+
+def quarter_hour_analog(start: datetime.date, num_days: int, seed: int = 0) -> list[tuple[datetime.datetime, str]]:
+    """A demand meter read every 15 minutes, higher during occupied hours"""
+    rng = random.Random(seed)
+    first = datetime.datetime(start.year, start.month, start.day)
+    values = []
+    for i in range(96 * num_days):
+        timestamp = first + datetime.timedelta(minutes=15 * i)
+        base = 400 if 7 <= timestamp.hour < 19 else 150
+        values.append((timestamp, f"{base + rng.uniform(-25, 25):.1f}"))
+    return values
+
+
+def cov_binary(start: datetime.date, num_days: int, seed: int = 0) -> list[tuple[datetime.datetime, str]]:
+    """An on/off status logged on change of value, a few dozen changes a day at irregular minutes"""
+    rng = random.Random(seed)
+    first = datetime.datetime(start.year, start.month, start.day)
+    values = []
+    for day in range(num_days):
+        minutes = sorted(rng.sample(range(1440), rng.randint(10, 40)))
+        for i, minute in enumerate(minutes):
+            values.append((first + datetime.timedelta(days=day, minutes=minute), "On" if i % 2 == 0 else "Off"))
+    return values
+
+
+def high_cardinality_strings(start: datetime.date, num_days: int, seed: int = 0) -> list[tuple[datetime.datetime, str]]:
+    """
+    An alarm message every 15 minutes, almost every one distinct. Any more often and a day's
+    encoded values would not fit in one page.
+    """
+    rng = random.Random(seed)
+    first = datetime.datetime(start.year, start.month, start.day)
+    values = []
+    for minute in range(0, 1440 * num_days, 15):
+        message = f"VAV-{rng.randint(1, 400):03d} {rng.choice(['High', 'Low'])} Zone Temp Alarm {rng.randint(0, 0xFFFF):04X}"
+        values.append((first + datetime.timedelta(minutes=minute), message))
+    return values
+
+
+workloads: dict[str, Callable[[datetime.date, int, int], list[tuple[datetime.datetime, str]]]] = {
+    "minute_analog": minute_analog,
+    "quarter_hour_analog": quarter_hour_analog,
+    "cov_binary": cov_binary,
+    "high_cardinality_strings": high_cardinality_strings,
+}
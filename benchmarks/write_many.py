@@ -0,0 +1,64 @@
+"""
+Measures ingest throughput of stsd.write_many as the number of trends per batch grows.
+
+Each run writes one day of 15 minute data for every trend, split into batches of the given size.
+A batch size of 1 is the same work as calling write_data once per trend.
+
+Usage: python benchmarks/write_many.py [num_trends]
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stsd
+
+
+def trend_values(day: datetime.date) -> list[tuple[datetime.datetime, str]]:
+    start = datetime.datetime(day.year, day.month, day.day)
+    return [(start + datetime.timedelta(minutes=15 * i), f"{random.uniform(400, 500):.2f}") for i in range(96)]
+
+
+def run(num_trends: int, batch_size: int, num_days: int) -> float:
+    """Returns values written per second"""
+    trend_names = [f"AHU-{i // 10}/Point {i % 10}" for i in range(num_trends)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "bench.db")
+        stsd.init(file)
+
+        elapsed = 0.0
+        num_values = 0
+        for day_offset in range(num_days):
+            day = datetime.date(2024, 1, 1) + datetime.timedelta(days=day_offset)
+            for batch_start in range(0, num_trends, batch_size):
+                batch = {name: trend_values(day) for name in trend_names[batch_start:batch_start + batch_size]}
+                num_values += sum(len(v) for v in batch.values())
+                start_time = time.perf_counter()
+                stsd.write_many(file, batch)
+                elapsed += time.perf_counter() - start_time
+
+    return num_values / elapsed
+
+
+def main():
+    num_trends = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_days = 3
+    random.seed(0)
+
+    print(f"{num_trends} trends, {num_days} days of 15 minute data")
+    print(f"{'Batch size':>10} {'Values/s':>12} {'Speedup':>8}")
+    baseline = None
+    for batch_size in [1, 10, 50, 100, 500]:
+        if batch_size > num_trends:
+            break
+        throughput = run(num_trends, batch_size, num_days)
+        baseline = baseline or throughput
+        print(f"{batch_size:>10} {throughput:>12.0f} {throughput / baseline:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,34 @@
 import math
 import heapq
-from collections import defaultdict, Counter
-from typing import Optional
+import bisect
+import functools
+from collections import defaultdict, Counter, OrderedDict
+from typing import Callable, Iterable, Iterator, Optional
 import sys
 import mputils
 import datetime
 import os
+import mmap
+import contextlib
+import csv
+import itertools
+import fnmatch
+import re
+import array
+import threading
+import time
+import zlib
+import struct
+import concurrent.futures
+import asyncio
+import json
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks, like on Windows. Only one writer may have the file open.
+    fcntl = None
 
-huffman_bytes_for_bytes = 2
 version_size_bytes = 2
 page_size_size_bytes = 2
 init_year_size_bytes = 2
@@ -15,19 +36,135 @@ num_day_entries_pages_size_bytes = 4
 num_trends_pages_size_bytes = 4
 num_index_pages_size_bytes = 4
 num_data_pages_size_bytes = 4
+page_pointer_size_bytes = 4
 
 page_size = 4096
+current_version = 7
+
+# Positions of the configuration page fields
+version_pos = 0
+page_size_pos = 2
+init_year_pos = 4
+num_day_entries_pages_pos = 6
+num_trends_pages_pos = 10
+num_index_pages_pos = 14
+num_data_pages_pos = 18
+first_day_entries_page_pos = 22
+first_trends_page_pos = 26
+first_index_page_pos = 30
+last_day_entries_page_pos = 34
+last_trends_page_pos = 38
+last_index_page_pos = 42
+free_list_head_pos = 46
+num_free_pages_pos = 50
+generation_pos = 54
+num_rollup_index_pages_pos = 58
+first_rollup_index_page_pos = 62
+last_rollup_index_page_pos = 66
+num_rollup_pages_pos = 70
 
 trend_name_size_bytes = 124  # Bytes
 trend_id_size_bytes = 4  # Bytes
+day_id_size_bytes = 2  # Bytes, days since the database's initial year
+day_entry_size_bytes = 181  # Bytes, 1 byte flag + 180 byte minute bit string
+index_record_size_bytes = 12  # Bytes
+data_page_header_size_bytes = 4  # Bytes, 2 byte end of the day values + 2 byte number of days
+day_slot_size_bytes = 8  # Bytes, 2 byte day id + 2 byte day type id + 2 byte position + 2 byte length
+day_type_cache_size = 256  # Day types with expanded minute offsets kept in memory
+day_cache_size_bytes = 64 * 1024 * 1024  # Default memory budget for decoded days
+wal_suffix = '-wal'  # The write ahead log is the database path with this appended
+wal_max_age_seconds = 15 * 60  # Logged days older than this are checkpointed even if not finished
+epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+snapshot_attempts = 3  # Lock free tries at a consistent read before taking the shared lock
+parallel_chunk_values = 20000  # Values, of whole trends, sent to a worker process at a time when writing in parallel
+server_port = 7471  # Default TCP port of the server
+server_line_limit = 64 * 1024 * 1024  # Longest request or response line, in bytes
 
 
 class DataIndex:
-    def __init__(self, trend_id: int, page_index: int, start_day: int, end_day: int) -> None:
+    def __init__(self, trend_id: int, page_index: int, start_day: int, end_day: int, record_index: int = -1) -> None:
         self.trend_id = trend_id
         self.page_index = page_index
         self.start_day = start_day
         self.end_day = end_day
+        # Position of the record in the index pages
+        self.record_index = record_index
+
+class TrendIntervals:
+    """
+    Index records of one trend, sorted by start day for bisect lookups.
+
+    Day ranges of a trend's records are normally disjoint, but can overlap after a merged day is
+    moved to a new page. The longest span of any record bounds how far back a lookup has to walk.
+    """
+    def __init__(self) -> None:
+        self.starts: list[tuple[int, int]] = []  # (start day, record index), kept sorted
+        self.records: list[DataIndex] = []  # In the same order as starts
+        self.max_span = 0
+
+    def add(self, index: DataIndex):
+        key = (index.start_day, index.record_index)
+        position = bisect.bisect_left(self.starts, key)
+        self.starts.insert(position, key)
+        self.records.insert(position, index)
+        self.max_span = max(self.max_span, index.end_day - index.start_day)
+
+    def extend(self, index: DataIndex, day_id: int):
+        """Widens a record's day range to include day_id"""
+        if day_id < index.start_day:
+            position = bisect.bisect_left(self.starts, (index.start_day, index.record_index))
+            del self.starts[position]
+            del self.records[position]
+            index.start_day = day_id
+            self.add(index)
+        index.end_day = max(index.end_day, day_id)
+        self.max_span = max(self.max_span, index.end_day - index.start_day)
+
+    def overlapping(self, start_day: int, end_day: int) -> list[DataIndex]:
+        """Records with any day in [start_day, end_day], ordered by start day"""
+        position = bisect.bisect_right(self.starts, (end_day, math.inf))
+        found = []
+        while position > 0 and self.starts[position - 1][0] >= start_day - self.max_span:
+            position -= 1
+            if self.records[position].end_day >= start_day:
+                found.append(self.records[position])
+        found.reverse()
+        return found
+
+    def containing(self, day_id: int) -> list[DataIndex]:
+        return self.overlapping(day_id, day_id)
+
+    def latest_before(self, day_id: int) -> Optional[DataIndex]:
+        """The record with the latest end day before day_id"""
+        position = bisect.bisect_left(self.starts, (day_id, -1))
+        latest: Optional[DataIndex] = None
+        while position > 0:
+            position -= 1
+            # No earlier record can end later than this start plus the longest span
+            if latest is not None and self.starts[position][0] + self.max_span <= latest.end_day:
+                break
+            index = self.records[position]
+            if index.end_day < day_id and (latest is None or index.end_day > latest.end_day):
+                latest = index
+        return latest
+
+
+class IntervalIndex:
+    """All index records in record order, with a TrendIntervals per trend kept up to date as records are added"""
+    def __init__(self, records: list[DataIndex]) -> None:
+        self.records: list[DataIndex] = []
+        self.by_trend: dict[int, TrendIntervals] = defaultdict(TrendIntervals)
+        for index in records:
+            self.add(index)
+
+    def add(self, index: DataIndex):
+        index.record_index = len(self.records)
+        self.records.append(index)
+        self.by_trend[index.trend_id].add(index)
+
+    def trend(self, trend_id: int) -> TrendIntervals:
+        return self.by_trend[trend_id]
+
 
 
 def init(filepath):
@@ -40,8 +177,17 @@ def init(filepath):
         # 4. 4 byte: number of day entries pages (6 - 10)
         # 5. 4 byte: number of trends pages (10 - 14)
         # 6. 4 byte: number of Index pages (14 - 18)
-        # 6. 4 byte: number of Data pages (18 - 22)
-        version = 1
+        # 7. 4 byte: number of Data pages (18 - 22)
+        # 8. 4 byte each: first day entries, trends, Index page (22 - 34)
+        # 9. 4 byte each: last day entries, trends, Index page (34 - 46)
+        # 10. 4 byte: first page of the free list (46 - 50)
+        # 11. 4 byte: number of free pages (50 - 54)
+        # 12. 4 byte: generation, odd while a write is in progress (54 - 58)
+        # 13. 4 byte: number of rollup index pages (58 - 62)
+        # 14. 4 byte each: first, last rollup index page (62 - 70)
+        # 15. 4 byte: number of rollup pages (70 - 74)
+        # Page index 0 is this page, so 0 marks an empty chain or free list.
+        version = current_version
         initial_year = 2000
         num_day_entries_pages = 0
         num_trends_pages = 0
@@ -57,6 +203,11 @@ def init(filepath):
             (num_index_pages, num_index_pages_size_bytes),
             (num_data_pages, num_data_pages_size_bytes),
         ]
+        # Chain ends and the free list all start empty
+        to_write.extend([(0, page_pointer_size_bytes)] * 8)
+        to_write.append((0, 4))
+        # No rollup index pages or rollup pages
+        to_write.extend([(0, 4)] * 4)
 
         for value, num_bytes in to_write:
             file.write(value.to_bytes(num_bytes, 'big'))
@@ -65,52 +216,339 @@ def init(filepath):
         file.write(b'\x00' * (page_size - sum([x[1] for x in to_write])))
 
 
-def write_int(filepath, value: int, pos: int, num_bytes: int):
-    with open(filepath, 'rb+') as file:
-        file.seek(pos)
-        file.write(value.to_bytes(num_bytes, 'big'))
-
-
-def update_num_trend_pages(filepath, num_trends: int):
-    write_int(filepath, num_trends, 10, 4)
-
-
-def update_num_index_pages(filepath, num_indexes: int):
-    write_int(filepath, num_indexes, 14, 4)
+class Stats:
+    """
+    Counters and timers for this process, shared by every open database: page I/O, metadata loads, encoding and
+    decoding by encoding, day cache hits, and reads run again after racing a writer. Counting is an attribute
+    increment, and timers are only around work that takes far longer than reading the clock.
 
+    Days trial encoded in worker processes during parallel loads are counted in those processes, not here.
 
-def update_num_data_pages(filepath, num_data: int):
-    write_int(filepath, num_data, 18, 4)
+    callback, if set, is called with (event, seconds) as each "write" batch, metadata "load", and "compact" finishes.
+    """
+    def __init__(self) -> None:
+        self.callback: Optional[Callable[[str, float], None]] = None
+        self.reset()
+
+    def reset(self):
+        self.pages_read = 0  # Page views handed out by pagers
+        self.pages_written = 0  # Whole pages written by write batches and compactions
+        self.pages_grown = 0  # Pages appended to the end of files
+        self.pages_reused = 0  # Pages taken off free lists
+        self.bytes_moved = 0  # Bytes of later days shifted down in their page when a day is removed to be rewritten
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.syncs = 0
+        self.sync_seconds = 0.0
+        self.metadata_loads = 0
+        self.metadata_seconds = 0.0
+        self.read_retries = 0  # Reads run again after racing a writer or a compaction
+        self.locked_reads = 0  # Reads that stopped retrying and took the shared lock
+        self.day_cache_hits = 0
+        self.day_cache_misses = 0
+        # By encoding: days it won, with their UTF-8 value bytes (separators included) and encoded bytes, and the
+        # time spent trying it, whether it won or not
+        self.encoded_days: Counter[int] = Counter()
+        self.encode_value_bytes: Counter[int] = Counter()
+        self.encoded_bytes: Counter[int] = Counter()
+        self.encode_seconds: Counter[int] = Counter()
+        # By encoding: days decoded, their encoded bytes, and the time spent
+        self.decoded_days: Counter[int] = Counter()
+        self.decoded_bytes: Counter[int] = Counter()
+        self.decode_seconds: Counter[int] = Counter()
+
+    def event(self, name: str, seconds: float):
+        if self.callback is not None:
+            self.callback(name, seconds)
+
+    def as_dict(self) -> dict:
+        """The counters, with per encoding counters keyed by encoding name"""
+        return {name: {encoding_names[encoding]: count for encoding, count in sorted(value.items())} if isinstance(value, Counter) else value
+                for name, value in vars(self).items() if name != "callback"}
+
+
+stats = Stats()
+
+
+class Pager:
+    """
+    Holds a database file open and memory maps it.
 
+    Pages are handed out as zero-copy memoryview slices of the mapping, so reading a page is plain
+    memory access instead of an open/seek/read. Views handed out before a grow() keep pointing at the
+    old mapping, which stays valid for the pages it covered.
+    """
+    def __init__(self, filepath, writable: bool = True) -> None:
+        self.filepath = filepath
+        self.writable = writable
+        self.file = open(filepath, 'rb+' if writable else 'rb')
+        self.lock_depth = 0
+        self.remap()
+        self.page_size = self.read_int(page_size_pos, page_size_size_bytes)
+
+    def __enter__(self) -> 'Pager':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def lock(self, operation: int):
+        """Takes a lock on the file, moving to the new file first if a compaction replaced it while waiting"""
+        while True:
+            fcntl.flock(self.file.fileno(), operation)
+            if not self.replaced():
+                return
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.reopen()
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        """Holds an exclusive advisory lock on the file, so one connection at a time writes to it. Reentrant."""
+        if fcntl is not None and self.lock_depth == 0:
+            self.lock(fcntl.LOCK_EX)
+        self.lock_depth += 1
+        try:
+            yield
+        finally:
+            self.lock_depth -= 1
+            if fcntl is not None and self.lock_depth == 0:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def read_lock(self):
+        """Holds a shared advisory lock on the file, keeping writers out while held"""
+        if fcntl is not None and self.lock_depth == 0:
+            self.lock(fcntl.LOCK_SH)
+        self.lock_depth += 1
+        try:
+            yield
+        finally:
+            self.lock_depth -= 1
+            if fcntl is not None and self.lock_depth == 0:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def writer_active(self) -> bool:
+        """Whether another connection holds the write lock"""
+        if fcntl is None or self.lock_depth > 0:
+            return False
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        return False
+
+    def remap(self) -> None:
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=access)
+        self.view = memoryview(self.mm)
+
+    def replaced(self) -> bool:
+        """Whether the file at filepath is no longer the one held open, after a compaction"""
+        try:
+            path_stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return False
+        file_stat = os.fstat(self.file.fileno())
+        return (path_stat.st_ino, path_stat.st_dev) != (file_stat.st_ino, file_stat.st_dev)
+
+    def reopen(self, file=None) -> None:
+        """Switches to file, or else the file now at filepath. Views of the old mapping stay valid until dropped."""
+        old_file = self.file
+        self.file = file if file is not None else open(self.filepath, 'rb+' if self.writable else 'rb')
+        self.release_mapping()
+        old_file.close()
+        self.remap()
+
+    def check_file(self) -> None:
+        """Catches up with a compaction replacing the file, or another writer growing it"""
+        if self.replaced():
+            self.reopen()
+        elif os.fstat(self.file.fileno()).st_size != self.size:
+            self.remap()
+
+    @property
+    def size(self) -> int:
+        return len(self.mm)
+
+    @property
+    def num_pages(self) -> int:
+        return self.size // self.page_size
+
+    def page(self, page_index: int) -> memoryview:
+        stats.pages_read += 1
+        start = page_index * self.page_size
+        return self.view[start:start + self.page_size]
+
+    def pages(self, first_page_index: int, num_pages: int) -> list[memoryview]:
+        return [self.page(first_page_index + i) for i in range(num_pages)]
+
+    def read_int(self, pos: int, num_bytes: int) -> int:
+        return int.from_bytes(self.view[pos:pos + num_bytes], 'big')
+
+    def write_int(self, value: int, pos: int, num_bytes: int) -> None:
+        self.view[pos:pos + num_bytes] = value.to_bytes(num_bytes, 'big')
+
+    def write(self, pos: int, data) -> None:
+        self.view[pos:pos + len(data)] = data
+
+    def grow(self, num_pages: int) -> int:
+        """Appends num_pages zeroed pages to the end of the file and remaps it.
+        Returns the index of the first new page.
+        """
+        first_new_page = self.num_pages
+        stats.pages_grown += num_pages
+        self.mm.flush()
+        self.file.truncate((first_new_page + num_pages) * self.page_size)
+        # The old mapping is left to be collected once no page views reference it.
+        self.view.release()
+        self.remap()
+        return first_new_page
+
+    def flush(self) -> None:
+        if self.writable:
+            self.mm.flush()
+
+    def sync(self) -> None:
+        """Flushes the mapping and fsyncs the file, so the file size is durable too"""
+        if self.writable:
+            started = time.perf_counter()
+            self.mm.flush()
+            os.fsync(self.file.fileno())
+            stats.syncs += 1
+            stats.sync_seconds += time.perf_counter() - started
+
+    def release_mapping(self) -> None:
+        self.view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            # A caller still holds a page view, the mapping is released when it is dropped.
+            pass
+
+    def close(self) -> None:
+        self.flush()
+        self.release_mapping()
+        self.file.close()
+
+
+@contextlib.contextmanager
+def use_pager(db, writable: bool = True):
+    """Yields db if it is already an open Pager, otherwise opens (and afterward closes) a Pager for the file path"""
+    if isinstance(db, Pager):
+        yield db
+    else:
+        with Pager(db, writable) as pager:
+            yield pager
 
-def insert_blank_pages(filepath, page_index: int, num_pages: int):
-    # Write to temp file, then do os.rename
-    temp_filepath = filepath + ".tmp"
 
-    with open(temp_filepath, 'xb') as temp_file:
-        with open(filepath, 'rb') as file:
-            # Copy the first page_index pages
-            temp_file.write(file.read(page_index * page_size))
-            # Write the new pages
-            temp_file.write(b'\x00' * (page_size * num_pages))
-            # Copy the rest of the file
-            temp_file.write(file.read())
+def write_int(db, value: int, pos: int, num_bytes: int):
+    with use_pager(db) as pager:
+        pager.write_int(value, pos, num_bytes)
 
-    os.replace(temp_filepath, filepath)
 
+def check_version(pager: Pager):
+    version = pager.read_int(version_pos, version_size_bytes)
+    if version != current_version:
+        raise ValueError(f"Unsupported database version {version}, expected {current_version}")
 
-def print_summary(filepath):
-    with open(filepath, 'rb') as file:
-        configurations = file.read(18)
 
-    page_size = int.from_bytes(configurations[2:4], 'big')
-    init_year = int.from_bytes(configurations[4:6], 'big')
-    num_day_entries_pages = int.from_bytes(configurations[6:10], 'big')
-    num_trends_pages = int.from_bytes(configurations[10:14], 'big')
-    num_index_pages = int.from_bytes(configurations[14:18], 'big')
-    num_data_pages = int.from_bytes(configurations[18:22], 'big')
+class PageChain:
+    """
+    A metadata section (trends, day types, or index records) stored as a linked list of pages.
+    The last 4 bytes of each page hold the index of the next page, 0 ending the chain, so a section
+    grows by linking one more page rather than shifting every page after it.
+    """
+    def __init__(self, count_pos: int, first_pos: int, last_pos: int, record_size: int) -> None:
+        self.count_pos = count_pos
+        self.first_pos = first_pos
+        self.last_pos = last_pos
+        self.record_size = record_size
+
+    def records_per_page(self, page_size: int) -> int:
+        return (page_size - page_pointer_size_bytes) // self.record_size
+
+    def page_indexes(self, pager: Pager) -> list[int]:
+        page_indexes = []
+        page_index = pager.read_int(self.first_pos, page_pointer_size_bytes)
+        while page_index != 0:
+            page_indexes.append(page_index)
+            page_index = pager.read_int((page_index + 1) * pager.page_size - page_pointer_size_bytes, page_pointer_size_bytes)
+        return page_indexes
+
+    def views(self, pager: Pager, page_indexes: list[int]) -> list[memoryview]:
+        """Record area of each page, without the next page pointer"""
+        return [pager.page(page_index)[:pager.page_size - page_pointer_size_bytes] for page_index in page_indexes]
+
+    def append_page(self, pager: Pager, page_indexes: list[int]) -> int:
+        """Links a new page onto the end of the chain, and adds it to page_indexes"""
+        new_page = allocate_page(pager)
+        if page_indexes:
+            last_page = page_indexes[-1]
+            pager.write_int(new_page, (last_page + 1) * pager.page_size - page_pointer_size_bytes, page_pointer_size_bytes)
+        else:
+            pager.write_int(new_page, self.first_pos, page_pointer_size_bytes)
+        pager.write_int(new_page, self.last_pos, page_pointer_size_bytes)
+        pager.write_int(len(page_indexes) + 1, self.count_pos, 4)
+        page_indexes.append(new_page)
+        return new_page
+
+    def record_position(self, pager: Pager, page_indexes: list[int], record_index: int) -> int:
+        """Byte position of a record. Records never straddle a page boundary."""
+        records_per_page = self.records_per_page(pager.page_size)
+        page_index = page_indexes[record_index // records_per_page]
+        return page_index * pager.page_size + (record_index % records_per_page) * self.record_size
+
+    def reserve(self, pager: Pager, page_indexes: list[int], num_records: int):
+        """Appends pages until the chain can hold num_records records"""
+        while num_records > self.records_per_page(pager.page_size) * len(page_indexes):
+            self.append_page(pager, page_indexes)
+
+
+day_entries_chain = PageChain(num_day_entries_pages_pos, first_day_entries_page_pos, last_day_entries_page_pos, day_entry_size_bytes)
+trends_chain = PageChain(num_trends_pages_pos, first_trends_page_pos, last_trends_page_pos, trend_id_size_bytes + trend_name_size_bytes)
+index_chain = PageChain(num_index_pages_pos, first_index_page_pos, last_index_page_pos, index_record_size_bytes)
+# Rollup index records point to rollup pages, in the same format as data index records
+rollup_index_chain = PageChain(num_rollup_index_pages_pos, first_rollup_index_page_pos, last_rollup_index_page_pos, index_record_size_bytes)
+
+
+def allocate_page(pager: Pager) -> int:
+    """Returns the index of a zeroed page, popped from the free list, or appended to the file if the list is empty"""
+    free_head = pager.read_int(free_list_head_pos, page_pointer_size_bytes)
+    if free_head == 0:
+        return pager.grow(1)
+
+    # A free page stores the next free page in its first 4 bytes
+    stats.pages_reused += 1
+    page_pos = free_head * pager.page_size
+    pager.write_int(pager.read_int(page_pos, page_pointer_size_bytes), free_list_head_pos, page_pointer_size_bytes)
+    pager.write_int(pager.read_int(num_free_pages_pos, 4) - 1, num_free_pages_pos, 4)
+    pager.write(page_pos, bytes(pager.page_size))
+    return free_head
+
+
+def free_page(pager: Pager, page_index: int):
+    """Pushes a page onto the free list"""
+    page_pos = page_index * pager.page_size
+    pager.write(page_pos, bytes(pager.page_size))
+    pager.write_int(pager.read_int(free_list_head_pos, page_pointer_size_bytes), page_pos, page_pointer_size_bytes)
+    pager.write_int(page_index, free_list_head_pos, page_pointer_size_bytes)
+    pager.write_int(pager.read_int(num_free_pages_pos, 4) + 1, num_free_pages_pos, 4)
+
+
+def print_summary(db):
+    with use_pager(db, writable=False) as pager:
+        page_size = pager.page_size
+        init_year = pager.read_int(init_year_pos, 2)
+        num_day_entries_pages = pager.read_int(num_day_entries_pages_pos, 4)
+        num_trends_pages = pager.read_int(num_trends_pages_pos, 4)
+        num_index_pages = pager.read_int(num_index_pages_pos, 4)
+        num_data_pages = pager.read_int(num_data_pages_pos, 4)
+        num_rollup_index_pages = pager.read_int(num_rollup_index_pages_pos, 4)
+        num_rollup_pages = pager.read_int(num_rollup_pages_pos, 4)
+        num_free_pages = pager.read_int(num_free_pages_pos, 4)
+        file_size = pager.size
 
-    file_size = os.path.getsize(filepath)
     total_num_pages = file_size // page_size
     print(f"Page size: {page_size} bytes")
     print(f"Initial year: {init_year}")
@@ -118,205 +556,1954 @@ def print_summary(filepath):
     print(f"Number of trends pages: {num_trends_pages}")
     print(f"Number of index pages: {num_index_pages}")
     print(f"Number of data pages: {num_data_pages}")
+    print(f"Number of rollup index pages: {num_rollup_index_pages}")
+    print(f"Number of rollup pages: {num_rollup_pages}")
+    print(f"Number of free pages: {num_free_pages}")
     print(f"Total number of pages: {total_num_pages}")
     print(f"Total size: {file_size} bytes")
 
 
-def write_data(filepath, trend_name: str, values: list[tuple[datetime.datetime, str]]):
-    # Read first 4096 bytes to get the configuration
-    with open(filepath, 'rb+') as file:
-        configurations = file.read(18)
+def print_stats(db, decode: bool = False):
+    """
+    Prints how full and fragmented the pages are, then this process's counters, which include opening the
+    database. With decode, every stored day is decoded first, timing each encoding on this database's data.
+    """
+    with use_database(db, writable=False) as database:
+        storage = database.storage_stats()
+        if decode:
+            with database.pager.read_lock():
+                for page_index in {index.page_index for index in database.indexes}:
+                    page = database.pager.page(page_index)
+                    for _, _, start, _ in iter_page_days(page):
+                        decode_day_values(page, start)
+
+    print(f"Total number of pages: {storage.total_pages}")
+    print(f"Data pages: {storage.data_pages}, {storage.data_fill:.1%} full")
+    print(f"Rollup pages: {storage.rollup_pages}, {storage.rollup_fill:.1%} full")
+    print(f"Metadata pages: {storage.metadata_pages}")
+    print(f"Free pages: {storage.free_pages}")
+    print(f"Days stored: {storage.days}")
+    print(f"Fragmentation: {storage.fragmentation:.1%}")
+    print()
+    print(f"Pages read: {stats.pages_read}")
+    print(f"Pages written: {stats.pages_written}")
+    print(f"Pages grown: {stats.pages_grown}")
+    print(f"Pages reused: {stats.pages_reused}")
+    print(f"Bytes moved: {stats.bytes_moved}")
+    print(f"Writes: {stats.writes} ({stats.write_seconds:.3f} s)")
+    print(f"Syncs: {stats.syncs} ({stats.sync_seconds:.3f} s)")
+    print(f"Metadata loads: {stats.metadata_loads} ({stats.metadata_seconds:.3f} s)")
+    print(f"Read retries: {stats.read_retries}")
+    print(f"Locked reads: {stats.locked_reads}")
+    print(f"Day cache hits: {stats.day_cache_hits}, misses: {stats.day_cache_misses}")
+    for encoding in all_encodings:
+        name = encoding_names[encoding]
+        if stats.encoded_days[encoding] or stats.encode_seconds[encoding]:
+            print(f"Encoded {name}: {stats.encoded_days[encoding]} days, {stats.encode_value_bytes[encoding]} to "
+                  f"{stats.encoded_bytes[encoding]} bytes ({stats.encode_seconds[encoding]:.3f} s)")
+        if stats.decoded_days[encoding]:
+            print(f"Decoded {name}: {stats.decoded_days[encoding]} days, {stats.decoded_bytes[encoding]} bytes "
+                  f"({stats.decode_seconds[encoding]:.3f} s)")
+
+
+def storage_stats(db) -> 'StorageStats':
+    with use_database(db, writable=False) as database:
+        return database.storage_stats()
+
+
+def encode_index_record(index: DataIndex) -> bytes:
+    return (index.trend_id.to_bytes(4, 'big') + index.page_index.to_bytes(4, 'big') +
+            index.start_day.to_bytes(2, 'big') + index.end_day.to_bytes(2, 'big'))
+
+
+def write_index_record(pager: Pager, index_pages: list[int], record_index: int, index: DataIndex, chain: PageChain = index_chain):
+    pager.write(chain.record_position(pager, index_pages, record_index), encode_index_record(index))
+
+
+class TrendCatalog:
+    """
+    Trend names and ids, loaded once from the trend pages and kept in sync as trends are added.
+    Names are also kept sorted, so prefix and glob listings only look at names sharing the pattern's
+    literal prefix.
+    """
+    def __init__(self, trends: dict[str, int]) -> None:
+        self.ids: dict[str, int] = {}
+        self.names: dict[int, str] = {}
+        self.sorted_names: list[str] = []
+        self.max_id = 0
+        for trend_name, trend_id in trends.items():
+            self.add(trend_name, trend_id)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, trend_name: str) -> bool:
+        return trend_name in self.ids
+
+    def add(self, trend_name: str, trend_id: int):
+        self.ids[trend_name] = trend_id
+        self.names[trend_id] = trend_name
+        bisect.insort(self.sorted_names, trend_name)
+        self.max_id = max(self.max_id, trend_id)
+
+    def id(self, trend_name: str) -> int:
+        if trend_name not in self.ids:
+            raise KeyError(f"Unknown trend '{trend_name}'")
+        return self.ids[trend_name]
+
+    def name(self, trend_id: int) -> str:
+        return self.names[trend_id]
+
+    def list(self, pattern: Optional[str] = None) -> list[str]:
+        """Sorted trend names, optionally filtered by a glob pattern like 'AHU-1/*'"""
+        if pattern is None:
+            return list(self.sorted_names)
+
+        wildcard_pos = min((pattern.find(c) for c in '*?[' if c in pattern), default=len(pattern))
+        prefix = pattern[:wildcard_pos]
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        matches = []
+        for trend_name in itertools.islice(self.sorted_names, start, None):
+            if not trend_name.startswith(prefix):
+                break
+            if fnmatch.fnmatchcase(trend_name, pattern):
+                matches.append(trend_name)
+        return matches
+
+
+class DayTypeRegistry:
+    """
+    Day types keyed by their 180 byte minute bitmap, so matching a day's schedule is one hash lookup.
+    The day type pages are only read on first use. New day types get their ids in memory, and are appended
+    to the pages by write_new. Ids are shared by every trend.
+    """
+    def __init__(self, pager: Pager, page_indexes: list[int]) -> None:
+        self.pager = pager
+        self.page_indexes = page_indexes
+        self.ids: Optional[dict[bytes, int]] = None
+        self.bitmaps: list[bytes] = []
+        # Ids of day types not yet written to the pages
+        self.unwritten: list[int] = []
+
+    def load(self) -> dict[bytes, int]:
+        if self.ids is None:
+            self.bitmaps = read_day_entry_pages(day_entries_chain.views(self.pager, self.page_indexes))
+            self.ids = {bitmap: day_type_id for day_type_id, bitmap in enumerate(self.bitmaps)}
+        return self.ids
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+    def id(self, bitmap: bytes) -> Optional[int]:
+        return self.load().get(bitmap)
+
+    def bitmap(self, day_type_id: int) -> bytes:
+        self.load()
+        return self.bitmaps[day_type_id]
+
+    def get_or_add(self, bitmap: bytes) -> int:
+        ids = self.load()
+        day_type_id = ids.get(bitmap)
+        if day_type_id is None:
+            day_type_id = len(self.bitmaps)
+            self.bitmaps.append(bitmap)
+            ids[bitmap] = day_type_id
+            self.unwritten.append(day_type_id)
+        return day_type_id
+
+    def write_new(self):
+        """Appends the day types added since the last call to the pages"""
+        if self.unwritten:
+            day_entries_chain.reserve(self.pager, self.page_indexes, len(self.bitmaps))
+        for day_type_id in self.unwritten:
+            pos = day_entries_chain.record_position(self.pager, self.page_indexes, day_type_id)
+            self.pager.write_int(1, pos, 1)
+            self.pager.write(pos + 1, self.bitmaps[day_type_id])
+        self.unwritten = []
+
+
+class LRUCache:
+    """
+    A dict that drops the least recently used entries when it grows past max_size. With size_of, max_size
+    is a budget for the total size of the values rather than a count of them.
+    """
+    def __init__(self, max_size: int, size_of=None) -> None:
+        self.max_size = max_size
+        self.size_of = size_of
+        self.entries: OrderedDict = OrderedDict()
+        self.sizes: dict = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.pop(key)
+        size = self.size_of(value) if self.size_of is not None else 1
+        if size > self.max_size:
+            return
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.size += size
+        while self.size > self.max_size:
+            evicted_key, _ = self.entries.popitem(last=False)
+            self.size -= self.sizes.pop(evicted_key)
+
+    def pop(self, key):
+        if key in self.entries:
+            del self.entries[key]
+            self.size -= self.sizes.pop(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SnapshotChanged(Exception):
+    """
+    A writer committed while a range was being read lazily, so the days still to come would be from a
+    different generation to those already yielded. Read the range again, or use read_range_list.
+    """
+
+
+class Database:
+    """
+    An open database with its metadata (trends, day types, and index records) parsed once.
+    Holding one open lets a long-running process skip the metadata parse on every write.
+    """
+    def __init__(self, pager: Pager, day_cache_bytes: int = day_cache_size_bytes) -> None:
+        check_version(pager)
+        self.pager = pager
+        self.init_year = pager.read_int(init_year_pos, 2)
+        self.init_nd_date = mputils.fixed_from_gregorian(self.init_year, 1, 1)
+        # Encodings chosen by trend id, kept across writes so losing encodings can be skipped
+        self.codec_stats: defaultdict[int, CodecStats] = defaultdict(CodecStats)
+        # Expanded day types, keyed by bitmap rather than id since compaction renumbers day types. A bitmap
+        # always expands the same way, so these are kept across reloads.
+        self.day_offsets_cache = LRUCache(day_type_cache_size)
+        self.day_offset_seconds_cache = LRUCache(day_type_cache_size)
+        # Decoded (day type id, values) by (trend id, day id)
+        self.day_cache = LRUCache(day_cache_bytes, decoded_day_size)
+        # Recent values not yet checkpointed into the pages, merged into reads when open
+        self.wal: Optional[WriteAheadLog] = None
+        self.wal_lock = threading.Lock()
+        self.metadata_file = pager.file
+        self.load()
+
+    def load(self):
+        started = time.perf_counter()
+        # Another writer may have changed any day
+        self.day_cache.clear()
+        _, self.generation = self.read_committed(self.load_metadata)
+        # The file the metadata was read from, a compaction may replace it
+        self.metadata_file = self.pager.file
+        seconds = time.perf_counter() - started
+        stats.metadata_loads += 1
+        stats.metadata_seconds += seconds
+        stats.event("load", seconds)
+
+    def load_metadata(self):
+        pager = self.pager
+        self.trend_pages = trends_chain.page_indexes(pager)
+        self.day_entry_pages = day_entries_chain.page_indexes(pager)
+        self.index_pages = index_chain.page_indexes(pager)
+
+        self.catalog = TrendCatalog(read_trend_pages(trends_chain.views(pager, self.trend_pages)))
+
+        self.day_types = DayTypeRegistry(pager, self.day_entry_pages)
+
+        self.index = IntervalIndex(read_index_page(index_chain.views(pager, self.index_pages)))
+        self.indexes: list[DataIndex] = self.index.records
+
+        self.rollup_index_pages = rollup_index_chain.page_indexes(pager)
+        self.rollup_index = IntervalIndex(read_index_page(rollup_index_chain.views(pager, self.rollup_index_pages)))
+
+    def refresh(self):
+        """Reloads the metadata if another writer has committed since it was loaded"""
+        self.pager.check_file()
+        if self.pager.read_int(generation_pos, 4) != self.generation or self.pager.file is not self.metadata_file:
+            self.load()
+        if self.wal is not None:
+            self.wal.refresh()
+
+    def read_committed(self, read):
+        """
+        Returns (read(), generation) with read() run against one committed generation of the file.
+        Writers make the generation odd while they write in place, and even again once done, so a read
+        that starts and ends on the same even generation saw no writes. Otherwise it is run again.
+        An odd generation with no writer holding the lock is left from a crashed writer, and is read as is.
+        After a few retries, the read is done holding the shared lock, so busy writers can't starve it.
+        """
+        delay = 0.001
+        attempts = 0
+        while True:
+            self.pager.check_file()
+            attempts += 1
+            if attempts > snapshot_attempts:
+                stats.locked_reads += 1
+                with self.pager.read_lock():
+                    self.pager.check_file()
+                    try:
+                        return read(), self.pager.read_int(generation_pos, 4)
+                    except Exception:
+                        # Metadata from a file since replaced fails on the new one, the caller reloads it
+                        if self.pager.file is self.metadata_file:
+                            raise
+                        return None, self.pager.read_int(generation_pos, 4)
+
+            generation = self.pager.read_int(generation_pos, 4)
+            if generation % 2 == 1 and self.pager.writer_active():
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                continue
+
+            try:
+                result = read()
+            except Exception:
+                # A torn read can fail in any number of ways, only a failure on an unchanged file is real
+                if self.pager.read_int(generation_pos, 4) == generation and self.pager.file is self.metadata_file:
+                    raise
+                stats.read_retries += 1
+                continue
+            if self.pager.read_int(generation_pos, 4) == generation:
+                return result, generation
+            stats.read_retries += 1
+
+    def snapshot(self, read):
+        """Returns read() run against the metadata and pages of one committed generation, reloading the metadata as needed"""
+        return self.snapshot_generation(read)[0]
+
+    def snapshot_generation(self, read):
+        """snapshot, also returning the generation read"""
+        for _ in range(snapshot_attempts):
+            self.pager.check_file()
+            if self.pager.read_int(generation_pos, 4) != self.generation or self.pager.file is not self.metadata_file:
+                self.load()
+            result, generation = self.read_committed(read)
+            if generation == self.generation and self.pager.file is self.metadata_file:
+                return result, generation
+
+        # Writers keep moving the generation on, keep them out for this read
+        with self.pager.read_lock():
+            if self.pager.read_int(generation_pos, 4) != self.generation or self.pager.file is not self.metadata_file:
+                self.load()
+            return self.read_committed(read)
+
+    def open_wal(self, writable: bool = False) -> 'WriteAheadLog':
+        """Opens the log next to the database file, for reads merged with the pages, or creating it for writing"""
+        with self.wal_lock:
+            if self.wal is None or (writable and not self.wal.writable):
+                if self.wal is not None:
+                    self.wal.close()
+                self.wal = WriteAheadLog(wal_path(self.pager.filepath), writable)
+            return self.wal
+
+    def append(self, trend_values: dict[str, list[tuple[datetime.datetime, str]]]):
+        """Appends values to the write ahead log, to be checkpointed into the pages later"""
+        self.open_wal(writable=True).append(trend_values)
+
+    def checkpoint(self, max_age: float = wal_max_age_seconds, force: bool = False) -> int:
+        return self.open_wal(writable=True).checkpoint(self, max_age, force)
+
+    def day_id(self, day: datetime.date) -> int:
+        # toordinal, Jan 1, Year 1, is 1.
+        return day.toordinal() - self.init_nd_date + 1
+
+    def date(self, day_id: int) -> datetime.date:
+        return datetime.date.fromordinal(day_id + self.init_nd_date - 1)
+
+    def day_offsets(self, day_type_id: int) -> list[datetime.timedelta]:
+        """Offsets from the start of the day of each minute in a day type"""
+        bitmap = self.day_types.bitmap(day_type_id)
+        offsets = self.day_offsets_cache.get(bitmap)
+        if offsets is None:
+            offsets = [datetime.timedelta(minutes=minute) for minute in day_entry_minutes(bitmap)]
+            self.day_offsets_cache.put(bitmap, offsets)
+        return offsets
+
+    def day_offset_seconds(self, day_type_id: int):
+        """Seconds from the start of the day of each minute in a day type, as a read only NumPy int64 array"""
+        bitmap = self.day_types.bitmap(day_type_id)
+        offsets = self.day_offset_seconds_cache.get(bitmap)
+        if offsets is None:
+            offsets = day_type_minutes(bitmap) * 60
+            offsets.flags.writeable = False
+            self.day_offset_seconds_cache.put(bitmap, offsets)
+        return offsets
+
+    def read_range(self, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> Iterator[tuple[datetime.datetime, str]]:
+        """
+        Yields (timestamp, value) for a trend from start_date through end_date (inclusive), in time order.
+        Only the data pages whose index records overlap the range are read, and they are decoded
+        lazily as the caller iterates. Values in the write ahead log, if open, are merged in.
+
+        Every page is read from the same committed generation. If a writer commits before the last page
+        is read, SnapshotChanged is raised rather than yield days from two generations.
+        """
+        logged_days = self.wal.logged_days(trend_name, start_date, end_date) if self.wal is not None else {}
+        if not logged_days:
+            yield from self.read_page_range(trend_name, start_date, end_date)
+        elif trend_name not in self.catalog:
+            yield from merge_logged_days(iter(()), logged_days)
+        else:
+            yield from merge_logged_days(self.read_page_range(trend_name, start_date, end_date), logged_days)
+
+    def read_page_range(self, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> Iterator[tuple[datetime.datetime, str]]:
+        start_day = self.day_id(start_date)
+        end_day = self.day_id(end_date)
+
+        # Decoded about a page of days at a time as the caller iterates, so a long range never holds more than
+        # a few pages of decoded days, and every chunk from the generation of the first
+        first_generation = None
+        while start_day <= end_day:
+            (trend_id, days, chunk_end), generation = self.snapshot_generation(
+                lambda: self.read_day_chunk(trend_name, start_day, end_day))
+            if first_generation is None:
+                first_generation = generation
+            elif generation != first_generation:
+                raise SnapshotChanged(f"{trend_name} changed from generation {first_generation} to {generation} while being read")
+            for day_id, day_type_id, values, cached in days:
+                if not cached:
+                    self.day_cache.put((trend_id, day_id), (day_type_id, values))
+
+            for day_id, day_type_id, values, _ in days:
+                date = self.date(day_id)
+                day_start = datetime.datetime(date.year, date.month, date.day)
+                for offset, value in zip(self.day_offsets(day_type_id), values):
+                    yield day_start + offset, value
+            start_day = chunk_end + 1
+
+    def read_range_list(self, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> list[tuple[datetime.datetime, str]]:
+        """
+        read_range as a list, read again if a writer commits partway. After a few tries the range is read
+        holding the shared lock, so busy writers can't starve it.
+        """
+        for _ in range(snapshot_attempts):
+            try:
+                return list(self.read_range(trend_name, start_date, end_date))
+            except SnapshotChanged:
+                stats.read_retries += 1
+        with self.pager.read_lock():
+            stats.locked_reads += 1
+            return list(self.read_range(trend_name, start_date, end_date))
+
+    def read_day_chunk(self, trend_name: str, start_day: int, end_day: int) -> tuple[int, list[tuple[int, int, list[str], bool]], int]:
+        """
+        read_days from start_day through the earliest end day of the index records overlapping the range, or end_day
+        if sooner, so only the pages of those records are decoded. Also returns the last day read.
+        """
+        trend_id = self.catalog.id(trend_name)
+        records = self.index.trend(trend_id).overlapping(start_day, end_day)
+        chunk_end = min([end_day] + [index.end_day for index in records])
+        return (*self.read_days(trend_name, start_day, chunk_end), chunk_end)
+
+    def read_days(self, trend_name: str, start_day: int, end_day: int) -> tuple[int, list[tuple[int, int, list[str], bool]]]:
+        """
+        Returns the trend id, and (day id, day type id, values, whether from the day cache) for each day in the range, in order.
+        The days in range are found from the page slot directories, and only days missing from the day cache are decoded.
+        """
+        trend_id = self.catalog.id(trend_name)
+        days = []
+        for page_index in {x.page_index for x in self.index.trend(trend_id).overlapping(start_day, end_day)}:
+            page = self.pager.page(page_index)
+            for day_id, day_type_id, start, _ in iter_page_days(page, start_day, end_day):
+                day = self.day_cache.get((trend_id, day_id))
+                if day is None:
+                    stats.day_cache_misses += 1
+                    days.append((day_id, day_type_id, decode_day_values(page, start)[0], False))
+                else:
+                    stats.day_cache_hits += 1
+                    days.append((day_id, day[0], day[1], True))
+        days.sort(key=lambda x: x[0])
+        return trend_id, days
+
+    def read_range_arrays(self, trend_name: str, start_date: datetime.date, end_date: datetime.date):
+        """
+        Returns (timestamps, values) NumPy arrays for a trend from start_date through end_date (inclusive), in time order.
+        Timestamps are int64 seconds since 1970-01-01 of the stored (naive) times. Values are float64,
+        or object arrays of the strings if any value in the range is not a number.
+        """
+        import numpy as np
+
+        logged_days = self.wal.logged_days(trend_name, start_date, end_date) if self.wal is not None else {}
+        if trend_name in self.catalog or not logged_days:
+            timestamps, values = self.page_range_arrays(trend_name, start_date, end_date)
+        else:
+            timestamps, values = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if not logged_days:
+            return timestamps, values
+
+        logged_timestamps = np.array([(day.toordinal() - epoch_ordinal) * 86400 + minute * 60
+                                      for day, day_values in logged_days.items() for minute in day_values], dtype=np.int64)
+        logged_values = [value for day_values in logged_days.values() for value in day_values.values()]
+        try:
+            if values.dtype == object:
+                raise ValueError
+            all_values = np.concatenate([values, np.array(logged_values, dtype=np.float64)])
+        except ValueError:
+            # Strings on either side, take the strings from the merged rows
+            rows = self.read_range_list(trend_name, start_date, end_date)
+            return (np.array([(x.toordinal() - epoch_ordinal) * 86400 + x.hour * 3600 + x.minute * 60 for x, _ in rows], dtype=np.int64),
+                    np.array([value for _, value in rows], dtype=object))
+
+        # Stable sort puts logged values after the page values at the same time, and the last of each is kept
+        all_timestamps = np.concatenate([timestamps, logged_timestamps])
+        order = np.argsort(all_timestamps, kind='stable')
+        all_timestamps = all_timestamps[order]
+        keep = np.ones(len(all_timestamps), dtype=bool)
+        keep[:-1] = all_timestamps[1:] != all_timestamps[:-1]
+        return all_timestamps[keep], all_values[order][keep]
+
+    def page_range_arrays(self, trend_name: str, start_date: datetime.date, end_date: datetime.date):
+        return self.snapshot(lambda: self.read_day_arrays(trend_name, start_date, end_date))
+
+    def read_day_arrays(self, trend_name: str, start_date: datetime.date, end_date: datetime.date):
+        import numpy as np
+
+        days = self.trend_days(self.catalog.id(trend_name), self.day_id(start_date), self.day_id(end_date))
+        if not days:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        timestamps = np.concatenate([
+            (day_id + self.init_nd_date - 1 - epoch_ordinal) * 86400 + self.day_offset_seconds(day_type_id)
+            for day_id, day_type_id, _, _ in days
+        ])
+
+        try:
+            values = np.concatenate([decode_day_array(page, start) for _, _, page, start in days])
+        except ValueError:
+            # An enumerated trend, keep the strings
+            values = np.array([value for _, _, page, start in days for value in decode_day_values(page, start)[0]], dtype=object)
+
+        return timestamps, values
+
+    def trend_days(self, trend_id: int, start_day: int, end_day: int) -> list[tuple[int, int, memoryview, int]]:
+        """(day id, day type id, page view, start of the encoded values) of the stored days of a trend in the range, in day order"""
+        days = []
+        for page_index in {x.page_index for x in self.index.trend(trend_id).overlapping(start_day, end_day)}:
+            page = self.pager.page(page_index)
+            days.extend((day_id, day_type_id, page, start) for day_id, day_type_id, start, _ in iter_page_days(page, start_day, end_day))
+        days.sort(key=lambda x: x[0])
+        return days
+
+    def read_aligned(self, trend_names: list[str], start_date: datetime.date, end_date: datetime.date):
+        """
+        Returns (timestamps, values) NumPy arrays for several trends from start_date through end_date (inclusive) on one
+        time axis. timestamps are int64 seconds since 1970-01-01 of every time any of the trends has a value, and
+        values[i, j] is the value of trend_names[j] at timestamps[i]. Values are float64 with NaN where a trend has no
+        value, or if any trend is not numeric, an object array with None there, holding the strings of those trends
+        and floats of the rest.
+
+        A day where every trend shares one day type is stacked as is. Only days where the day types differ are merged.
+        """
+        import numpy as np
+
+        start_day = self.day_id(start_date)
+        end_day = self.day_id(end_date)
+
+        # Trends with logged values are read merged with the log, the rest straight from the pages
+        logged = [self.wal is not None and bool(self.wal.logged_days(trend_name, start_date, end_date)) for trend_name in trend_names]
+        trend_days = self.snapshot(lambda: [self.decode_trend_days(self.catalog.id(trend_name), start_day, end_day)
+                                            for trend_name, is_logged in zip(trend_names, logged) if not is_logged])
+        # For each trend, (day id, day type id or None, seconds into the day or None, values)
+        columns: list[list[tuple[int, Optional[int], object, object]]] = []
+        for trend_name, is_logged in zip(trend_names, logged):
+            if not is_logged:
+                columns.append(trend_days.pop(0))
+                continue
+            timestamps, values = self.read_range_arrays(trend_name, start_date, end_date)
+            day_ids = timestamps // 86400 + (epoch_ordinal - self.init_nd_date + 1)
+            day_starts = np.flatnonzero(np.diff(day_ids, prepend=-1))
+            columns.append([(int(day_ids[first]), None, timestamps[first:last] % 86400, values[first:last])
+                            for first, last in zip(day_starts, list(day_starts[1:]) + [len(day_ids)])])
+
+        is_object = any(values.dtype == object for column in columns for _, _, _, values in column)
+        days_by_id: dict[int, list[tuple[int, Optional[int], object, object]]] = defaultdict(list)
+        for column_index, column in enumerate(columns):
+            for day_id, day_type_id, offsets, values in column:
+                days_by_id[day_id].append((column_index, day_type_id, offsets, values))
+
+        timestamp_blocks = []
+        value_blocks = []
+        for day_id in sorted(days_by_id):
+            day = days_by_id[day_id]
+            day_type_ids = {day_type_id for _, day_type_id, _, _ in day}
+            if len(day_type_ids) == 1 and None not in day_type_ids:
+                # One schedule, the values line up already
+                offsets = self.day_offset_seconds(day[0][1])
+                positions = [None] * len(day)
+            else:
+                day_offsets = [self.day_offset_seconds(day_type_id) if offsets is None else offsets for _, day_type_id, offsets, _ in day]
+                offsets = np.unique(np.concatenate(day_offsets))
+                positions = [np.searchsorted(offsets, x) for x in day_offsets]
+
+            block = np.full((len(offsets), len(trend_names)), None if is_object else np.nan, dtype=object if is_object else np.float64)
+            for (column_index, _, _, values), position in zip(day, positions):
+                if position is None:
+                    block[:, column_index] = values
+                else:
+                    block[position, column_index] = values
+            timestamp_blocks.append((day_id + self.init_nd_date - 1 - epoch_ordinal) * 86400 + offsets)
+            value_blocks.append(block)
+
+        if not value_blocks:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(trend_names)), dtype=np.float64)
+        return np.concatenate(timestamp_blocks), np.concatenate(value_blocks)
+
+    def decode_trend_days(self, trend_id: int, start_day: int, end_day: int):
+        """(day id, day type id, None, values NumPy array) of the stored days of a trend in the range, as read_aligned needs them"""
+        import numpy as np
+
+        days = self.trend_days(trend_id, start_day, end_day)
+        try:
+            return [(day_id, day_type_id, None, decode_day_array(page, start)) for day_id, day_type_id, page, start in days]
+        except ValueError:
+            return [(day_id, day_type_id, None, np.array(decode_day_values(page, start)[0], dtype=object))
+                    for day_id, day_type_id, page, start in days]
+
+    def rollups(self, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> list[tuple[datetime.date, 'DayRollup']]:
+        """(date, rollup) of each day of a trend with values from start_date through end_date (inclusive), in order.
+        Stored days are read from their rollups alone, days with logged values, or too many states to store, are rolled
+        up from their values.
+        """
+        logged_days = self.wal.logged_days(trend_name, start_date, end_date) if self.wal is not None else {}
+        rollups: dict[datetime.date, 'DayRollup'] = {}
+        unrolled_days = list(logged_days)
+        if trend_name in self.catalog or not logged_days:
+            start_day = self.day_id(start_date)
+            end_day = self.day_id(end_date)
+            for day_id, rollup in self.snapshot(lambda: self.read_rollups(self.catalog.id(trend_name), start_day, end_day)):
+                rollups[self.date(day_id)] = rollup
+                if rollup.count and rollup.state_minutes == {}:
+                    unrolled_days.append(self.date(day_id))
+        for day in unrolled_days:
+            rows = self.read_range_list(trend_name, day, day)
+            rollups[day] = day_rollup([timestamp.hour * 60 + timestamp.minute for timestamp, _ in rows], [value for _, value in rows])
+        return sorted(rollups.items(), key=lambda x: x[0])
+
+    def read_rollups(self, trend_id: int, start_day: int, end_day: int) -> list[tuple[int, 'DayRollup']]:
+        rollups = []
+        for page_index in {x.page_index for x in self.rollup_index.trend(trend_id).overlapping(start_day, end_day)}:
+            page = self.pager.page(page_index)
+            rollups.extend((day_id, decode_rollup(page, start)) for day_id, _, start, _ in iter_page_days(page, start_day, end_day))
+        return rollups
+
+    def aggregate(self, trend_name: str, start_date: datetime.date, end_date: datetime.date, function: str):
+        """One of aggregate_functions over a trend's days from start_date through end_date (inclusive), see combine_rollups"""
+        return combine_rollups([rollup for _, rollup in self.rollups(trend_name, start_date, end_date)], function)
+
+    def write_many(self, trend_values: dict[str, list[tuple[datetime.datetime, str]]], executor: Optional[concurrent.futures.Executor] = None):
+        """
+        Writes values for many trends as one batch. New trend, day type, and index records are collected
+        in memory, data pages are assembled in page buffers, then everything is written in page order
+        followed by a single sync.
+
+        Every day is checked to be within the dates the database can store, merged, encoded, and checked to
+        fit a page before any page is allocated, so a batch that fails leaves the file as it was.
+
+        With a process pool executor, trends are sent to its workers in chunks, where their values are grouped
+        into days, and each day's type, rollup, and trial encodings are worked out. This process only merges
+        with stored days and places the pages, in day order, and the bytes written are the same as without one.
+
+        The write lock is held throughout, and the generation is odd while pages are written in place,
+        so readers retry anything they read meanwhile.
+        """
+        started = time.perf_counter()
+        with self.pager.write_lock():
+            # Catch up with any other writer's commit first
+            self.refresh()
+            committed_generation = self.generation + 1 if self.generation % 2 == 1 else self.generation + 2
+            self.pager.write_int(committed_generation - 1, generation_pos, 4)
+            try:
+                self.write_batch(trend_values, executor)
+            except BaseException:
+                self.pager.write_int(committed_generation, generation_pos, 4)
+                # Drop any records added in memory but not written
+                self.load()
+                raise
+            self.generation = committed_generation
+            self.pager.write_int(committed_generation, generation_pos, 4)
+            self.pager.sync()
+        seconds = time.perf_counter() - started
+        stats.writes += 1
+        stats.write_seconds += seconds
+        stats.event("write", seconds)
+
+    def write_batch(self, trend_values: dict[str, list[tuple[datetime.datetime, str]]], executor: Optional[concurrent.futures.Executor] = None):
+        pager = self.pager
+        page_size = pager.page_size
+
+        # (record number, trend id, encoded name) of new trends
+        trends_to_add: list[tuple[int, int, bytes]] = []
+        for trend_name in trend_values:
+            if trend_name in self.catalog:
+                continue
+            encoded_name = trend_name.encode('utf-8')
+            if len(encoded_name) > trend_name_size_bytes:
+                raise ValueError(f"Trend name longer than {trend_name_size_bytes} bytes")
+            trend_id = self.catalog.max_id + 1
+            trends_to_add.append((len(self.catalog), trend_id, encoded_name))
+            self.catalog.add(trend_name, trend_id)
+
+        trend_names = list(trend_values)
+        if executor is None:
+            trends_prepared = [prepare_days(trend_values[trend_name]) for trend_name in trend_names]
+        else:
+            chunks: list[list[list[tuple[datetime.datetime, str]]]] = [[]]
+            chunk_size = 0
+            for trend_name in trend_names:
+                if chunk_size >= parallel_chunk_values:
+                    chunks.append([])
+                    chunk_size = 0
+                chunks[-1].append(trend_values[trend_name])
+                chunk_size += len(trend_values[trend_name])
+            trends_prepared = list(itertools.chain.from_iterable(executor.map(prepare_trial_days, chunks)))
+
+        # (trend id, day id, minutes, values, day type bitmap, encoded rollup, trial encodings), one per trend day
+        trend_days: list[tuple[int, int, list[int], list[str], bytes, bytes, Optional[tuple]]] = []
+        for trend_name, prepared_days in zip(trend_names, trends_prepared):
+            trend_id = self.catalog.id(trend_name)
+            for day, minutes, day_values, bitmap, encoded_rollup, trials in prepared_days:
+                day_id = self.day_id(day)
+                if not 0 <= day_id < 1 << 8 * day_id_size_bytes:
+                    raise ValueError(f"{day} is outside the dates the database can store, "
+                                     f"{self.date(0)} to {self.date((1 << 8 * day_id_size_bytes) - 1)}")
+                trend_days.append((trend_id, day_id, minutes, day_values, bitmap, encoded_rollup, trials))
+
+        # Data pages being written, keyed by page index, and index records that changed.
+        page_buffers: dict[int, bytearray] = {}
+        dirty_indexes: dict[int, DataIndex] = {}
+        dirty_rollup_indexes: dict[int, DataIndex] = {}
+        # New pages by the configuration page field counting them, and every page allocated, to give back on failure
+        new_pages: Counter[int] = Counter()
+        allocated_pages: list[int] = []
+
+        def page_buffer(page_index: int) -> bytearray:
+            if page_index not in page_buffers:
+                page_buffers[page_index] = bytearray(pager.page(page_index))
+            return page_buffers[page_index]
+
+        def place_day(index: IntervalIndex, dirty: dict[int, DataIndex], count_pos: int, target_index: Optional[DataIndex],
+                      trend_id: int, day_id: int, day_type_id: int, encoded: bytes):
+            # Add it to the target page if it fits
+            if target_index is not None and add_page_day(page_buffer(target_index.page_index), day_id, day_type_id, encoded):
+                index.trend(trend_id).extend(target_index, day_id)
+                dirty[target_index.record_index] = target_index
+                return
+
+            # Start a new page, with a new index record pointing to it
+            new_page_index = allocate_page(pager)
+            allocated_pages.append(new_page_index)
+            page = new_data_page(page_size)
+            add_page_day(page, day_id, day_type_id, encoded)
+            page_buffers[new_page_index] = page
+            new_pages[count_pos] += 1
+
+            new_index = DataIndex(trend_id, new_page_index, day_id, day_id)
+            index.add(new_index)
+            dirty[new_index.record_index] = new_index
+
+        # In trend and day order, so days of a trend are appended in order
+        trend_days.sort(key=lambda x: (x[0], x[1]))
+
+        # Every day is merged, encoded, and checked before anything is allocated or written, so a day that can't be
+        # stored fails the batch with the file untouched.
+        # (trend id, day id, index record of the page already holding the day or None, day type bitmap, values, rollup)
+        encoded_days: list[tuple[int, int, Optional[DataIndex], bytes, bytes, bytes]] = []
+        for trend_id, day_id, minutes, day_values, bitmap, encoded_rollup, trials in trend_days:
+            stored_index: Optional[DataIndex] = None
+            for containing_index in self.index.trend(trend_id).containing(day_id):
+                page = pager.page(containing_index.page_index)
+                existing = find_page_day(page, day_id)
+                if existing is not None:
+                    # The day is already stored. Merge with it, new values winning. It is taken out of its page
+                    # when placed, so the merged day can be written like a new one.
+                    existing_type_id, start, _ = existing
+                    existing_values, _ = decode_day_values(page, start)
+                    merged = dict(zip(day_entry_minutes(self.day_types.bitmap(existing_type_id)), existing_values))
+                    merged.update(zip(minutes, day_values))
+                    minutes = sorted(merged)
+                    day_values = [merged[minute] for minute in minutes]
+                    bitmap = bytes(minutes_to_day_entry(minutes))
+                    encoded_rollup = encode_rollup(day_rollup(minutes, day_values))
+                    stored_index = containing_index
+                    # The merged day has different values to the ones trial encoded
+                    trials = None
+                    break
+
+            encoded_values = encode_day_values(day_values, self.codec_stats[trend_id], trials)
+            if len(encoded_values) + data_page_header_size_bytes + day_slot_size_bytes > page_size:
+                raise ValueError("Encoded values too large")
+            encoded_days.append((trend_id, day_id, stored_index, bitmap, encoded_values, encoded_rollup))
+
+        try:
+            for trend_id, day_id, stored_index, bitmap, encoded_values, encoded_rollup in encoded_days:
+                self.day_cache.pop((trend_id, day_id))
+
+                # A merged day goes back in its page if it still fits, others after the trend's latest earlier day
+                if stored_index is not None:
+                    remove_page_day(page_buffer(stored_index.page_index), day_id)
+                    target_index = stored_index
+                else:
+                    trend_intervals = self.index.trend(trend_id)
+                    containing_indexes = trend_intervals.containing(day_id)
+                    target_index = containing_indexes[0] if containing_indexes else trend_intervals.latest_before(day_id)
+                place_day(self.index, dirty_indexes, num_data_pages_pos, target_index, trend_id, day_id,
+                          self.day_types.get_or_add(bitmap), encoded_values)
+
+                # The day's rollup replaces any stored one, in the same page if it fits
+                rollup_intervals = self.rollup_index.trend(trend_id)
+                containing_rollups = rollup_intervals.containing(day_id)
+                rollup_target = containing_rollups[0] if containing_rollups else rollup_intervals.latest_before(day_id)
+                for containing_rollup in containing_rollups:
+                    page = page_buffer(containing_rollup.page_index)
+                    if find_page_day(page, day_id) is not None:
+                        remove_page_day(page, day_id)
+                        rollup_target = containing_rollup
+                        break
+                place_day(self.rollup_index, dirty_rollup_indexes, num_rollup_pages_pos, rollup_target, trend_id, day_id, 0, encoded_rollup)
+        except BaseException:
+            # Nothing points to the pages taken so far yet
+            for page_index in allocated_pages:
+                free_page(pager, page_index)
+            raise
+
+        # Link in any metadata pages needed before writing records to them
+        self.day_types.write_new()
+        trends_chain.reserve(pager, self.trend_pages, len(self.catalog))
+        index_chain.reserve(pager, self.index_pages, len(self.indexes))
+        rollup_index_chain.reserve(pager, self.rollup_index_pages, len(self.rollup_index.records))
+
+        for record_index, trend_id, encoded_name in trends_to_add:
+            pos = trends_chain.record_position(pager, self.trend_pages, record_index)
+            pager.write_int(trend_id, pos, trend_id_size_bytes)
+            pager.write(pos + trend_id_size_bytes, encoded_name)
+
+        for record_index in sorted(dirty_indexes):
+            write_index_record(pager, self.index_pages, record_index, dirty_indexes[record_index])
+        for record_index in sorted(dirty_rollup_indexes):
+            write_index_record(pager, self.rollup_index_pages, record_index, dirty_rollup_indexes[record_index], rollup_index_chain)
+
+        for page_index in sorted(page_buffers):
+            pager.write(page_index * page_size, page_buffers[page_index])
+        stats.pages_written += len(page_buffers)
+        for count_pos, num_pages in new_pages.items():
+            pager.write_int(pager.read_int(count_pos, 4) + num_pages, count_pos, 4)
+
+    def storage_stats(self) -> 'StorageStats':
+        return self.snapshot(self.read_storage_stats)
+
+    def read_storage_stats(self) -> 'StorageStats':
+        pager = self.pager
+        data_pages, days, data_fill = page_fill(pager, self.indexes)
+        rollup_pages, _, rollup_fill = page_fill(pager, self.rollup_index.records)
+
+        # Steps from one of a trend's data pages to its next in day order, and those not to the next page in the file
+        steps = 0
+        jumps = 0
+        for trend_id in {index.trend_id for index in self.indexes}:
+            page_order = list(dict.fromkeys(index.page_index for index in self.index.trend(trend_id).records))
+            steps += len(page_order) - 1
+            jumps += sum(1 for page_index, next_page_index in zip(page_order, page_order[1:]) if next_page_index != page_index + 1)
+
+        metadata_pages = len(self.trend_pages) + len(self.day_entry_pages) + len(self.index_pages) + len(self.rollup_index_pages)
+        return StorageStats(pager.num_pages, data_pages, rollup_pages, pager.read_int(num_free_pages_pos, 4), metadata_pages,
+                            days, data_fill, rollup_fill, jumps / steps if steps else 0.0)
+
+    def compact(self) -> 'CompactionResult':
+        """
+        Rewrites the database into a new file with each trend's days packed into consecutive data pages in day
+        order, one index record per page, no day types that no day uses, and no free pages, then swaps it in.
+
+        The write lock is held throughout, so the new file misses no write. Readers keep reading the old file,
+        and every connection moves to the new one the next time it refreshes or takes a lock.
+        """
+        pager = self.pager
+        if not pager.writable:
+            raise ValueError("Compacting requires a writable database")
+        started = time.perf_counter()
+
+        with pager.write_lock():
+            self.refresh()
+            page_size = pager.page_size
+            size_before = pager.size
+            data_pages_before = pager.read_int(num_data_pages_pos, 4)
+            index_records_before = len(self.indexes)
+            day_types_before = len(self.day_types)
+
+            used_day_types: set[int] = set()
+            for index in self.indexes:
+                used_day_types.update(day_type_id for _, day_type_id, _, _ in iter_page_days(pager.page(index.page_index)))
+            # Kept in the same order, so the ids only close up over the dropped ones
+            day_type_ids = {old_id: new_id for new_id, old_id in enumerate(sorted(used_day_types))}
+
+            temp_path = pager.filepath + '.compact'
+            new_file = open(temp_path, 'w+b')
+            try:
+                os.chmod(temp_path, os.stat(pager.filepath).st_mode & 0o7777)
+                if fcntl is not None:
+                    fcntl.flock(new_file.fileno(), fcntl.LOCK_EX)
+                # The configuration page is written last, once the page counts are known
+                new_file.write(bytes(page_size))
+
+                indexes, pages_by_trend = write_packed_pages(new_file, pager, self.indexes, 1, day_type_ids)
+                num_data_pages = sum(pages_by_trend.values())
+                trend_pages = {self.catalog.name(trend_id): num_pages for trend_id, num_pages in pages_by_trend.items()}
+                # Rollups have no day type
+                rollup_indexes, _ = write_packed_pages(new_file, pager, self.rollup_index.records, 1 + num_data_pages, {0: 0})
+                num_rollup_pages = len(rollup_indexes)
+                next_page = 1 + num_data_pages + num_rollup_pages
+
+                trend_records = [trend_id.to_bytes(trend_id_size_bytes, 'big') + trend_name.encode('utf-8').ljust(trend_name_size_bytes, b'\x00')
+                                 for trend_id, trend_name in sorted(self.catalog.names.items())]
+                day_entry_records = [b'\x01' + self.day_types.bitmap(old_id) for old_id in sorted(used_day_types)]
+                index_records = [encode_index_record(index) for index in indexes]
+                rollup_index_records = [encode_index_record(index) for index in rollup_indexes]
+
+                config = bytearray(pager.page(0))
+                for chain, records in [(trends_chain, trend_records), (day_entries_chain, day_entry_records), (index_chain, index_records),
+                                       (rollup_index_chain, rollup_index_records)]:
+                    chain_pages = write_chain_pages(new_file, chain, records, next_page, page_size)
+                    config[chain.count_pos:chain.count_pos + 4] = chain_pages.to_bytes(4, 'big')
+                    config[chain.first_pos:chain.first_pos + 4] = (next_page if chain_pages else 0).to_bytes(4, 'big')
+                    config[chain.last_pos:chain.last_pos + 4] = (next_page + chain_pages - 1 if chain_pages else 0).to_bytes(4, 'big')
+                    next_page += chain_pages
+
+                generation = self.generation + 1 if self.generation % 2 == 1 else self.generation + 2
+                config[num_data_pages_pos:num_data_pages_pos + 4] = num_data_pages.to_bytes(4, 'big')
+                config[num_rollup_pages_pos:num_rollup_pages_pos + 4] = num_rollup_pages.to_bytes(4, 'big')
+                config[free_list_head_pos:free_list_head_pos + 4] = bytes(4)
+                config[num_free_pages_pos:num_free_pages_pos + 4] = bytes(4)
+                config[generation_pos:generation_pos + 4] = generation.to_bytes(4, 'big')
+                new_file.seek(0)
+                new_file.write(config)
+                new_file.flush()
+                os.fsync(new_file.fileno())
+
+                replace_file(temp_path, pager.filepath)
+            except BaseException:
+                new_file.close()
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(temp_path)
+                raise
+
+            # Still holding the lock, now on the new file
+            pager.reopen(new_file)
+            self.load()
+
+        stats.pages_written += pager.num_pages
+        stats.event("compact", time.perf_counter() - started)
+        return CompactionResult(size_before, pager.size, data_pages_before, num_data_pages, index_records_before,
+                                len(self.indexes), day_types_before, len(self.day_types), trend_pages)
+
+
+class CompactionResult:
+    """What a compaction changed. Sizes are in bytes."""
+    def __init__(self, size_before: int, size_after: int, data_pages_before: int, data_pages_after: int,
+                 index_records_before: int, index_records_after: int, day_types_before: int, day_types_after: int,
+                 trend_pages: dict[str, int]) -> None:
+        self.size_before = size_before
+        self.size_after = size_after
+        self.data_pages_before = data_pages_before
+        self.data_pages_after = data_pages_after
+        self.index_records_before = index_records_before
+        self.index_records_after = index_records_after
+        self.day_types_before = day_types_before
+        self.day_types_after = day_types_after
+        # Data pages of each trend
+        self.trend_pages = trend_pages
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return self.size_before - self.size_after
+
+
+class StorageStats:
+    """How full and how scattered the pages of a database are"""
+    def __init__(self, total_pages: int, data_pages: int, rollup_pages: int, free_pages: int, metadata_pages: int,
+                 days: int, data_fill: float, rollup_fill: float, fragmentation: float) -> None:
+        self.total_pages = total_pages
+        self.data_pages = data_pages
+        self.rollup_pages = rollup_pages
+        self.free_pages = free_pages
+        # Trend, day type, index, and rollup index pages
+        self.metadata_pages = metadata_pages
+        self.days = days
+        # Fraction of the bytes of the data and rollup pages in use, header and slots included
+        self.data_fill = data_fill
+        self.rollup_fill = rollup_fill
+        # Fraction of the steps from one of a trend's data pages to its next, in day order, that are not to the next
+        # page in the file. 0 after a compaction.
+        self.fragmentation = fragmentation
+
+
+def page_fill(pager: Pager, records: list[DataIndex]) -> tuple[int, int, float]:
+    """Number of pages records point to, days stored in them, and the fraction of their bytes in use"""
+    page_indexes = {index.page_index for index in records}
+    days = 0
+    used_bytes = 0
+    for page_index in page_indexes:
+        page = pager.page(page_index)
+        num_days = int.from_bytes(page[2:4], 'big')
+        days += num_days
+        used_bytes += int.from_bytes(page[0:2], 'big') + num_days * day_slot_size_bytes
+    return len(page_indexes), days, used_bytes / (len(page_indexes) * pager.page_size) if page_indexes else 0.0
+
+
+def write_packed_pages(file, pager: Pager, records: list[DataIndex], first_page: int, day_type_ids: dict[int, int]) -> tuple[list[DataIndex], dict[int, int]]:
+    """
+    Writes the days of the pages records point to, each trend's days packed in day order into consecutive pages
+    numbered from first_page, with day type ids mapped through day_type_ids. Returns an index record for each
+    page written, and the number of pages by trend id.
+    """
+    trend_records: dict[int, list[DataIndex]] = defaultdict(list)
+    for index in records:
+        trend_records[index.trend_id].append(index)
+
+    indexes: list[DataIndex] = []
+    pages_by_trend: dict[int, int] = {}
+    next_page = first_page
+    for trend_id in sorted(trend_records):
+        days = []
+        for index in trend_records[trend_id]:
+            page = pager.page(index.page_index)
+            for day_id, day_type_id, start, end in iter_page_days(page):
+                days.append((day_id, day_type_id, start, end, page))
+        days.sort(key=lambda x: x[0])
+        if not days:
+            continue
+
+        trend_first_page = next_page
+        page = new_data_page(pager.page_size)
+        start_day = days[0][0]
+        for day_index, (day_id, day_type_id, start, end, old_page) in enumerate(days):
+            if not add_page_day(page, day_id, day_type_ids[day_type_id], old_page[start:end]):
+                file.write(page)
+                indexes.append(DataIndex(trend_id, next_page, start_day, days[day_index - 1][0]))
+                next_page += 1
+                page = new_data_page(pager.page_size)
+                start_day = day_id
+                add_page_day(page, day_id, day_type_ids[day_type_id], old_page[start:end])
+        file.write(page)
+        indexes.append(DataIndex(trend_id, next_page, start_day, days[-1][0]))
+        next_page += 1
+        pages_by_trend[trend_id] = next_page - trend_first_page
+    return indexes, pages_by_trend
+
+
+def write_chain_pages(file, chain: PageChain, records: list[bytes], first_page: int, page_size: int) -> int:
+    """Writes records as a page chain starting at first_page, each page linked to the next. Returns the number of pages."""
+    records_per_page = chain.records_per_page(page_size)
+    num_pages = (len(records) + records_per_page - 1) // records_per_page
+    for page_number in range(num_pages):
+        page = bytearray(b"".join(records[page_number * records_per_page:(page_number + 1) * records_per_page]).ljust(page_size, b'\x00'))
+        next_page = first_page + page_number + 1 if page_number + 1 < num_pages else 0
+        page[page_size - page_pointer_size_bytes:] = next_page.to_bytes(page_pointer_size_bytes, 'big')
+        file.write(page)
+    return num_pages
+
+
+def replace_file(temp_path: str, path: str):
+    """Moves a fully written temp file over path, and syncs the directory so the rename is durable"""
+    os.replace(temp_path, path)
+    directory_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+@contextlib.contextmanager
+def use_database(db, writable: bool = True):
+    """Yields db if it is already an open Database (refreshed if another writer has committed since), otherwise
+    opens one on the file path or Pager
+    """
+    if isinstance(db, Database):
+        db.refresh()
+        yield db
+    else:
+        with use_pager(db, writable) as pager:
+            database = Database(pager)
+            if os.path.exists(wal_path(pager.filepath)):
+                database.open_wal()
+            try:
+                yield database
+            finally:
+                if database.wal is not None:
+                    database.wal.close()
+
+
+def write_many(db, trend_values: dict[str, list[tuple[datetime.datetime, str]]], executor: Optional[concurrent.futures.Executor] = None):
+    with use_database(db) as database:
+        database.write_many(trend_values, executor)
+
+
+def write_data(db, trend_name: str, values: list[tuple[datetime.datetime, str]]):
+    write_many(db, {trend_name: values})
 
-        page_size = int.from_bytes(configurations[2:4], 'big')
-        init_year = int.from_bytes(configurations[4:6], 'big')
-        num_day_entries_pages = int.from_bytes(configurations[6:10], 'big')
-        num_trends_pages = int.from_bytes(configurations[10:14], 'big')
-        num_index_pages = int.from_bytes(configurations[14:18], 'big')
 
-        total_size = page_size * (num_day_entries_pages + num_trends_pages + num_index_pages)
+def compact(db) -> CompactionResult:
+    with use_database(db) as database:
+        return database.compact()
 
-        init_nd_date = mputils.fixed_from_gregorian(init_year, 1, 1)
 
-        file.seek(page_size)
+def append(db, trend_values: dict[str, list[tuple[datetime.datetime, str]]]):
+    with use_database(db) as database:
+        database.append(trend_values)
 
-        # Read all the index pages
-        all_index_pages = file.read(total_size)
-        curr_pos = 0
 
-        trend_pages = []
-        for _ in range(num_trends_pages):
-            trend_pages.append(all_index_pages[curr_pos:curr_pos + page_size])
-            curr_pos += page_size
+def checkpoint(db, max_age: float = wal_max_age_seconds, force: bool = False) -> int:
+    with use_database(db) as database:
+        return database.checkpoint(max_age, force)
 
-        # Check if we need a new trend page
-        trends: dict[str, int] = read_trend_pages(trend_pages)
-        if trend_name in trends:
-            trend_id = trends[trend_name]
+
+def lock_exclusive(file) -> bool:
+    """Takes an exclusive advisory lock on an open file without waiting, returning whether it was taken"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def wal_path(filepath) -> str:
+    return f"{filepath}{wal_suffix}"
+
+
+def encode_wal_record(trend_values: dict[str, list[tuple[datetime.datetime, str]]]) -> bytes:
+    """
+    - 4 bytes: length of payload
+    - 4 bytes: CRC-32 of payload
+    - payload, for each value:
+        - varint: length of UTF-8 encoded trend name
+        - n bytes: UTF-8 trend name
+        - varint: minutes since Jan 1, Year 1 (date ordinal * 1440 + minute of the day)
+        - varint: length of UTF-8 encoded value
+        - m bytes: UTF-8 value
+    """
+    payload: list[int] = []
+    for trend_name, values in trend_values.items():
+        encoded_name = trend_name.encode('utf-8')
+        for timestamp, value in values:
+            encode_varint(len(encoded_name), payload)
+            payload.extend(encoded_name)
+            encode_varint(timestamp.toordinal() * 1440 + timestamp.hour * 60 + timestamp.minute, payload)
+            encoded_value = value.encode('utf-8')
+            encode_varint(len(encoded_value), payload)
+            payload.extend(encoded_value)
+
+    payload_bytes = bytes(payload)
+    return len(payload_bytes).to_bytes(4, 'big') + zlib.crc32(payload_bytes).to_bytes(4, 'big') + payload_bytes
+
+
+def decode_wal_records(data: bytes) -> tuple[list[tuple[str, int, str]], int]:
+    """
+    Returns (trend name, minutes since Jan 1, Year 1, value) for each value in the complete records,
+    and the length of the data they cover. Decoding stops at a torn or corrupt record.
+    """
+    values = []
+    pos = 0
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], 'big')
+        payload = data[pos + 8:pos + 8 + length]
+        if len(payload) != length or zlib.crc32(payload) != int.from_bytes(data[pos + 4:pos + 8], 'big'):
+            break
+
+        index = 0
+        while index < length:
+            name_length, index = decode_varint(payload, index)
+            trend_name = payload[index:index + name_length].decode('utf-8')
+            minute, index = decode_varint(payload, index + name_length)
+            value_length, index = decode_varint(payload, index)
+            values.append((trend_name, minute, payload[index:index + value_length].decode('utf-8')))
+            index += value_length
+        pos += 8 + length
+
+    return values, pos
+
+
+class WriteAheadLog:
+    """
+    The append only log next to a database file, '<database>-wal'. Small writes are appended to it instead of
+    rewriting data pages, and callers appending at the same time share one fsync. checkpoint folds finished
+    or aged days into the data pages and drops them from the log.
+
+    Logged values are also held in memory, by (trend name, date), so reads can merge them with the pages.
+    Appends are thread safe. One connection at a time may open the log for writing, it holds a lock on the file.
+    """
+    def __init__(self, path: str, writable: bool = True) -> None:
+        self.path = path
+        self.writable = writable
+        self.condition = threading.Condition()
+        # {minute of the day: value} by (trend name, date), and when each day was first logged
+        self.days: dict[tuple[str, datetime.date], dict[int, str]] = {}
+        self.logged_at: dict[tuple[str, datetime.date], float] = {}
+
+        # Records, with their values, waiting for a group commit. Appends are numbered, and every append up to
+        # synced_sequence is durable, except those whose group commit failed, with the error it failed with.
+        self.pending: list[tuple[bytes, dict[str, list[tuple[datetime.datetime, str]]]]] = []
+        self.next_sequence = 0
+        self.synced_sequence = 0
+        self.failed_sequences: dict[int, BaseException] = {}
+        self.syncing = False
+
+        self.file = None
+        if writable:
+            self.file = open(path, 'ab')
+            if not lock_exclusive(self.file):
+                self.file.close()
+                raise ValueError(f"{path} is open for writing by another connection")
+        # (inode, size) of the log when last read or written, to tell when another process has changed it
+        self.file_id: Optional[tuple[int, int]] = None
+        self.replay()
+
+    def __enter__(self) -> 'WriteAheadLog':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def replay(self):
+        """Reads the logged values from the file. A torn record at the end, from a crash mid-append, is cut off."""
+        self.days = {}
+        self.logged_at = {}
+        if not os.path.exists(self.path):
+            self.file_id = None
+            return
+
+        with open(self.path, 'rb') as log_file:
+            data = log_file.read()
+            stat = os.fstat(log_file.fileno())
+        values, valid_length = decode_wal_records(data)
+        if valid_length < len(data) and self.writable:
+            self.file.truncate(valid_length)
+
+        now = time.time()
+        for trend_name, minute, value in values:
+            day = datetime.date.fromordinal(minute // 1440)
+            self.add_value((trend_name, day), minute % 1440, value, now)
+        self.file_id = (stat.st_ino, valid_length)
+
+    def refresh(self):
+        """Replays the file if another process has appended to or checkpointed it"""
+        try:
+            stat = os.stat(self.path)
+            file_id: Optional[tuple[int, int]] = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            file_id = None
+        if file_id != self.file_id:
+            with self.condition:
+                self.replay()
+
+    def add_value(self, key: tuple[str, datetime.date], minute: int, value: str, now: float):
+        if key not in self.days:
+            self.days[key] = {}
+            self.logged_at[key] = now
+        self.days[key][minute] = value
+
+    def publish(self, trend_values: dict[str, list[tuple[datetime.datetime, str]]], now: float):
+        """Makes logged values readable. Called holding the condition, once they are on disk."""
+        for trend_name, values in trend_values.items():
+            for timestamp, value in values:
+                self.add_value((trend_name, timestamp.date()), timestamp.hour * 60 + timestamp.minute, value, now)
+
+    def append(self, trend_values: dict[str, list[tuple[datetime.datetime, str]]]):
+        """
+        Appends values to the log, returning once they are on disk, and readable from then on. If the group
+        commit fails, every append in it raises, and none of their values are logged.
+        """
+        if not self.writable:
+            raise ValueError("Log is open read only")
+        record = encode_wal_record(trend_values)
+        with self.condition:
+            self.pending.append((record, trend_values))
+            self.next_sequence += 1
+            sequence = self.next_sequence
+            while True:
+                if sequence in self.failed_sequences:
+                    error = self.failed_sequences.pop(sequence)
+                    raise OSError(f"Group commit of the write ahead log failed: {error}") from error
+                if self.synced_sequence >= sequence:
+                    return
+                if self.syncing:
+                    self.condition.wait()
+                    continue
+
+                # Lead a group commit of everything pending, letting other appends queue up meanwhile
+                batch = self.pending
+                self.pending = []
+                last_sequence = self.next_sequence
+                self.syncing = True
+                self.condition.release()
+                start = self.file.tell()
+                try:
+                    self.file.write(b''.join(record for record, _ in batch))
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                except BaseException as error:
+                    try:
+                        # Leave no partial record behind
+                        self.file.truncate(start)
+                        self.file.seek(start)
+                    finally:
+                        self.condition.acquire()
+                        self.syncing = False
+                        # The whole group fails, this append with the error itself
+                        for failed_sequence in range(last_sequence - len(batch) + 1, last_sequence + 1):
+                            if failed_sequence != sequence:
+                                self.failed_sequences[failed_sequence] = error
+                        self.condition.notify_all()
+                    raise
+
+                self.condition.acquire()
+                self.syncing = False
+                now = time.time()
+                for _, values in batch:
+                    self.publish(values, now)
+                self.synced_sequence = last_sequence
+                self.file_id = (os.fstat(self.file.fileno()).st_ino, self.file.tell())
+                self.condition.notify_all()
+
+    def logged_days(self, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> dict[datetime.date, dict[int, str]]:
+        """Copies of the logged {minute of the day: value} of a trend by date, from start_date through end_date"""
+        with self.condition:
+            return {day: dict(values) for (name, day), values in self.days.items()
+                    if name == trend_name and start_date <= day <= end_date}
+
+    def __len__(self) -> int:
+        return sum(len(values) for values in self.days.values())
+
+    def checkpoint(self, database: 'Database', max_age: float = wal_max_age_seconds, force: bool = False) -> int:
+        """
+        Writes finished days, those with a later day logged for the same trend, and days first logged more than
+        max_age seconds ago (or every day, with force) into the data pages, then drops them from the log.
+        Returns the number of values checkpointed.
+        """
+        with self.condition:
+            now = time.time()
+            latest_days: dict[str, datetime.date] = {}
+            for trend_name, day in self.days:
+                latest_days[trend_name] = max(day, latest_days.get(trend_name, day))
+            due = {key: dict(values) for key, values in self.days.items()
+                   if force or key[1] < latest_days[key[0]] or now - self.logged_at[key] >= max_age}
+        if not due:
+            return 0
+
+        trend_values: dict[str, list[tuple[datetime.datetime, str]]] = defaultdict(list)
+        for (trend_name, day), values in due.items():
+            day_start = datetime.datetime(day.year, day.month, day.day)
+            trend_values[trend_name].extend((day_start + datetime.timedelta(minutes=minute), value) for minute, value in values.items())
+        database.write_many(trend_values)
+
+        with self.condition:
+            while self.syncing:
+                self.condition.wait()
+            # Values appended during the write stay logged
+            for key, values in due.items():
+                logged = self.days.get(key, {})
+                for minute, value in values.items():
+                    if logged.get(minute) == value:
+                        del logged[minute]
+                if not logged:
+                    self.days.pop(key, None)
+                    self.logged_at.pop(key, None)
+            self.rewrite()
+
+        return sum(len(values) for values in due.values())
+
+    def rewrite(self):
+        """Replaces the file with one record of the values still logged. Called holding the condition."""
+        # Anything pending goes in the new file, so is readable now
+        now = time.time()
+        for _, values in self.pending:
+            self.publish(values, now)
+        remaining: dict[str, list[tuple[datetime.datetime, str]]] = defaultdict(list)
+        for (trend_name, day), values in self.days.items():
+            day_start = datetime.datetime(day.year, day.month, day.day)
+            remaining[trend_name].extend((day_start + datetime.timedelta(minutes=minute), value) for minute, value in values.items())
+
+        # The new file is locked before it replaces the old one, so the log is never left unlocked
+        temp_path = self.path + '.tmp'
+        temp_file = open(temp_path, 'wb')
+        lock_exclusive(temp_file)
+        if remaining:
+            temp_file.write(encode_wal_record(remaining))
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+        replace_file(temp_path, self.path)
+        self.file.close()
+        self.file = temp_file
+
+        self.pending = []
+        self.synced_sequence = self.next_sequence
+        self.file_id = (os.fstat(self.file.fileno()).st_ino, self.file.tell())
+
+
+class Checkpointer(threading.Thread):
+    """
+    Checkpoints a log into its database every interval seconds, on a connection of its own, until stopped.
+    Other connections see the checkpointed days like any other writer's commit.
+    """
+    def __init__(self, filepath, wal: WriteAheadLog, interval: float = 60.0, max_age: float = wal_max_age_seconds) -> None:
+        super().__init__(daemon=True)
+        self.filepath = filepath
+        self.wal = wal
+        self.interval = interval
+        self.max_age = max_age
+        self.stopped = threading.Event()
+
+    def run(self):
+        # The log is shared, not opened again on this connection
+        with use_pager(self.filepath) as pager:
+            database = Database(pager)
+            while not self.stopped.wait(self.interval):
+                database.refresh()
+                self.wal.checkpoint(database, self.max_age)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def merge_logged_days(rows: Iterator[tuple[datetime.datetime, str]], logged_days: dict[datetime.date, dict[int, str]]) -> Iterator[tuple[datetime.datetime, str]]:
+    """Merges logged values into time ordered rows from the pages, logged values winning"""
+    pending = sorted(logged_days)
+
+    def logged_rows(day: datetime.date, values: dict[int, str]):
+        day_start = datetime.datetime(day.year, day.month, day.day)
+        for minute in sorted(values):
+            yield day_start + datetime.timedelta(minutes=minute), values[minute]
+
+    for day, day_rows in itertools.groupby(rows, key=lambda x: x[0].date()):
+        while pending and pending[0] < day:
+            logged_day = pending.pop(0)
+            yield from logged_rows(logged_day, logged_days[logged_day])
+        if pending and pending[0] == day:
+            merged = {timestamp.hour * 60 + timestamp.minute: value for timestamp, value in day_rows}
+            merged.update(logged_days[pending.pop(0)])
+            yield from logged_rows(day, merged)
         else:
-            trend_id = max(trends.values(), default=0) + 1
-            num_trends = len(trends)
-
-            if (num_trends + 1) * (trend_name_size_bytes + trend_id_size_bytes) >= num_trends_pages * page_size:
-                file.close()
-                insert_blank_pages(filepath, 1 + num_trends_pages, 1)
-                update_num_trend_pages(filepath, num_trends_pages + 1)
-                # Recursively start over
-                write_data(filepath, trend_name, values)
-                return
+            yield from day_rows
 
-        day_entry_pages = []
-        for _ in range(num_day_entries_pages):
-            day_entry_pages.append(all_index_pages[curr_pos:curr_pos + page_size])
-            curr_pos += page_size
+    for logged_day in pending:
+        yield from logged_rows(logged_day, logged_days[logged_day])
 
-        index_page_start_pos = curr_pos
-        index_pages_bytes: list[bytes] = []
-        for _ in range(num_index_pages):
-            index_pages_bytes.append(all_index_pages[curr_pos:curr_pos + page_size])
-            curr_pos += page_size
 
-        data_page_start_pos = curr_pos
+def list_trends(db, pattern: Optional[str] = None) -> list[str]:
+    with use_database(db, writable=False) as database:
+        trend_names = database.catalog.list(pattern)
+        if database.wal is not None:
+            # Trends only in the log so far
+            logged_names = {trend_name for trend_name, _ in database.wal.days
+                            if trend_name not in database.catalog and (pattern is None or fnmatch.fnmatchcase(trend_name, pattern))}
+            trend_names = sorted(set(trend_names) | logged_names)
+        return trend_names
 
-        # A list of (id, 180 byte day entry)
-        day_entries: list[tuple[int, list[int]]] = [(idx, day) for idx, day in
-                                                    enumerate(read_day_entry_pages(day_entry_pages))]
-        day_entries.sort(key=lambda x: x[1])
 
-        indexes: list[DataIndex] = read_index_page(index_pages_bytes)
+def read_range(db, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> Iterator[tuple[datetime.datetime, str]]:
+    with use_database(db, writable=False) as database:
+        yield from database.read_range(trend_name, start_date, end_date)
 
-        indexes_for_trend: list[DataIndex] = [x for x in indexes if x.trend_id == trends[trend_name]]
 
-        # Group data by day
-        day_grouped: dict[datetime.date, list[tuple[datetime.datetime, str]]] = mputils.groupby(values,
-                                                                                                lambda x: x[0].date())
+def read_range_list(db, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> list[tuple[datetime.datetime, str]]:
+    with use_database(db, writable=False) as database:
+        return database.read_range_list(trend_name, start_date, end_date)
 
-        day_entries_to_add = []
 
-        for day in day_grouped:
-            # day is datetime.date
-            # Get the day entry for the day
-            day_type = to_day_entry([x[0] for x in day_grouped[day]])
-            day_index: Optional[int] = match_day_entry(day_entries, day_type)
+def read_range_arrays(db, trend_name: str, start_date: datetime.date, end_date: datetime.date):
+    with use_database(db, writable=False) as database:
+        return database.read_range_arrays(trend_name, start_date, end_date)
 
-            if day_index is None:
-                # Add a new day entry
-                day_entries_to_add.append((len(day_entries) + len(day_entries_to_add), day_type))
 
-            # toordinal, Jan 1, Year 1, is 1.
-            day_id = day.toordinal() - init_nd_date + 1
+def aggregate(db, trend_name: str, start_date: datetime.date, end_date: datetime.date, function: str):
+    with use_database(db, writable=False) as database:
+        return database.aggregate(trend_name, start_date, end_date, function)
 
-            encoded_values = encode_day_values([x[1] for x in day_grouped[day]])
 
-            if len(encoded_values) > page_size:
-                raise ValueError("Encoded values too large")
+def read_aligned(db, trend_names: list[str], start_date: datetime.date, end_date: datetime.date):
+    with use_database(db, writable=False) as database:
+        return database.read_aligned(trend_names, start_date, end_date)
 
-            # Find the best index page to write to.
-            index_pages = []
-            latest_index: Optional[DataIndex] = None
-            for index in indexes_for_trend:
-                if day_id > index.end_day and (
-                        latest_index is None or day_id - index.end_day < day_id - latest_index.end_day):
-                    latest_index = index
 
-                if index.start_day <= day.toordinal() - init_nd_date + 1 <= index.end_day:
-                    index_pages.append(index)
-                    break
+class Server:
+    """
+    Serves one database to many clients over a local TCP or Unix socket, keeping the metadata and decoded
+    day cache in memory between requests.
 
-            if not index_pages:
-                # Try to see if it fits into latest existing page
-                if latest_index is not None:
-                    data_page_start = data_page_start_pos + latest_index.page_index * page_size
-                    file.seek(data_page_start)
-                    # Read first two bytes
-                    bytes_taken = int.from_bytes(file.read(2), 'big')
-
-                    if bytes_taken + len(encoded_values) < page_size:
-                        # It fits
-                        # First write the number of bytes taken
-                        file.seek(data_page_start)
-                        file.write((bytes_taken + len(encoded_values)).to_bytes(2, 'big'))
-                        # Then move to end and write new data
-                        file.seek(data_page_start + bytes_taken)
-                        file.write(bytes(encoded_values))
+    Each request is a line of JSON, {"id": n, "op": ..., ...}, and is answered with a line {"id": n, "result": ...}
+    or {"id": n, "error": message}. Requests on one connection may be pipelined, answers come back as they finish.
 
+    - write: {"values": {trend name: [[ISO timestamp, value], ...]}}, written to the pages
+    - append: the same, appended to the write ahead log
+    - read: {"trend": name, "start": ISO date, "end": ISO date}, returns [[ISO timestamp, value], ...]
+    - aggregate: {"trend": name, "start": ISO date, "end": ISO date, "function": one of aggregate_functions}
+    - trends: {"pattern": optional glob}, returns trend names
+
+    Writes that arrive while a commit is running are coalesced into the next one, so many collectors
+    writing at once share one write_many and one sync.
+    """
+    def __init__(self, database: Database) -> None:
+        self.database = database
+        # Database access runs off the event loop, one request at a time
+        self.database_lock = asyncio.Lock()
+        # (trend values, future) of writes waiting for the next commit
+        self.pending_writes: list[tuple[dict[str, list[tuple[datetime.datetime, str]]], asyncio.Future]] = []
+        self.writes_ready = asyncio.Event()
+        self.commits = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.committer: Optional[asyncio.Task] = None
+
+    async def start(self, host: Optional[str] = None, port: int = server_port, path: Optional[str] = None):
+        """Listens on the Unix socket path if given, otherwise on host and port"""
+        self.committer = asyncio.create_task(self.commit_writes())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path, limit=server_line_limit)
+        else:
+            self.server = await asyncio.start_server(self.handle, host or "127.0.0.1", port, limit=server_line_limit)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.committer is not None:
+            self.committer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.committer
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        requests: set[asyncio.Task] = set()
+        try:
+            async for line in reader:
+                request = asyncio.create_task(self.respond(line, writer))
+                requests.add(request)
+                request.add_done_callback(requests.discard)
+            if requests:
+                await asyncio.wait(requests)
+        except (ConnectionError, ValueError):
+            # Dropped connection, or a line longer than the limit
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, line: bytes, writer: asyncio.StreamWriter):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            response = {"id": request_id, "result": await self.run(request)}
+        except Exception as error:
+            response = {"id": request_id, "error": str(error) or type(error).__name__}
+        if not writer.is_closing():
+            writer.write(json.dumps(response).encode('utf-8') + b"\n")
+            await writer.drain()
+
+    async def run(self, request: dict):
+        op = request.get("op")
+        if op == "write":
+            future = asyncio.get_running_loop().create_future()
+            self.pending_writes.append((parse_trend_values(request["values"]), future))
+            self.writes_ready.set()
+            await future
+            return None
+        elif op == "append":
+            await self.run_database(append, self.database, parse_trend_values(request["values"]))
+            return None
+        elif op == "read":
+            start_date = datetime.date.fromisoformat(request["start"])
+            end_date = datetime.date.fromisoformat(request["end"])
+            rows = await self.run_database(read_range_list, self.database, request["trend"], start_date, end_date)
+            return [[timestamp.isoformat(), value] for timestamp, value in rows]
+        elif op == "aggregate":
+            start_date = datetime.date.fromisoformat(request["start"])
+            end_date = datetime.date.fromisoformat(request["end"])
+            return await self.run_database(aggregate, self.database, request["trend"], start_date, end_date, request["function"])
+        elif op == "trends":
+            return await self.run_database(list_trends, self.database, request.get("pattern"))
+        raise ValueError(f"Unknown op {op}")
+
+    async def run_database(self, function, *args):
+        async with self.database_lock:
+            return await asyncio.to_thread(function, *args)
+
+    async def commit_writes(self):
+        while True:
+            await self.writes_ready.wait()
+            self.writes_ready.clear()
+            writes, self.pending_writes = self.pending_writes, []
+
+            # In arrival order, so a later write of the same minute wins
+            trend_values: dict[str, list[tuple[datetime.datetime, str]]] = defaultdict(list)
+            for values, _ in writes:
+                for trend_name, trend_rows in values.items():
+                    trend_values[trend_name].extend(trend_rows)
+
+            try:
+                await self.run_database(write_many, self.database, trend_values)
+                self.commits += 1
+                for _, future in writes:
+                    future.set_result(None)
+            except Exception as error:
+                if len(writes) == 1:
+                    writes[0][1].set_exception(error)
+                    continue
+                # Commit them one by one, so only the bad writes fail
+                for values, future in writes:
+                    try:
+                        await self.run_database(write_many, self.database, values)
+                        self.commits += 1
+                        future.set_result(None)
+                    except Exception as error:
+                        future.set_exception(error)
+
+
+def parse_trend_values(values: dict[str, list[list[str]]]) -> dict[str, list[tuple[datetime.datetime, str]]]:
+    return {trend_name: [(datetime.datetime.fromisoformat(timestamp), str(value)) for timestamp, value in rows]
+            for trend_name, rows in values.items()}
+
+
+def format_trend_values(trend_values: dict[str, list[tuple[datetime.datetime, str]]]) -> dict[str, list[list[str]]]:
+    return {trend_name: [[timestamp.isoformat(), value] for timestamp, value in rows] for trend_name, rows in trend_values.items()}
+
+
+async def serve(db, host: Optional[str] = None, port: int = server_port, path: Optional[str] = None):
+    """Serves the database file until cancelled"""
+    with use_database(db) as database:
+        server = Server(database)
+        await server.start(host, port, path)
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+
+class Client:
+    """
+    An asyncio connection to a Server. Calls may be made concurrently, they are pipelined on the one connection.
+    Errors from the server are raised as ValueError.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting: dict[int, asyncio.Future] = {}
+        self.receiver = asyncio.create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, host: Optional[str] = None, port: int = server_port, path: Optional[str] = None) -> 'Client':
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path, limit=server_line_limit)
+        else:
+            reader, writer = await asyncio.open_connection(host or "127.0.0.1", port, limit=server_line_limit)
+        return cls(reader, writer)
+
+    async def __aenter__(self) -> 'Client':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def close(self):
+        self.writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self.writer.wait_closed()
+        self.receiver.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.receiver
+
+    async def receive(self):
+        try:
+            async for line in self.reader:
+                response = json.loads(line)
+                future = self.waiting.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(ValueError(response["error"]))
                 else:
-                    # Write the new index page info
-                    if len(indexes) * 12 + 12 >= num_index_pages * page_size:
-                        file.close()
-                        insert_blank_pages(filepath, 1 + num_trends_pages + num_day_entries_pages + num_index_pages, 1)
-                        update_num_index_pages(filepath, num_index_pages + 1)
-                        # Recursively start over
-                        write_data(filepath, trend_name, values)
-                        return
-
-                    file.seek(index_page_start_pos + len(indexes) * 12)
-                    file.write(trend_id.to_bytes(4, 'big'))
-                    file.write(num_index_pages.to_bytes(4, 'big'))
-                    file.write(day_id.to_bytes(2, 'big'))
-                    file.write(day_id.to_bytes(2, 'big'))
-                    indexes_for_trend.append(DataIndex(trend_id, num_index_pages, day_id, day_id))
-                    indexes.append(DataIndex(trend_id, num_index_pages, day_id, day_id))
-
-                    # Write the new data page
-                    file.seek(data_page_start_pos + num_index_pages * page_size)
-                    file.write(len(encoded_values).to_bytes(2, 'big'))
-                    file.write(bytes(encoded_values))
-            else:
-                # We need to insert/overwrite the data in the existing page
-                raise ValueError("Not implemented yet")
+                    future.set_result(response["result"])
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to server closed"))
+            self.waiting.clear()
 
+    async def request(self, op: str, **arguments):
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        self.writer.write(json.dumps({"id": self.next_id, "op": op, **arguments}).encode('utf-8') + b"\n")
+        await self.writer.drain()
+        return await future
 
-def to_day_entry(datetime_values: list[datetime.datetime]) -> list[int]:
-    # Convert the datetime values to a list of 1s and 0s
-    day_values = [0] * (1440 // 8)
+    async def write_many(self, trend_values: dict[str, list[tuple[datetime.datetime, str]]]):
+        await self.request("write", values=format_trend_values(trend_values))
 
-    for dt in datetime_values:
-        minute = dt.hour * 60 + dt.minute
-        day_values[minute // 8] |= 1 << (minute % 8)
+    async def write_data(self, trend_name: str, values: list[tuple[datetime.datetime, str]]):
+        await self.write_many({trend_name: values})
 
-    return day_values
+    async def append(self, trend_values: dict[str, list[tuple[datetime.datetime, str]]]):
+        await self.request("append", values=format_trend_values(trend_values))
 
+    async def read_range(self, trend_name: str, start_date: datetime.date, end_date: datetime.date) -> list[tuple[datetime.datetime, str]]:
+        rows = await self.request("read", trend=trend_name, start=start_date.isoformat(), end=end_date.isoformat())
+        return [(datetime.datetime.fromisoformat(timestamp), value) for timestamp, value in rows]
 
-def day_compare(day1: list[int], day2: list[int]) -> int:
-    # Return 0 if the days are equal, -1 if day1 < day2, 1 if day1 > day2
-    index = 0
+    async def aggregate(self, trend_name: str, start_date: datetime.date, end_date: datetime.date, function: str):
+        return await self.request("aggregate", trend=trend_name, start=start_date.isoformat(), end=end_date.isoformat(), function=function)
 
-    while index < len(day1) and index < len(day2):
-        if day1[index] < day2[index]:
-            return -1
-        elif day1[index] > day2[index]:
-            return 1
-        index += 1
+    async def list_trends(self, pattern: Optional[str] = None) -> list[str]:
+        return await self.request("trends", pattern=pattern)
 
-    if len(day1) < len(day2):
-        return -1
-    elif len(day1) > len(day2):
-        return 1
-    else:
-        return 0
+
+def read_rows(lines: Iterable[str], delimiter: Optional[str] = None) -> Iterator[tuple[datetime.datetime, str, str]]:
+    """
+    Parses timestamp, trend name, value rows from CSV or TSV lines. The delimiter is guessed from
+    the first line if not given, and a header row is skipped.
+    """
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+    if delimiter is None:
+        delimiter = '\t' if '\t' in first_line else ','
+
+    for line_number, row in enumerate(csv.reader(itertools.chain([first_line], lines), delimiter=delimiter), start=1):
+        if not row:
+            continue
+        if len(row) != 3:
+            raise ValueError(f"Line {line_number}: expected timestamp, trend, value but got {len(row)} fields")
+        try:
+            timestamp = datetime.datetime.fromisoformat(row[0])
+        except ValueError:
+            if line_number == 1:
+                # Header
+                continue
+            raise ValueError(f"Line {line_number}: could not parse timestamp '{row[0]}'")
+        yield timestamp, row[1], row[2]
+
+
+def finished_days(rows: Iterable[tuple[datetime.datetime, str, str]]) -> Iterator[tuple[str, list[tuple[datetime.datetime, str]]]]:
+    """
+    Groups rows by trend and day. A trend's day is yielded as soon as a row for a different day of that
+    trend arrives, so only one open day per trend is held in memory. Rows should be ordered by time
+    within each trend; a day that shows up again later is merged when it is written.
+    """
+    open_days: dict[str, tuple[datetime.date, list[tuple[datetime.datetime, str]]]] = {}
+    for timestamp, trend_name, value in rows:
+        day = timestamp.date()
+        open_day = open_days.get(trend_name)
+        if open_day is None or open_day[0] != day:
+            if open_day is not None:
+                yield trend_name, open_day[1]
+            open_day = (day, [])
+            open_days[trend_name] = open_day
+        open_day[1].append((timestamp, value))
+
+    for trend_name, (_, values) in open_days.items():
+        yield trend_name, values
+
+
+def load(db, rows: Iterable[tuple[datetime.datetime, str, str]], chunk_values: int = 100000, workers: int = 0) -> int:
+    """
+    Streams rows into the database, writing finished days with write_many each time about chunk_values
+    values have collected. Returns the number of values loaded.
+    With workers, days are grouped, rolled up, and encoded across that many worker processes.
+    """
+    num_values = 0
+    with use_database(db) as database, contextlib.ExitStack() as stack:
+        executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(workers)) if workers > 0 else None
+        chunk: dict[str, list[tuple[datetime.datetime, str]]] = defaultdict(list)
+        chunk_size = 0
+        for trend_name, values in finished_days(rows):
+            chunk[trend_name].extend(values)
+            chunk_size += len(values)
+            if chunk_size >= chunk_values:
+                database.write_many(chunk, executor)
+                num_values += chunk_size
+                chunk = defaultdict(list)
+                chunk_size = 0
+
+        if chunk:
+            database.write_many(chunk, executor)
+            num_values += chunk_size
+
+    return num_values
+
+
+def minute_values(values: list[tuple[datetime.datetime, str]]) -> dict[int, str]:
+    """Maps minute of the day to value, keeping the last value written within each minute,
+    since a day type only has one bit per minute.
+    """
+    return {dt.hour * 60 + dt.minute: value for dt, value in values}
+
+
+def prepare_days(values: list[tuple[datetime.datetime, str]], trial: bool = False) \
+        -> list[tuple[datetime.date, list[int], list[str], bytes, bytes, Optional[tuple]]]:
+    """
+    Groups a trend's values into days, and returns (date, minutes, values, day type bitmap, encoded rollup, trial
+    encodings) for each. The trial encodings, from trial_encode_days, are only worked out with trial, else None.
+    """
+    day_grouped: dict[datetime.date, list[tuple[datetime.datetime, str]]] = mputils.groupby(values, lambda x: x[0].date())
+    prepared = []
+    for day, grouped_values in day_grouped.items():
+        values_by_minute = minute_values(grouped_values)
+        minutes = sorted(values_by_minute)
+        day_values = [values_by_minute[minute] for minute in minutes]
+        prepared.append((day, minutes, day_values, bytes(minutes_to_day_entry(minutes)),
+                         encode_rollup(day_rollup(minutes, day_values)), None))
+    if trial:
+        trials = trial_encode_days([day_values for _, _, day_values, _, _, _ in prepared])
+        prepared = [(*day[:-1], day_trials) for day, day_trials in zip(prepared, trials)]
+    return prepared
+
+
+def prepare_trial_days(trends: list[list[tuple[datetime.datetime, str]]]):
+    """prepare_days with trial encodings for a chunk of trends, run in a worker process"""
+    return [prepare_days(values, trial=True) for values in trends]
+
+
+def new_data_page(page_size: int) -> bytearray:
+    page = bytearray(page_size)
+    page[0:2] = data_page_header_size_bytes.to_bytes(2, 'big')
+    return page
 
 
-def match_day_entry(day_entries: list[tuple[int, list[int]]], day_times: list[int]) -> Optional[int]:
-    # list[int] represents the byte array where each bit is a minute of the day
-    # day_times is a list of datetime objects
-    L = 0
-    R = len(day_entries) - 1
+def page_slot_position(page, slot_index: int) -> int:
+    """Slots are stored from the end of the page backwards, slot 0 last"""
+    return len(page) - (slot_index + 1) * day_slot_size_bytes
 
-    while L <= R:
-        m = math.floor((L + R) / 2)
-        test_entry = day_entries[m][1]
 
-        if day_compare(test_entry, day_times) < 0:
-            L = m + 1
-        elif day_compare(test_entry, day_times) > 0:
-            R = m - 1
+def page_slot_day(page, slot_index: int) -> int:
+    pos = page_slot_position(page, slot_index)
+    return int.from_bytes(page[pos:pos + 2], 'big')
+
+
+def find_page_slot(page, day_id: int) -> int:
+    """Index of the first slot with a day id of at least day_id, found by binary search"""
+    low = 0
+    high = int.from_bytes(page[2:4], 'big')
+    while low < high:
+        middle = (low + high) // 2
+        if page_slot_day(page, middle) < day_id:
+            low = middle + 1
         else:
-            return test_entry[0]
+            high = middle
+    return low
 
+
+def iter_page_days(page, start_day: int = 0, end_day: int = 0xFFFF):
+    """Yields (day id, day type id, start position, end position) of the encoded values of each day in a data page
+    from start_day through end_day, in day order, without decoding anything
+    """
+    num_days = int.from_bytes(page[2:4], 'big')
+    for slot_index in range(find_page_slot(page, start_day), num_days):
+        pos = page_slot_position(page, slot_index)
+        day_id = int.from_bytes(page[pos:pos + 2], 'big')
+        if day_id > end_day:
+            return
+        start = int.from_bytes(page[pos + 4:pos + 6], 'big')
+        yield day_id, int.from_bytes(page[pos + 2:pos + 4], 'big'), start, start + int.from_bytes(page[pos + 6:pos + 8], 'big')
+
+
+def find_page_day(page, day_id: int) -> Optional[tuple[int, int, int]]:
+    """(day type id, start position, end position) of the encoded values of a day in a data page, if stored there"""
+    for _, day_type_id, start, end in iter_page_days(page, day_id, day_id):
+        return day_type_id, start, end
     return None
 
 
-def read_day_entry_pages(pages: list[bytes]) -> list[list[int]]:
+def add_page_day(page: bytearray, day_id: int, day_type_id: int, encoded_values: bytes) -> bool:
+    """Adds a day to a data page, returning False if there is not room for it"""
+    data_end = int.from_bytes(page[0:2], 'big')
+    num_days = int.from_bytes(page[2:4], 'big')
+    if data_end + len(encoded_values) > page_slot_position(page, num_days):
+        return False
+
+    page[data_end:data_end + len(encoded_values)] = encoded_values
+    # Slots after the new one move down a slot
+    slot_index = find_page_slot(page, day_id)
+    slots_end = page_slot_position(page, slot_index - 1)
+    new_slot = page_slot_position(page, slot_index)
+    page[page_slot_position(page, num_days):new_slot] = page[page_slot_position(page, num_days - 1):slots_end]
+    page[new_slot:new_slot + day_slot_size_bytes] = (day_id.to_bytes(2, 'big') + day_type_id.to_bytes(2, 'big') +
+                                                    data_end.to_bytes(2, 'big') + len(encoded_values).to_bytes(2, 'big'))
+    page[0:2] = (data_end + len(encoded_values)).to_bytes(2, 'big')
+    page[2:4] = (num_days + 1).to_bytes(2, 'big')
+    return True
+
+
+def remove_page_day(page: bytearray, day_id: int):
+    """Removes a day from a data page, shifting the values of later days down"""
+    data_end = int.from_bytes(page[0:2], 'big')
+    num_days = int.from_bytes(page[2:4], 'big')
+    slot_index = find_page_slot(page, day_id)
+    slot = page_slot_position(page, slot_index)
+    start = int.from_bytes(page[slot + 4:slot + 6], 'big')
+    length = int.from_bytes(page[slot + 6:slot + 8], 'big')
+
+    page[start:data_end - length] = page[start + length:data_end]
+    stats.bytes_moved += data_end - length - start
+    page[data_end - length:data_end] = bytes(length)
+    # Slots after the removed one move up a slot
+    first_slot = page_slot_position(page, num_days - 1)
+    page[first_slot + day_slot_size_bytes:slot + day_slot_size_bytes] = page[first_slot:slot]
+    page[first_slot:first_slot + day_slot_size_bytes] = bytes(day_slot_size_bytes)
+    for other_slot in range(num_days - 1):
+        pos = page_slot_position(page, other_slot)
+        other_start = int.from_bytes(page[pos + 4:pos + 6], 'big')
+        if other_start > start:
+            page[pos + 4:pos + 6] = (other_start - length).to_bytes(2, 'big')
+
+    page[0:2] = (data_end - length).to_bytes(2, 'big')
+    page[2:4] = (num_days - 1).to_bytes(2, 'big')
+
+
+def to_day_entry(datetime_values: list[datetime.datetime]) -> list[int]:
+    # Convert the datetime values to a list of 1s and 0s
+    return minutes_to_day_entry([dt.hour * 60 + dt.minute for dt in datetime_values])
+
+
+def minutes_to_day_entry(minutes: list[int]) -> list[int]:
+    day_values = [0] * (1440 // 8)
+
+    for minute in minutes:
+        day_values[minute // 8] |= 1 << (minute % 8)
+
+    return day_values
+
+
+def day_entry_minutes(day_entry: list[int]) -> list[int]:
+    """Minutes of the day set in a day entry, in order"""
+    return [byte_index * 8 + bit for byte_index, byte in enumerate(day_entry) for bit in range(8) if byte >> bit & 1]
+
+
+def day_type_minutes(day_entry: bytes):
+    """Minutes of the day set in a day entry, as a NumPy int64 array"""
+    import numpy as np
+    # Bit n of byte k is minute 8k + n
+    return np.flatnonzero(np.unpackbits(np.frombuffer(day_entry, dtype=np.uint8), bitorder='little')).astype(np.int64)
+
+
+def read_day_entry_pages(pages: list[bytes]) -> list[bytes]:
     # 1. For each day entry:
     # - 1 byte: non-zero byte to indicate following 180 bits are good
     # - 180 bytes: day format. Bit string of 1440 bits, 1 for each minute of the day.
@@ -324,13 +2511,13 @@ def read_day_entry_pages(pages: list[bytes]) -> list[list[int]]:
     day_entries = []
     for page in pages:
         pos_in_page = 0
-        while pos_in_page < len(page):
+        while pos_in_page + day_entry_size_bytes <= len(page):
             if page[pos_in_page] == 0:
                 break
             pos_in_page += 1
             day_type = page[pos_in_page:pos_in_page + 180]
             pos_in_page += 180
-            day_entries.append(list(day_type))
+            day_entries.append(bytes(day_type))
     return day_entries
 
 
@@ -343,15 +2530,15 @@ def read_trend_pages(pages: list[bytes]) -> dict[str, int]:
     Returns: dictionary from trend name to integer trend id
     """
     trends = {}
-    pos_in_page = 0
     for page in pages:
-        while pos_in_page < len(page):
+        pos_in_page = 0
+        while pos_in_page + trend_id_size_bytes + trend_name_size_bytes <= len(page):
             trend_id = int.from_bytes(page[pos_in_page:pos_in_page + 4], 'big')
             if trend_id == 0:
                 break
             pos_in_page += 4
-            trend_name = page[pos_in_page:pos_in_page + trend_name_size].decode('utf-8').rstrip('\x00')
-            pos_in_page += trend_name_size
+            trend_name = bytes(page[pos_in_page:pos_in_page + trend_name_size_bytes]).decode('utf-8').rstrip('\x00')
+            pos_in_page += trend_name_size_bytes
 
             trends[trend_name] = trend_id
 
@@ -367,9 +2554,9 @@ def read_index_page(pages: list[bytes]) -> list[DataIndex]:
     # Null filled after the last index record
     indexes = []
 
-    pos_in_page = 0
     for page in pages:
-        while pos_in_page < len(page):
+        pos_in_page = 0
+        while pos_in_page + index_record_size_bytes <= len(page):
             trend_id = int.from_bytes(page[pos_in_page:pos_in_page + 4], 'big')
             if trend_id == 0:
                 break
@@ -381,7 +2568,7 @@ def read_index_page(pages: list[bytes]) -> list[DataIndex]:
             end_day = int.from_bytes(page[pos_in_page:pos_in_page + 2], 'big')
             pos_in_page += 2
 
-            indexes.append(DataIndex(trend_id, page_index, start_day, end_day))
+            indexes.append(DataIndex(trend_id, page_index, start_day, end_day, len(indexes)))
 
     return indexes
 
@@ -421,7 +2608,7 @@ def build_huffman_tree_from_dict(frequency_dict: dict[str, int]):
 def build_huffman_tree(text):
     # Count frequency of appearance of each character
     frequency = Counter(text)
-    build_huffman_tree_from_dict(frequency)
+    return build_huffman_tree_from_dict(frequency)
 
 
 def generate_codes(node, prefix="", code=None):
@@ -448,6 +2635,114 @@ def huffman_encoding(text):
     return encoded_text, huffman_codes
 
 
+class HuffmanDecoder:
+    """
+    Table driven decoder for a prefix code, decoding a whole byte of input per lookup.
+
+    The states are the internal nodes of the code tree, that is the partial code read so far. For each
+    state and input byte the tables hold the symbols completed within that byte, joined, and the state
+    after it. They are built by composing the 1 bit transitions into 2, 4, then 8 bit transitions.
+    """
+    def __init__(self, codes: list[tuple[str, int, int]]) -> None:
+        # codes: (symbol, code, code length in bits)
+        leaves: dict[tuple[int, int], str] = {}
+        states: dict[tuple[int, int], int] = {(0, 0): 0}
+        for symbol, code, length in codes:
+            leaves[(length, code)] = symbol
+            for prefix_length in range(1, length):
+                states.setdefault((prefix_length, code >> (length - prefix_length)), len(states))
+
+        # Bits that do not lead to any code go to a final state that never leaves
+        self.invalid_state = len(states)
+        num_states = len(states) + 1
+
+        # Indexed by state * 2 + bit
+        self.bit_symbols: list[str] = []
+        self.bit_states: list[int] = []
+        for length, code in states:
+            for bit in (0, 1):
+                key = (length + 1, (code << 1) | bit)
+                self.bit_symbols.append(leaves.get(key, ""))
+                self.bit_states.append(0 if key in leaves else states.get(key, self.invalid_state))
+        self.bit_symbols.extend(["", ""])
+        self.bit_states.extend([self.invalid_state] * 2)
+
+        symbols, next_states = self.bit_symbols, self.bit_states
+        for bits in (1, 2, 4):
+            width = 1 << bits
+            wide_symbols: list[str] = []
+            wide_states: list[int] = []
+            for high in range(num_states * width):
+                high_symbols = symbols[high]
+                low = next_states[high] * width
+                if high_symbols:
+                    wide_symbols.extend(map(high_symbols.__add__, symbols[low:low + width]))
+                else:
+                    wide_symbols.extend(symbols[low:low + width])
+                wide_states.extend(next_states[low:low + width])
+            symbols, next_states = wide_symbols, wide_states
+
+        # Indexed by state * 256 + byte. States are kept premultiplied by 256.
+        self.byte_symbols = symbols
+        self.byte_states = [state * 256 for state in next_states]
+
+    def decode(self, data, num_bits: int) -> str:
+        byte_symbols = self.byte_symbols
+        byte_states = self.byte_states
+        full_bytes = num_bits // 8
+
+        pieces = []
+        append = pieces.append
+        state = 0
+        for byte in bytes(data[:full_bytes]):
+            entry = state + byte
+            append(byte_symbols[entry])
+            state = byte_states[entry]
+        state //= 256
+
+        # Any bits of a last partial byte
+        remaining_bits = num_bits - full_bytes * 8
+        for shift in range(7, 7 - remaining_bits, -1):
+            entry = state * 2 + ((data[full_bytes] >> shift) & 1)
+            append(self.bit_symbols[entry])
+            state = self.bit_states[entry]
+
+        if state != 0:
+            raise ValueError("Invalid Huffman code")
+        return "".join(pieces)
+
+
+def huffman_code_lengths(frequency_dict: dict[str, int]) -> dict[str, int]:
+    """Code length of each symbol in a Huffman tree built from the frequencies"""
+    lengths = {symbol: len(code) for symbol, code in generate_codes(build_huffman_tree_from_dict(frequency_dict)).items()}
+    if len(lengths) == 1:
+        # A lone symbol still needs one bit per occurrence
+        lengths = {symbol: 1 for symbol in lengths}
+    return lengths
+
+
+def canonical_codes(code_lengths: dict[str, int]) -> list[tuple[str, int, int]]:
+    """
+    Assigns canonical Huffman codes: symbols ordered by (code length, symbol) get consecutive codes,
+    shifted left whenever the length grows. Returns (symbol, code, length) in that order.
+    """
+    codes = []
+    code = 0
+    prev_length = 0
+    for symbol, length in sorted(code_lengths.items(), key=lambda x: (x[1], x[0])):
+        code <<= length - prev_length
+        codes.append((symbol, code, length))
+        code += 1
+        prev_length = length
+    return codes
+
+
+@functools.lru_cache(maxsize=256)
+def huffman_decoder(codes: tuple[tuple[str, int, int], ...]) -> HuffmanDecoder:
+    """Decoders are cached by code table. With canonical codes, days with the same symbols and code lengths share one."""
+    return HuffmanDecoder(list(codes))
+
+
 def str_to_bytes(s: str) -> list[int]:
     """Converts a string of 1s and 0s to a list of bytes"""
     # Input is list of 1s and 0s
@@ -471,143 +2766,643 @@ bit_strings = {
 }
 
 
-def encode_day_values(day_values: list[str]) -> list[int]:
-    key_counts = {}
-    runs = []
-    prev_value = None
-    run_length = 0
-    symbol_counts: dict[str, int] = {}
+# Encoding type bytes, the first byte of each encoded day
+dictionary_encoding_type = 0
+huffman_encoding_type = 1
+numeric_encoding_type = 2
+all_encodings = (dictionary_encoding_type, huffman_encoding_type, numeric_encoding_type)
+encoding_names = {dictionary_encoding_type: "dictionary", huffman_encoding_type: "huffman", numeric_encoding_type: "numeric"}
+
+# Rollup type bytes, the first byte of each encoded rollup
+rollup_numeric = 0
+rollup_states = 1
+rollup_numeric_states = 2
+rollup_max_bytes = 1024  # Longest rollup stored, days with more states keep only their count
+rollup_max_integer_states = 16  # Whole number days with up to this many distinct values, like 0/1 statuses, also keep states
+# A value a numeric day may hold. Unlike float(), no exponents, underscores, nan, or inf.
+decimal_pattern = re.compile(r'-?[0-9]+(?:\.[0-9]+)?')
+aggregate_functions = ("count", "min", "max", "sum", "mean", "first", "last", "durations")
+
+
+# Values separated by record separators, each with a trailing separator. Negative zeros like '-0.0' are left out,
+# they would come back as '0.0'.
+numeric_day_pattern = re.compile(r'(?:(?!-0(?:\.0+)?\x1E)-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?\x1E)+')
+# Most decimal places a numeric encoded day has. Any more and dividing by the scale as a float can round a
+# value to another decimal, or underflow.
+numeric_max_scale = 15
+
+# Signed array typecodes by their size in bytes
+delta_typecodes = {array.array(code).itemsize: code for code in 'bhilq'}
+
+
+def encode_varint(value: int, output_bytes: list[int]):
+    """Appends an unsigned LEB128 varint: 7 bits per byte, high bit set on all but the last byte"""
+    while value > 0x7F:
+        output_bytes.append((value & 0x7F) | 0x80)
+        value >>= 7
+    output_bytes.append(value)
+
+
+def decode_varint(encoded_bytes, index: int) -> tuple[int, int]:
+    """Returns the value and the index after it"""
+    value = 0
+    shift = 0
+    while True:
+        byte = encoded_bytes[index]
+        index += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, index
+        shift += 7
+
+
+def zigzag(value: int) -> int:
+    # Interleaves negatives and positives, 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def encode_numeric_values(day_values: list[str]) -> Optional[list[int]]:
+    """
+    Encodes a day of plain decimal strings, like '487.60' or '-3', as integers scaled by their number of
+    decimal places. Returns None if any value would not decode back to the identical string, or has more
+    than numeric_max_scale decimal places.
+
+    - 1 byte: 2 to represent numeric encoding
+    - varint: number of values
+    - varint: number of runs of equal decimal places
+    - For each run:
+        - varint: number of values in the run
+        - varint: decimal places
+    - 1 byte: delta width in bytes, 1, 2, 4 or 8
+    - For each value, a signed little endian delta of that width: the value scaled to the largest number of
+      decimal places, minus the previous scaled value (the first value is stored as is).
+      The smallest number of the width marks a delta too large for it.
+    - For each marked delta, a zigzag varint of the delta
+    """
+    joined = '\x1E'.join(day_values)
+    if numeric_day_pattern.fullmatch(joined + '\x1E') is None:
+        return None
+    scales = [len(value) - 1 - value.index('.') if '.' in value else 0 for value in day_values]
+    if max(scales) > numeric_max_scale:
+        return None
+    mantissas = list(map(int, joined.replace('.', '').split('\x1E')))
+
+    max_scale = max(scales)
+    output_bytes = [numeric_encoding_type]
+    encode_varint(len(day_values), output_bytes)
+
+    scale_runs = [(scale, len(list(run))) for scale, run in itertools.groupby(scales)]
+    encode_varint(len(scale_runs), output_bytes)
+    for scale, run_length in scale_runs:
+        encode_varint(run_length, output_bytes)
+        encode_varint(scale, output_bytes)
+
+    deltas = []
+    previous = 0
+    for scale, mantissa in zip(scales, mantissas):
+        scaled = mantissa * 10 ** (max_scale - scale)
+        deltas.append(scaled - previous)
+        previous = scaled
+
+    # Pick the width with the fewest total bytes, a few outliers, like the first value, go to varints
+    # instead of widening every delta.
+    best_width = 0
+    best_size = 0
+    for width in delta_typecodes:
+        limit = 1 << (8 * width - 1)
+        outliers = [delta for delta in deltas if not -limit < delta < limit]
+        size = width * len(deltas) + sum((zigzag(delta).bit_length() + 6) // 7 for delta in outliers)
+        if best_width == 0 or size < best_size:
+            best_width = width
+            best_size = size
+        if not outliers:
+            # Wider deltas would only take more space
+            break
+
+    limit = 1 << (8 * best_width - 1)
+    packed = array.array(delta_typecodes[best_width], [delta if -limit < delta < limit else -limit for delta in deltas])
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    output_bytes.append(best_width)
+    output_bytes.extend(packed.tobytes())
+    for delta in deltas:
+        if not -limit < delta < limit:
+            encode_varint(zigzag(delta), output_bytes)
+
+    return output_bytes
+
 
-    for value in day_values:
-        if value != prev_value:
-            if prev_value is not None:
-                runs.append((prev_value, run_length))
-            run_length = 1
-            prev_value = value
+def decode_numeric_values(encoded_bytes, start_index=0) -> tuple[list[str], int]:
+    num_values, index = decode_varint(encoded_bytes, start_index + 1)
+    num_scale_runs, index = decode_varint(encoded_bytes, index)
+    scale_runs: list[tuple[int, int]] = []
+    for _ in range(num_scale_runs):
+        run_length, index = decode_varint(encoded_bytes, index)
+        scale, index = decode_varint(encoded_bytes, index)
+        scale_runs.append((run_length, scale))
+
+    width = encoded_bytes[index]
+    index += 1
+    packed = array.array(delta_typecodes[width])
+    packed.frombytes(bytes(encoded_bytes[index:index + width * num_values]))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    index += width * num_values
+
+    marker = -(1 << (8 * width - 1))
+    if marker in packed:
+        deltas = packed.tolist()
+        for position, delta in enumerate(deltas):
+            if delta == marker:
+                value, index = decode_varint(encoded_bytes, index)
+                deltas[position] = value >> 1 if value & 1 == 0 else -((value + 1) >> 1)
+        scaled_values = list(itertools.accumulate(deltas))
+    else:
+        scaled_values = list(itertools.accumulate(packed))
+
+    max_scale = max((scale for _, scale in scale_runs), default=0)
+    day_values = []
+    position = 0
+    for run_length, scale in scale_runs:
+        # Exact, the scaled values were built by multiplying the mantissas up
+        run = scaled_values[position:position + run_length]
+        if max_scale != scale:
+            run = [scaled // 10 ** (max_scale - scale) for scaled in run]
+        if scale == 0:
+            day_values.extend(map(str, run))
+        elif scale <= numeric_max_scale and max(map(abs, run)) < 10 ** 15:
+            # Within 15 digits the nearest double rounds back to the exact decimal, and formatting the
+            # whole run at once is much faster than building each string from its digits
+            divisor = 10 ** scale
+            formatted = (f'%.{scale}f\x1E' * run_length) % tuple([mantissa / divisor for mantissa in run])
+            day_values.extend(formatted.split('\x1E')[:-1])
         else:
-            run_length += 1
+            divisor = 10 ** scale
+            for mantissa in run:
+                whole, fraction = divmod(abs(mantissa), divisor)
+                day_values.append(f"{'-' if mantissa < 0 else ''}{whole}.{fraction:0{scale}d}")
+        position += run_length
 
-        key_counts[value] = key_counts.get(value, 0) + 1
+    if len(day_values) != num_values:
+        raise ValueError("Corrupt numeric encoding")
+    return day_values, index
 
-        for c in value:
-            symbol_counts[c] = symbol_counts.get(c, 0) + 1
 
-    runs.append((prev_value, run_length))
+class CodecStats:
+    """
+    Encodings chosen for the days of one trend, with the bytes they took. After the first few days, encodings
+    that have never been the smallest for the trend are skipped, except on every probe_interval'th day in case
+    the data has changed.
+    """
+    warmup_days = 8
+    probe_interval = 32
 
-    percent_unique = len(key_counts) / len(day_values)
+    def __init__(self) -> None:
+        self.days = 0
+        self.wins: Counter[int] = Counter()
+        # UTF-8 bytes of the values, separators included, and bytes encoded, of the days each encoding won
+        self.value_bytes: Counter[int] = Counter()
+        self.encoded_bytes: Counter[int] = Counter()
 
-    if percent_unique < 0.2:
-        # Do a dictionary encoding, followed by a run-length encoding
-        keys = list(key_counts.keys())
+    def candidates(self) -> tuple[int, ...]:
+        if self.days < self.warmup_days or self.days % self.probe_interval == 0:
+            return all_encodings
+        return tuple(encoding for encoding in all_encodings if self.wins[encoding])
 
-        # First byte is 0 to signal dictionary/RL encoding
-        # Second byte is the number of keys
-        output_bytes: list[int] = [0, len(keys)]
+    def record(self, encoding: int, value_bytes: int, encoded_bytes: int):
+        self.days += 1
+        self.wins[encoding] += 1
+        self.value_bytes[encoding] += value_bytes
+        self.encoded_bytes[encoding] += encoded_bytes
 
-        # Next followed by 1 byte length of following UTF-8 encoded string for each unique value. Means max 256 length strings.
-        for key in keys:
-            output_bytes.append(len(key))
-            output_bytes.extend(list(key.encode('utf-8')))
+    def ratio(self, encoding: int) -> float:
+        """Encoded bytes over value bytes for the days the encoding won"""
+        return self.encoded_bytes[encoding] / self.value_bytes[encoding] if self.value_bytes[encoding] else 0.0
 
-        output_bytes.append(len(runs))
 
-        # Now RLE each value
-        for value, length in runs:
-            value_index = keys.index(value)
-            # Handle case where run length is greater than 255
-            while length > 255:
-                output_bytes.append(255)
-                output_bytes.append(value_index)
-                length -= 255
+def varint_size(value: int) -> int:
+    return max(1, (value.bit_length() + 6) // 7)
 
-            output_bytes.append(length)
-            output_bytes.append(value_index)
 
-        return output_bytes
+def encode_dictionary_values(day_values: list[str]) -> list[int]:
+    """
+    - 1 byte: 0 to represent dictionary encoding
+    - varint: number of keys in dictionary
+    - For each key:
+        - varint: length of UTF-8 encoded key
+        - n bytes: UTF-8 string key
+    - varint: number of runs
+    - For each run:
+        - varint: length of run
+        - varint: key, zero indexed
+    """
+    runs = [(value, len(list(run))) for value, run in itertools.groupby(day_values)]
+    key_indexes: dict[str, int] = {}
+    for value, _ in runs:
+        if value not in key_indexes:
+            key_indexes[value] = len(key_indexes)
+
+    output_bytes = [dictionary_encoding_type]
+    encode_varint(len(key_indexes), output_bytes)
+    for key in key_indexes:
+        encoded_key = key.encode('utf-8')
+        encode_varint(len(encoded_key), output_bytes)
+        output_bytes.extend(encoded_key)
+
+    encode_varint(len(runs), output_bytes)
+    for value, length in runs:
+        encode_varint(length, output_bytes)
+        encode_varint(key_indexes[value], output_bytes)
 
-    else:
-        # Do a Huffman encoding. Input is the data values, assumed separated by 'Record Separator' character, 1E
-        # - 1 byte: 1 to represent Huffman encoding
-        # - 1 byte: number of symbols
-        # - For each symbol (n):
-        #     - 1 byte: length of symbol
-        #     - m bytes: UTF-8 string symbol
-        #     - 1 byte: length of Huffman code (implies no code > 255 bits)
-        # - o bytes: Huffman codes, padded to byte boundary
-        # - 2 bytes: number of *bits* of data
-        # - p bytes: data, padded to byte boundary
+    return output_bytes
 
-        # First byte is 1 to signal Huffman encoding
-        output_bytes = [1]
 
-        # Need to add fake 'Record Separator' character to the symbol counts
-        symbol_counts[chr(0x1E)] = len(day_values) - 1
+def huffman_symbol_counts(day_values: list[str]) -> dict[str, int]:
+    # Values are joined by the 'Record Separator' character, 1E, which is coded like any other symbol
+    symbol_counts: dict[str, int] = Counter("".join(day_values))
+    symbol_counts["\x1E"] = len(day_values) - 1
+    return symbol_counts
 
-        # Encode the number of keys
-        output_bytes.append(len(symbol_counts))
 
-        root = build_huffman_tree_from_dict(symbol_counts)
-        huffman_codes = generate_codes(root)
+def huffman_encoded_size(symbol_counts: dict[str, int], code_lengths: dict[str, int]) -> int:
+    num_bits = sum(count * code_lengths[symbol] for symbol, count in symbol_counts.items())
+    symbols_size = sum(len(symbol.encode('utf-8')) + 2 for symbol in code_lengths)
+    return 1 + varint_size(len(code_lengths)) + symbols_size + varint_size(num_bits) + (num_bits + 7) // 8
 
-        code_items = list(huffman_codes.items())
 
-        # Encode the symbols
-        all_codes = []
-        for symbol, code in code_items:
-            output_bytes.append(len(symbol))
-            output_bytes.extend(list(symbol.encode('utf-8')))
-            output_bytes.append(len(code))
-            all_codes.append(code)
+def encode_huffman_values(day_values: list[str], code_lengths: dict[str, int]) -> list[int]:
+    """
+    - 1 byte: 1 to represent Huffman encoding
+    - varint: number of symbols
+    - For each symbol (n), in canonical order (by code length, then symbol):
+        - 1 byte: length of UTF-8 encoded symbol
+        - m bytes: UTF-8 string symbol
+        - 1 byte: length of Huffman code (implies no code > 255 bits)
+    - varint: number of *bits* of data
+    - p bytes: data, padded to byte boundary
+
+    The codes are canonical, so they are rebuilt from the code lengths alone.
+    """
+    output_bytes = [huffman_encoding_type]
+    codes = canonical_codes(code_lengths)
+
+    encode_varint(len(codes), output_bytes)
+    for symbol, _, length in codes:
+        encoded_symbol = symbol.encode('utf-8')
+        output_bytes.append(len(encoded_symbol))
+        output_bytes.extend(encoded_symbol)
+        output_bytes.append(length)
+
+    # Encode the data into an integer bit buffer, emitting whole bytes as it fills
+    symbol_codes = {symbol: (code, length) for symbol, code, length in codes}
+    separator_code, separator_length = symbol_codes["\x1E"]
+    value_codes: dict[str, tuple[int, int]] = {}
+    data = bytearray()
+    bit_buffer = 0
+    buffer_bits = 0
+    num_bits = 0
+    for value_index, value in enumerate(day_values):
+        if value not in value_codes:
+            value_code = 0
+            value_length = 0
+            for char in value:
+                code, length = symbol_codes[char]
+                value_code = (value_code << length) | code
+                value_length += length
+            value_codes[value] = (value_code, value_length)
+        value_code, value_length = value_codes[value]
+
+        if value_index > 0:
+            bit_buffer = (bit_buffer << separator_length) | separator_code
+            buffer_bits += separator_length
+        bit_buffer = (bit_buffer << value_length) | value_code
+        buffer_bits += value_length
+
+        if buffer_bits >= 64:
+            keep_bits = buffer_bits % 8
+            data += (bit_buffer >> keep_bits).to_bytes((buffer_bits - keep_bits) // 8, 'big')
+            num_bits += buffer_bits - keep_bits
+            bit_buffer &= (1 << keep_bits) - 1
+            buffer_bits = keep_bits
+
+    # Pad the last byte with zeros
+    num_bits += buffer_bits
+    pad_bits = (8 - buffer_bits % 8) % 8
+    data += (bit_buffer << pad_bits).to_bytes((buffer_bits + pad_bits) // 8, 'big')
+
+    encode_varint(num_bits, output_bytes)
+    output_bytes.extend(data)
 
-        # Dump all the huffman codes concatenated
-        output_bytes.extend(str_to_bytes(''.join(all_codes)))
+    return output_bytes
 
-        # Encode the data
-        text = "\x1E".join(day_values)
-        # Literal string of 1s and 0s
-        encoded_text = ''.join(huffman_codes[char] for char in text)
 
-        if len(encoded_text) > 65535:
-            raise ValueError("Encoded text too large")
+def trial_encodings(day_values: list[str], encodings: tuple[int, ...]) -> tuple[dict[int, int], dict[int, bytes], dict[str, int]]:
+    """
+    Sizes of the given encodings that fit the day, the bytes of those that had to be encoded to size them, and the
+    Huffman code lengths if Huffman was sized. Numeric and dictionary encodings are tried outright, the Huffman
+    size is worked out from the symbol counts without encoding. Huffman codes the values joined by record
+    separators, so it doesn't fit a day with a separator in a value.
+    """
+    sizes: dict[int, int] = {}
+    encoded: dict[int, bytes] = {}
+    code_lengths: dict[str, int] = {}
+    for encoding in encodings:
+        started = time.perf_counter()
+        if encoding == numeric_encoding_type:
+            numeric_bytes = encode_numeric_values(day_values)
+            if numeric_bytes is not None:
+                encoded[encoding] = bytes(numeric_bytes)
+                sizes[encoding] = len(numeric_bytes)
+        elif encoding == dictionary_encoding_type:
+            encoded[encoding] = bytes(encode_dictionary_values(day_values))
+            sizes[encoding] = len(encoded[encoding])
+        elif encoding == huffman_encoding_type and not any('\x1E' in value for value in day_values):
+            symbol_counts = huffman_symbol_counts(day_values)
+            code_lengths = huffman_code_lengths(symbol_counts)
+            sizes[encoding] = huffman_encoded_size(symbol_counts, code_lengths)
+        stats.encode_seconds[encoding] += time.perf_counter() - started
+    return sizes, encoded, code_lengths
+
+
+def trial_encode_days(days: list[list[str]]) -> list[tuple[dict[int, int], dict[int, bytes], dict[str, int]]]:
+    """
+    trial_encodings over every encoding for a chunk of days, run in a worker process. Huffman is encoded too when
+    it is the smallest, since it will nearly always be picked then.
+    """
+    trials = []
+    for day_values in days:
+        sizes, encoded, code_lengths = trial_encodings(day_values, all_encodings)
+        if min(sizes, key=lambda x: (sizes[x], x)) == huffman_encoding_type:
+            encoded[huffman_encoding_type] = bytes(encode_huffman_values(day_values, code_lengths))
+        trials.append((sizes, encoded, code_lengths))
+    return trials
 
-        # Dump the total number of bytes, in huffman_bytes_for_bytes bytes
-        num_bits = len(encoded_text)
 
-        output_bytes.extend(num_bits.to_bytes(huffman_bytes_for_bytes, 'big'))
-        output_bytes.extend(str_to_bytes(encoded_text))
+def encode_day_values(day_values: list[str], codec_stats: Optional[CodecStats] = None,
+                      trials: Optional[tuple[dict[int, int], dict[int, bytes], dict[str, int]]] = None) -> bytes:
+    """
+    Encodes a day with whichever encoding gives the fewest bytes.
+    With codec_stats, only the encodings that have been winning for the trend are tried, and the choice is recorded.
+    trials is trial_encode_days output for the day, worked out ahead of time in another process. The same
+    encoding is picked from it as would be without it, so the bytes are the same.
+    """
+    encodings = codec_stats.candidates() if codec_stats is not None else all_encodings
+    # The Huffman encoding works for any day without a record separator in a value, and the dictionary encoding
+    # for any day at all, so they are the fallbacks in that order if none of the usual encodings fit
+    if trials is None:
+        sizes, encoded, code_lengths = trial_encodings(day_values, encodings)
+        for fallback in (huffman_encoding_type, dictionary_encoding_type):
+            if sizes:
+                break
+            sizes, encoded, code_lengths = trial_encodings(day_values, (fallback,))
+    else:
+        all_sizes, encoded, code_lengths = trials
+        sizes = {encoding: all_sizes[encoding] for encoding in encodings if encoding in all_sizes}
+        for fallback in (huffman_encoding_type, dictionary_encoding_type):
+            if sizes:
+                break
+            sizes = {fallback: all_sizes[fallback]} if fallback in all_sizes else {}
 
-        # Encode the symbols
-        return output_bytes
+    best = min(sizes, key=lambda x: (sizes[x], x))
+    if best in encoded:
+        output_bytes = encoded[best]
+    else:
+        started = time.perf_counter()
+        output_bytes = bytes(encode_huffman_values(day_values, code_lengths))
+        stats.encode_seconds[huffman_encoding_type] += time.perf_counter() - started
+
+    value_bytes = len("\x1E".join(day_values).encode('utf-8'))
+    stats.encoded_days[best] += 1
+    stats.encode_value_bytes[best] += value_bytes
+    stats.encoded_bytes[best] += len(output_bytes)
+    if codec_stats is not None:
+        codec_stats.record(best, value_bytes, len(output_bytes))
+
+    return output_bytes
+
+
+def decoded_day_size(day: tuple[int, list[str]]) -> int:
+    """Approximate bytes held by a decoded (day type id, values), counting repeated strings each time"""
+    return sys.getsizeof(day[1]) + sum(map(sys.getsizeof, day[1]))
+
+
+class DayRollup:
+    """
+    Summary of one day of a trend, stored with it so aggregates don't decode the values.
+    Numeric days have count, minimum, maximum, total, first, and last. Other days, like on/off statuses, have the count
+    and the minutes each state was held, each value being held until the next one, and the last until midnight.
+    Days of a few distinct whole numbers, like a 0/1 status, have both.
+    """
+    def __init__(self, count: int, minimum: Optional[float] = None, maximum: Optional[float] = None, total: Optional[float] = None,
+                 first: Optional[float] = None, last: Optional[float] = None, state_minutes: Optional[dict[str, int]] = None) -> None:
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+        self.total = total
+        self.first = first
+        self.last = last
+        self.state_minutes = state_minutes
+
+    @property
+    def numeric(self) -> bool:
+        return self.total is not None
+
+
+def day_rollup(minutes: list[int], day_values: list[str]) -> DayRollup:
+    """Rollup of a day's values at the given minutes of the day, in order"""
+    numbers: tuple[float, ...] = ()
+    if all(decimal_pattern.fullmatch(value) for value in day_values):
+        values = [float(value) for value in day_values]
+        # Digits past the range of a double are not a number to sum
+        if all(map(math.isfinite, values)):
+            numbers = (min(values), max(values), math.fsum(values), values[0], values[-1])
+            distinct_values = set(day_values)
+            if len(distinct_values) > rollup_max_integer_states or any('.' in value for value in distinct_values):
+                return DayRollup(len(day_values), *numbers)
+
+    state_minutes: dict[str, int] = {}
+    for minute, next_minute, value in zip(minutes, minutes[1:] + [1440], day_values):
+        state_minutes[value] = state_minutes.get(value, 0) + next_minute - minute
+    return DayRollup(len(day_values), *numbers, state_minutes=state_minutes)
+
+
+def encode_rollup(rollup: DayRollup) -> bytes:
+    """
+    - 1 byte: 0 for a numeric day, 1 for states, 2 for both
+    - varint: number of values
+    - Numeric: 8 byte little endian doubles: minimum, maximum, total, first, last
+    - States:
+        - varint: number of states
+        - For each state:
+            - varint: length of UTF-8 encoded state, then the state
+            - varint: minutes held
+
+    If the states would take the rollup past rollup_max_bytes, none are stored, and readers roll the day up from its values.
+    """
+    if rollup.state_minutes is None:
+        rollup_type = rollup_numeric
+    else:
+        rollup_type = rollup_numeric_states if rollup.numeric else rollup_states
+    output_bytes = [rollup_type]
+    encode_varint(rollup.count, output_bytes)
+    if rollup.numeric:
+        output_bytes.extend(struct.pack('<5d', rollup.minimum, rollup.maximum, rollup.total, rollup.first, rollup.last))
+    if rollup.state_minutes is None:
+        return bytes(output_bytes)
+
+    encode_varint(len(rollup.state_minutes), output_bytes)
+    for state, minutes in rollup.state_minutes.items():
+        encoded_state = state.encode('utf-8')
+        encode_varint(len(encoded_state), output_bytes)
+        output_bytes.extend(encoded_state)
+        encode_varint(minutes, output_bytes)
+    if len(output_bytes) > rollup_max_bytes:
+        return encode_rollup(DayRollup(rollup.count, rollup.minimum, rollup.maximum, rollup.total, rollup.first, rollup.last,
+                                       None if rollup.numeric else {}))
+    return bytes(output_bytes)
+
+
+def decode_rollup(encoded_bytes, start_index: int = 0) -> DayRollup:
+    rollup_type = encoded_bytes[start_index]
+    count, index = decode_varint(encoded_bytes, start_index + 1)
+    numbers: tuple[float, ...] = ()
+    if rollup_type != rollup_states:
+        numbers = struct.unpack_from('<5d', encoded_bytes, index)
+        if rollup_type == rollup_numeric:
+            return DayRollup(count, *numbers)
+        index += struct.calcsize('<5d')
+
+    num_states, index = decode_varint(encoded_bytes, index)
+    state_minutes = {}
+    for _ in range(num_states):
+        length, index = decode_varint(encoded_bytes, index)
+        state = bytes(encoded_bytes[index:index + length]).decode('utf-8')
+        state_minutes[state], index = decode_varint(encoded_bytes, index + length)
+    return DayRollup(count, *numbers, state_minutes=state_minutes)
+
+
+def combine_rollups(rollups: list[DayRollup], function: str):
+    """
+    Aggregates day rollups, in day order, with one of aggregate_functions. durations is the minutes held of each
+    state, and needs days with states. The rest but count need numeric days, and are None over no days.
+    """
+    if function not in aggregate_functions:
+        raise ValueError(f"Unknown aggregate function '{function}', expected one of {', '.join(aggregate_functions)}")
+    if function == "count":
+        return sum(rollup.count for rollup in rollups)
+
+    if function == "durations":
+        if any(rollup.state_minutes is None for rollup in rollups):
+            raise ValueError("durations needs days of states, not numbers")
+        durations: Counter[str] = Counter()
+        for rollup in rollups:
+            durations.update(rollup.state_minutes)
+        return dict(durations)
+
+    if not all(rollup.numeric for rollup in rollups):
+        raise ValueError(f"{function} needs numeric days")
+    if not rollups:
+        return None
+    if function == "min":
+        return min(rollup.minimum for rollup in rollups)
+    elif function == "max":
+        return max(rollup.maximum for rollup in rollups)
+    elif function == "sum":
+        return math.fsum(rollup.total for rollup in rollups)
+    elif function == "mean":
+        return math.fsum(rollup.total for rollup in rollups) / sum(rollup.count for rollup in rollups)
+    elif function == "first":
+        return rollups[0].first
+    else:
+        return rollups[-1].last
 
 
-def decode_data_page(encoded_bytes: list[int]) -> list[tuple[datetime.datetime, str]]:
+def decode_data_page(encoded_bytes) -> list[tuple[int, int, list[str]]]:
     # List of encoded days.
-    # Days can be compressed using either be a dictionary/run length encoding, or Huffman coding.
+    # Days can be compressed using either be a dictionary/run length encoding, Huffman coding, or numeric encoding.
     #
     # Begins with
     #
-    # - 2 bytes: total number of days in page
+    # - 2 bytes: end of the encoded days, the number of bytes used from the start of the page
+    # - 2 bytes: number of days
     #
-    # For each encoded day:
+    # Then each day's encoded values, back to back, with either a dictionary/run length encoding, Huffman coding,
+    # or numeric encoding.
     #
-    # Begins with:
+    # The page ends with a directory of 8 byte slots, one per day, sorted by day id, the first slot last:
     #     - 2 byte day Id (Indexed from Jan 1, of start year, default 2000)
     #     - 2 byte day type Id (0 indexed)
-    #
-    # Then followed with either a dictionary/run length encoding, or Huffman coding.
+    #     - 2 byte position of the encoded values in the page
+    #     - 2 byte length of the encoded values
 
-    day_count = int.from_bytes(encoded_bytes[0:2], 'big')
-    index = 2
+    # Returns a list of (day id, day type id, values)
+    return [(day_id, day_type_id, decode_day_values(encoded_bytes, start)[0])
+            for day_id, day_type_id, start, _ in iter_page_days(encoded_bytes)]
 
-    day_entries = []
-    day_index = 0
-    while day_index < day_count:
-        day_id = int.from_bytes(encoded_bytes[index:index + 2], 'big')
-        index += 2
-        day_type_id = int.from_bytes(encoded_bytes[index:index + 2], 'big')
-        index += 2
 
-        day_values = decode_day_values(encoded_bytes[index:])
+def decode_day_array(encoded_bytes, start_index=0):
+    """
+    Decodes day values straight to a float64 NumPy array. encoded_bytes must support the buffer protocol,
+    like a page view. Raises ValueError if a value is not a number.
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    encoding_type = encoded_bytes[start_index]
+
+    if encoding_type == numeric_encoding_type:
+        num_values, index = decode_varint(encoded_bytes, start_index + 1)
+        num_scale_runs, index = decode_varint(encoded_bytes, index)
+        max_scale = 0
+        for _ in range(num_scale_runs):
+            _, index = decode_varint(encoded_bytes, index)
+            scale, index = decode_varint(encoded_bytes, index)
+            max_scale = max(max_scale, scale)
+
+        if max_scale > numeric_max_scale:
+            return np.array(decode_day_values(encoded_bytes, start_index)[0], dtype=np.float64)
+
+        width = encoded_bytes[index]
+        deltas = np.frombuffer(encoded_bytes, dtype=f'<i{width}', count=num_values, offset=index + 1).astype(np.int64)
+        index += 1 + width * num_values
+        for position in np.flatnonzero(deltas == -(1 << (8 * width - 1))):
+            value, index = decode_varint(encoded_bytes, index)
+            delta = value >> 1 if value & 1 == 0 else -((value + 1) >> 1)
+            if abs(delta) >= 1 << 52:
+                # The running sum could overflow int64, go through the strings instead
+                return np.array(decode_day_values(encoded_bytes, start_index)[0], dtype=np.float64)
+            deltas[position] = delta
+        if width == 8:
+            return np.array(decode_day_values(encoded_bytes, start_index)[0], dtype=np.float64)
+
+        # Every value is scaled to the largest number of decimal places
+        values = np.cumsum(deltas) / float(10 ** max_scale)
+
+    elif encoding_type == dictionary_encoding_type:
+        key_count, index = decode_varint(encoded_bytes, start_index + 1)
+        keys = []
+        for _ in range(key_count):
+            key_length, index = decode_varint(encoded_bytes, index)
+            keys.append(bytes(encoded_bytes[index:index + key_length]).decode('utf-8'))
+            index += key_length
+        key_values = np.array(keys, dtype=np.float64)
+
+        num_runs, index = decode_varint(encoded_bytes, index)
+        run_lengths = np.empty(num_runs, dtype=np.int64)
+        key_indexes = np.empty(num_runs, dtype=np.int64)
+        for run in range(num_runs):
+            run_lengths[run], index = decode_varint(encoded_bytes, index)
+            key_indexes[run], index = decode_varint(encoded_bytes, index)
+
+        values = np.repeat(key_values[key_indexes], run_lengths)
+
+    else:
+        return np.array(decode_day_values(encoded_bytes, start_index)[0], dtype=np.float64)
+
+    stats.decoded_days[encoding_type] += 1
+    stats.decoded_bytes[encoding_type] += index - start_index
+    stats.decode_seconds[encoding_type] += time.perf_counter() - started
+    return values
 
 
 def decode_day_values(encoded_bytes: list[int], start_index=0) -> tuple[list[str], int]:
@@ -615,94 +3410,59 @@ def decode_day_values(encoded_bytes: list[int], start_index=0) -> tuple[list[str
     Returns a list of strings, and the index of the next byte after the decoded values
 
     """
+    started = time.perf_counter()
     encoding_type = encoded_bytes[start_index]
 
-    if encoding_type == 0:
+    if encoding_type == dictionary_encoding_type:
         # Dictionary encoding, followed by a run-length encoding
-
-        # - 1 byte: 0 to represent dictionary encoding
-        # - 1 byte: number of keys in dictionary (implying < 256 keys)
-        # - For each key:
-        #     - 1 byte: length of key 1
-        #     - n bytes: UTF-8 string key 1
-        # - 1 byte: number of values
-        # - For each value:
-        #     - 1 byte: length of run of key n, (implies no run > 255, may need to repeat if run > 255)
-        #     - 1 byte: key n, zero indexed
-
+        key_count, index = decode_varint(encoded_bytes, start_index + 1)
         keys = []
-        key_count = encoded_bytes[start_index + 1]
-        index = start_index + 2
         for _ in range(key_count):
-            key_length = encoded_bytes[index]
-            index += 1
+            key_length, index = decode_varint(encoded_bytes, index)
             keys.append(bytes(encoded_bytes[index:index + key_length]).decode('utf-8'))
             index += key_length
 
-        num_values = encoded_bytes[index]
-
-        index += 1
+        num_runs, index = decode_varint(encoded_bytes, index)
         day_values = []
-        while len(day_values) < num_values:
-            length = encoded_bytes[index]
-            index += 1
-            value = keys[encoded_bytes[index]]
-            index += 1
+        for _ in range(num_runs):
+            length, index = decode_varint(encoded_bytes, index)
+            key_index, index = decode_varint(encoded_bytes, index)
+            day_values.extend([keys[key_index]] * length)
 
-            day_values.extend([value] * length)
+    elif encoding_type == huffman_encoding_type:
+        symbol_count, index = decode_varint(encoded_bytes, start_index + 1)
 
-        return day_values, index
-
-    elif encoding_type == 1:
-        # Huffman encoding
-        symbol_count = encoded_bytes[start_index + 1]
-        index = start_index + 2
-
-        symbols = []
-        huffman_code_lengths = []
+        huffman_code_lengths: dict[str, int] = {}
 
         for _ in range(symbol_count):
             length = encoded_bytes[index]
             index += 1
-            symbols.append(bytes(encoded_bytes[index:index + length]).decode('utf-8'))
+            symbol = bytes(encoded_bytes[index:index + length]).decode('utf-8')
             index += length
-            huffman_code_lengths.append(encoded_bytes[index])
+            huffman_code_lengths[symbol] = encoded_bytes[index]
             index += 1
 
-        num_bytes_required_for_codes = math.ceil(sum(huffman_code_lengths) / 8)
-        code_bytes = encoded_bytes[index:index + num_bytes_required_for_codes]
-        index += num_bytes_required_for_codes
-
-        code_bits: str = ''.join([f"{code:08b}" for code in code_bytes])
-        symbol_dict = {}
-
-        code_index = 0
-        for i, symbol in enumerate(symbols):
-            length = huffman_code_lengths[i]
-            symbol_dict[code_bits[code_index:code_index + length]] = symbol
-            code_index += length
+        codes = canonical_codes(huffman_code_lengths)
 
-        num_bits = int.from_bytes(encoded_bytes[index:index + huffman_bytes_for_bytes], 'big')
-        index += huffman_bytes_for_bytes
-
-        num_bytes = num_bits // 8 + (1 if num_bits % 8 != 0 else 0)
+        num_bits, index = decode_varint(encoded_bytes, index)
+        num_bytes = (num_bits + 7) // 8
 
         data_bytes = encoded_bytes[index:index + num_bytes]
-        data_bits = ''.join([f"{byte:08b}" for byte in data_bytes])
 
-        day_values_chars: list[str] = []
-        code = ""
-        for bit in data_bits[0:num_bits]:
-            code += bit
-            if code in symbol_dict:
-                day_values_chars.append(symbol_dict[code])
-                code = ""
+        day_values = huffman_decoder(tuple(codes)).decode(data_bytes, num_bits).split("\x1E")
+        index += num_bytes
 
-        return "".join(day_values_chars).split("\x1E"), index + num_bytes
+    elif encoding_type == numeric_encoding_type:
+        day_values, index = decode_numeric_values(encoded_bytes, start_index)
 
     else:
         raise ValueError("Unknown encoding type")
 
+    stats.decoded_days[encoding_type] += 1
+    stats.decoded_bytes[encoding_type] += index - start_index
+    stats.decode_seconds[encoding_type] += time.perf_counter() - started
+    return day_values, index
+
 
 if __name__ == "__main__":
     arg_index = 1
@@ -727,6 +3487,95 @@ if __name__ == "__main__":
 
             print_summary(sys.argv[arg_index + 1])
 
+            sys.exit(0)
+        elif sys.argv[arg_index] == "stats":
+            command = "stats"
+
+            if arg_index + 1 >= len(sys.argv):
+                print("Error: stats requires a file path, and optionally --decode")
+                sys.exit(1)
+
+            print_stats(sys.argv[arg_index + 1], decode="--decode" in sys.argv[arg_index + 2:])
+
+            sys.exit(0)
+        elif sys.argv[arg_index] == "trends":
+            command = "trends"
+
+            if arg_index + 1 >= len(sys.argv):
+                print("Error: trends requires a file path, and optionally a glob pattern")
+                sys.exit(1)
+
+            pattern = sys.argv[arg_index + 2] if arg_index + 2 < len(sys.argv) else None
+            for trend_name in list_trends(sys.argv[arg_index + 1], pattern):
+                print(trend_name)
+
+            sys.exit(0)
+        elif sys.argv[arg_index] == "checkpoint":
+            command = "checkpoint"
+
+            if arg_index + 1 >= len(sys.argv):
+                print("Error: checkpoint requires a file path")
+                sys.exit(1)
+
+            print(f"Checkpointed {checkpoint(sys.argv[arg_index + 1], force=True)} values")
+            sys.exit(0)
+        elif sys.argv[arg_index] == "compact":
+            command = "compact"
+
+            if arg_index + 1 >= len(sys.argv):
+                print("Error: compact requires a file path")
+                sys.exit(1)
+
+            result = compact(sys.argv[arg_index + 1])
+            print(f"Reclaimed {result.bytes_reclaimed} bytes ({result.size_before} to {result.size_after})")
+            print(f"Data pages: {result.data_pages_before} to {result.data_pages_after}")
+            print(f"Index records: {result.index_records_before} to {result.index_records_after}")
+            print(f"Day types: {result.day_types_before} to {result.day_types_after}")
+            for trend_name, num_pages in sorted(result.trend_pages.items()):
+                print(f"{trend_name}\t{num_pages} pages")
+            sys.exit(0)
+        elif sys.argv[arg_index] == "serve":
+            command = "serve"
+
+            if arg_index + 1 >= len(sys.argv):
+                print("Error: serve requires a file path, and optionally host:port or a Unix socket path")
+                sys.exit(1)
+
+            address = sys.argv[arg_index + 2] if arg_index + 2 < len(sys.argv) else f"127.0.0.1:{server_port}"
+            host, _, port = address.rpartition(":")
+            try:
+                if port.isdigit():
+                    asyncio.run(serve(sys.argv[arg_index + 1], host, int(port)))
+                else:
+                    asyncio.run(serve(sys.argv[arg_index + 1], path=address))
+            except KeyboardInterrupt:
+                pass
+            sys.exit(0)
+        elif sys.argv[arg_index] == "load":
+            command = "load"
+
+            load_args = sys.argv[arg_index + 1:]
+            workers = 0
+            if "--workers" in load_args:
+                workers_index = load_args.index("--workers")
+                if workers_index + 1 >= len(load_args) or not load_args[workers_index + 1].isdigit():
+                    print("Error: --workers requires a number of processes")
+                    sys.exit(1)
+                workers = int(load_args[workers_index + 1])
+                del load_args[workers_index:workers_index + 2]
+
+            if len(load_args) < 1:
+                print("Error: load requires a file path, and optionally a CSV/TSV input file (default stdin)")
+                sys.exit(1)
+
+            input_path = load_args[1] if len(load_args) > 1 else "-"
+            if input_path == "-":
+                num_loaded = load(load_args[0], read_rows(sys.stdin), workers=workers)
+            else:
+                with open(input_path, 'r', newline='') as input_file:
+                    num_loaded = load(load_args[0], read_rows(input_file), workers=workers)
+
+            print(f"Loaded {num_loaded} values")
             sys.exit(0)
         else:
             arg_index += 1
@@ -1,5 +1,16 @@
 import stsd
+import asyncio
+import concurrent.futures
 import datetime
+import errno
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
 
 values1 = [
     "905.428",
@@ -56,6 +67,167 @@ def test2():
         assert values2[i] == decoded[i]
 
 
+def test_huffman_round_trip():
+    random.seed(2)
+    # data.csv style numeric day
+    numeric_day = [f"{random.uniform(400, 600):.2f}" for _ in range(1440)]
+    # Skewed character counts give codes longer than a byte
+    alphabet = [chr(ord('a') + i) for i in range(16)]
+    weights = [2 ** -i for i in range(16)]
+    skewed_day = list(dict.fromkeys("".join(random.choices(alphabet, weights, k=8)) for _ in range(500)))
+
+    for day, encoding_type in [(numeric_day, 2), (skewed_day, 1)]:
+        encoded = stsd.encode_day_values(day)
+        assert encoded[0] == encoding_type
+        decoded, bytes_consumed = stsd.decode_day_values(encoded)
+        assert decoded == day
+        assert bytes_consumed == len(encoded)
+
+
+def test_numeric_round_trip():
+    random.seed(3)
+    walk = [500.0]
+    for _ in range(1439):
+        walk.append(walk[-1] + random.uniform(-0.5, 0.5))
+    days = [
+        [f"{value:.2f}" for value in walk],
+        # Mixed decimal places, negatives and large integers
+        ["72", "72.5", "-3", "-0.25", "0", "0.0", "1000000000000", "-12.125", "7"] * 10,
+        # Past the float formatting fast path
+        ["123456789012345.678", "-99999999999999999.5", "0.001"],
+        ["0"] * 1440,
+        # A spike too large for the delta width
+        ["20.5"] * 700 + ["-90000.5"] + ["20.5"] * 739,
+        # The most decimal places, and integers past any float
+        ["0.000000000000001", "-0.999999999999999", "123456789.123456789012345", "1"],
+        ["1" + "0" * 400, "-5"],
+    ]
+    for day in days:
+        encoded = stsd.encode_numeric_values(day)
+        assert encoded is not None
+        decoded, bytes_consumed = stsd.decode_day_values(encoded)
+        assert decoded == day
+        assert bytes_consumed == len(encoded)
+
+    # Strings that would not come back identical stay with the text encodings
+    for value in ["-0.0", "007", "1e5", "1.", ".5", "+1", "NaN", "on"]:
+        assert stsd.encode_numeric_values(["1", value]) is None
+
+
+def test_numeric_extreme_exponents():
+    # Dividing by the scale as a float would underflow these or round them to another decimal
+    days = [
+        ["0." + "0" * 399 + "1", "1"],
+        ["0.0000000000000001"] * 50,
+        ["1." + "0" * 20, "2." + "0" * 20 + "1"],
+        ["-" + "9" * 300 + "." + "9" * 300],
+    ]
+    for day in days:
+        assert stsd.encode_numeric_values(day) is None
+        encoded = stsd.encode_day_values(day)
+        assert encoded[0] != stsd.numeric_encoding_type
+        assert stsd.decode_day_values(encoded)[0] == day
+        assert len(stsd.decode_day_array(bytes(encoded))) == len(day)
+
+
+def test_canonical_huffman():
+    random.seed(7)
+    # Fibonacci counts give the deepest tree, codes of 1 to 19 bits for these 19 symbols and the separator
+    fibonacci = [1, 1]
+    while len(fibonacci) < 19:
+        fibonacci.append(fibonacci[-1] + fibonacci[-2])
+    deep_chars = [chr(0x3B1 + i) for i in range(19)]
+    deep_text = [char for char, count in zip(deep_chars, fibonacci) for _ in range(count)]
+    random.shuffle(deep_text)
+    # One value, so no record separators skew the counts
+    deep_day = ["".join(deep_text)]
+
+    days = [
+        # Only the record separator, a lone symbol with a 1 bit code
+        ["", "", ""],
+        ["a"],
+        ["On", "Off"] * 100,
+        deep_day,
+    ]
+    for day in days:
+        code_lengths = stsd.huffman_code_lengths(stsd.huffman_symbol_counts(day))
+        encoded = stsd.encode_huffman_values(day, code_lengths)
+        decoded, bytes_consumed = stsd.decode_day_values(encoded)
+        assert decoded == day
+        assert bytes_consumed == len(encoded)
+    assert max(stsd.huffman_code_lengths(stsd.huffman_symbol_counts(deep_day)).values()) == 19
+
+    # Codes of every length up to the 255 bits the header allows, the last two the longest
+    symbols = ["\x1E"] + [chr(0x100 + i) for i in range(255)]
+    code_lengths = {symbol: min(i + 1, 255) for i, symbol in enumerate(symbols)}
+    codes = stsd.canonical_codes(code_lengths)
+    # Consecutive codes, shifted left as the length grows, in (length, symbol) order
+    assert codes[0] == ("\x1E", 0, 1) and codes[-1][1:] == ((1 << 255) - 1, 255)
+    for (_, code, length), (_, next_code, next_length) in zip(codes, codes[1:]):
+        assert next_code == (code + 1) << (next_length - length)
+    day = ["".join(random.choices(symbols[1:], k=10)) for _ in range(30)]
+    decoded, _ = stsd.decode_day_values(stsd.encode_huffman_values(day, code_lengths))
+    assert decoded == day
+
+
+def test_codec_selection():
+    random.seed(4)
+    with open(os.path.join(os.path.dirname(__file__), 'data.csv')) as f:
+        data_values = [line.strip() for line in f]
+    days = [data_values[i:i + 1440] for i in range(0, len(data_values), 1440)]
+    # More than 255 keys, and runs longer than 255
+    days.append([f"state {i // 3}" for i in range(900)] + ["off"] * 540)
+    # More than 65535 bits of Huffman data
+    days.append(["".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=60)) for _ in range(1440)])
+
+    for day in days:
+        encoded = stsd.encode_day_values(day)
+        decoded, bytes_consumed = stsd.decode_day_values(encoded)
+        assert decoded == day
+        assert bytes_consumed == len(encoded)
+
+        # The smallest encoding wins, and the Huffman size estimate is exact
+        symbol_counts = stsd.huffman_symbol_counts(day)
+        code_lengths = stsd.huffman_code_lengths(symbol_counts)
+        huffman = stsd.encode_huffman_values(day, code_lengths)
+        assert len(huffman) == stsd.huffman_encoded_size(symbol_counts, code_lengths)
+        numeric = stsd.encode_numeric_values(day)
+        sizes = [len(stsd.encode_dictionary_values(day)), len(huffman)] + ([len(numeric)] if numeric else [])
+        assert len(encoded) == min(sizes)
+
+    # After a trend's first days, only the winning encodings are tried
+    codec_stats = stsd.CodecStats()
+    for day in days[:stsd.CodecStats.warmup_days]:
+        stsd.encode_day_values(day, codec_stats)
+    assert codec_stats.candidates() != stsd.all_encodings
+    assert codec_stats.days == stsd.CodecStats.warmup_days
+    assert 0 < codec_stats.ratio(codec_stats.wins.most_common(1)[0][0]) < 1
+    # Still falls back to an encoding that fits
+    text_day = ["on", "off"] * 720
+    assert stsd.decode_day_values(stsd.encode_day_values(text_day, codec_stats))[0] == text_day
+
+
+def test_record_separator_values():
+    random.seed(5)
+    # Huffman codes values joined by record separators, these would come back split
+    day = [f"a\x1eb{i}" for i in range(50)]
+    encoded = stsd.encode_day_values(day)
+    assert encoded[0] == stsd.dictionary_encoding_type
+    assert stsd.decode_day_values(encoded)[0] == day
+
+    # A trend where only Huffman has won still falls back to an encoding that fits
+    codec_stats = stsd.CodecStats()
+    for _ in range(stsd.CodecStats.warmup_days):
+        stsd.encode_day_values(["".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=60)) for _ in range(100)], codec_stats)
+    assert codec_stats.candidates() == (stsd.huffman_encoding_type,)
+    assert stsd.decode_day_values(stsd.encode_day_values(day, codec_stats))[0] == day
+
+    # And so do days trial encoded ahead of time
+    trials = stsd.trial_encode_days([day])[0]
+    assert stsd.huffman_encoding_type not in trials[0]
+    assert stsd.decode_day_values(stsd.encode_day_values(day, codec_stats, trials))[0] == day
+
+
 def test3():
     start_datetime = datetime.datetime(2024, 3, 5, 0, 0)
     # Add 96 datetimes, spaced 15 minutes apart
@@ -67,6 +239,954 @@ def test3():
     assert len(day_time_values) == 180, f"Expected 180 but got {len(day_time_values)}"
 
 
+def test_data_page_slots():
+    page = stsd.new_data_page(256)
+    days = {day_id: bytes([day_id]) * (day_id % 7 + 1) for day_id in [30, 10, 20, 40, 15]}
+    for day_id, encoded in days.items():
+        assert stsd.add_page_day(page, day_id, day_id // 10, encoded)
+    assert [x[0] for x in stsd.iter_page_days(page)] == [10, 15, 20, 30, 40]
+    assert [x[0] for x in stsd.iter_page_days(page, 12, 30)] == [15, 20, 30]
+
+    # Removing a day moves the values after it, and the slots still find every day
+    stsd.remove_page_day(page, 20)
+    del days[20]
+    assert stsd.find_page_day(page, 20) is None
+    for day_id, encoded in days.items():
+        day_type_id, start, end = stsd.find_page_day(page, day_id)
+        assert day_type_id == day_id // 10 and bytes(page[start:end]) == encoded
+
+    # Full once the values and slots would meet
+    free_bytes = 256 - int.from_bytes(page[0:2], 'big') - (len(days) + 1) * stsd.day_slot_size_bytes
+    assert not stsd.add_page_day(page, 50, 0, bytes(free_bytes + 1))
+    assert stsd.add_page_day(page, 50, 0, bytes(free_bytes))
+    assert [x[0] for x in stsd.iter_page_days(page)] == [10, 15, 30, 40, 50]
+
+
+def test_pager():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        with stsd.Pager(file) as pager:
+            assert pager.page_size == 4096
+            assert pager.num_pages == 1
+
+            first_page = pager.page(0)
+            first_new_page = pager.grow(2)
+            assert first_new_page == 1
+            assert pager.num_pages == 3
+
+            # Views taken before the remap still see the same bytes
+            assert int.from_bytes(first_page[2:4], 'big') == 4096
+
+            pager.write(pager.page_size * 2, b"abc")
+            assert bytes(pager.page(2)[0:3]) == b"abc"
+
+        assert os.path.getsize(file) == 3 * 4096
+
+
+def test_page_chains():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        values = [(datetime.datetime(2024, 3, 21, i, 0), str(i)) for i in range(24)]
+        # More trends than fit on one trend page
+        for i in range(40):
+            stsd.write_data(file, f"Trend {i}", values)
+
+        with stsd.Pager(file) as pager:
+            trend_pages = stsd.trends_chain.page_indexes(pager)
+            assert len(trend_pages) == 2
+            trends = stsd.read_trend_pages(stsd.trends_chain.views(pager, trend_pages))
+            assert len(trends) == 40
+
+            index_pages = stsd.index_chain.page_indexes(pager)
+            indexes = stsd.read_index_page(stsd.index_chain.views(pager, index_pages))
+            assert len(indexes) == 40
+
+            # Freed pages are reused before the file grows
+            num_pages = pager.num_pages
+            stsd.free_page(pager, indexes[0].page_index)
+            assert stsd.allocate_page(pager) == indexes[0].page_index
+            assert pager.num_pages == num_pages
+
+
+def test_write_many():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 3, 21)
+        trend_values = {
+            f"Trend {i}": [(start + datetime.timedelta(minutes=15 * j), str(i * j)) for j in range(96 * 2)]
+            for i in range(5)
+        }
+        stsd.write_many(file, trend_values)
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            assert database.catalog.list() == sorted(trend_values)
+            # One shared day type for the 15 minute schedule
+            assert len(database.day_types) == 1
+
+            for trend_id in database.catalog.ids.values():
+                day_ids = []
+                for index in database.indexes:
+                    if index.trend_id == trend_id:
+                        day_ids.extend(day_id for day_id, _, _, _ in stsd.iter_page_days(pager.page(index.page_index)))
+                assert day_ids == [database.day_id(start.date()), database.day_id(start.date()) + 1]
+
+
+def test_failed_batch():
+    rng = random.Random(0)
+    start = datetime.datetime(2024, 4, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+        stsd.write_data(file, "A", [(start + datetime.timedelta(minutes=15 * i), "1.5") for i in range(96)])
+        size_before = os.path.getsize(file)
+
+        # A new day type for A and a new trend are placed before Z's day is found to be too large for a page
+        too_large = [(start + datetime.timedelta(minutes=i), "".join(rng.choice(string.ascii_letters) for _ in range(30)))
+                     for i in range(1440)]
+        try:
+            stsd.write_many(file, {
+                "A": [(start + datetime.timedelta(days=1, minutes=7 * i), "2.5") for i in range(200)],
+                "B": [(start + datetime.timedelta(minutes=15 * i), "3.5") for i in range(96)],
+                "Z": too_large,
+            })
+            assert False, "Expected an error"
+        except ValueError:
+            pass
+
+        assert os.path.getsize(file) == size_before
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            assert len(database.day_types) == 1
+            assert pager.read_int(stsd.num_data_pages_pos, 4) == 1
+            assert pager.read_int(stsd.num_free_pages_pos, 4) == 0
+            assert pager.read_int(stsd.generation_pos, 4) % 2 == 0
+        assert stsd.list_trends(file) == ["A"]
+        assert len(list(stsd.read_range(file, "A", start.date(), start.date() + datetime.timedelta(days=1)))) == 96
+
+
+def test_out_of_range_dates():
+    start = datetime.datetime(2024, 4, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+        stsd.write_data(file, "A", [(start + datetime.timedelta(minutes=15 * i), "1.5") for i in range(96)])
+        size_before = os.path.getsize(file)
+
+        # Day ids are 2 bytes counted from the initial year
+        for day in [datetime.datetime(1999, 12, 30), datetime.datetime(2200, 1, 1)]:
+            try:
+                stsd.write_many(file, {"A": [(start, "2.5")], "B": [(start, "3.5"), (day, "3.5")]})
+                assert False, "Expected an error"
+            except ValueError as e:
+                assert str(day.date()) in str(e)
+
+        assert os.path.getsize(file) == size_before
+        with stsd.Pager(file) as pager:
+            assert pager.read_int(stsd.num_free_pages_pos, 4) == 0
+        assert stsd.list_trends(file) == ["A"]
+        assert list(stsd.read_range(file, "A", start.date(), start.date()))[0] == (start, "1.5")
+
+
+class FullDiskPager(stsd.Pager):
+    """A pager for a disk that fills up after pages_left more pages"""
+    def __init__(self, filepath, pages_left: int) -> None:
+        super().__init__(filepath)
+        self.pages_left = pages_left
+
+    def grow(self, num_pages: int) -> int:
+        if num_pages > self.pages_left:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        self.pages_left -= num_pages
+        return super().grow(num_pages)
+
+
+def test_free_pages_reused():
+    start = datetime.datetime(2024, 4, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+        stsd.write_data(file, "A", [(start + datetime.timedelta(minutes=15 * i), "1.5") for i in range(96)])
+        size_before = os.path.getsize(file)
+
+        # Each new trend takes a data page and a rollup page, the disk fills on the third
+        with FullDiskPager(file, pages_left=2) as pager:
+            try:
+                stsd.write_many(stsd.Database(pager), {name: [(start, "1.0")] for name in ["B", "C"]})
+                assert False, "Expected an error"
+            except OSError:
+                pass
+
+        with stsd.Pager(file) as pager:
+            assert pager.read_int(stsd.num_free_pages_pos, 4) == 2
+            assert pager.read_int(stsd.num_data_pages_pos, 4) == 1
+        assert os.path.getsize(file) == size_before + 2 * stsd.page_size
+        assert stsd.list_trends(file) == ["A"]
+
+        # The next write takes its pages off the free list before growing the file
+        stsd.write_data(file, "B", [(start, "1.0")])
+        with stsd.Pager(file) as pager:
+            assert pager.read_int(stsd.num_free_pages_pos, 4) == 0
+        assert os.path.getsize(file) == size_before + 2 * stsd.page_size
+        assert list(stsd.read_range(file, "B", start.date(), start.date())) == [(start, "1.0")]
+
+
+def test_load():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        lines = ["timestamp\ttrend\tvalue"]
+        start = datetime.datetime(2024, 3, 20)
+        for i in range(96 * 3):
+            timestamp = start + datetime.timedelta(minutes=15 * i)
+            lines.append(f"{timestamp.isoformat()}\tFan\t{'On' if i % 7 else 'Off'}")
+            lines.append(f"{timestamp.isoformat()}\tTemp\t{70 + i % 5}.5")
+
+        assert stsd.load(file, stsd.read_rows(lines), chunk_values=100) == 96 * 3 * 2
+
+        # A day written again is merged, not duplicated
+        stsd.load(file, stsd.read_rows(["2024-03-21 00:05:00,Temp,1.0"]))
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            temp_days = []
+            for index in database.indexes:
+                if index.trend_id == database.catalog.id("Temp"):
+                    page = pager.page(index.page_index)
+                    for day_id, _, start_pos, _ in stsd.iter_page_days(page):
+                        temp_days.append((day_id, stsd.decode_day_values(page, start_pos)[0]))
+
+            temp_days.sort()
+            assert [len(values) for _, values in temp_days] == [96, 97, 96]
+            assert temp_days[1][1][0:2] == ["71.5", "1.0"]
+
+
+def test_parallel_encoding():
+    random.seed(5)
+    start = datetime.datetime(2024, 1, 1)
+    minutes = [start + datetime.timedelta(minutes=5 * i) for i in range(288 * 40)]
+    # Numeric, on/off, and a trend that turns from text to numbers after the encodings have settled
+    batches = [
+        {
+            "Temp": [(t, f"{random.uniform(60, 80):.1f}") for t in minutes],
+            "Fan": [(t, "On" if t.hour > 6 else "Off") for t in minutes],
+            "Mode": [(t, random.choice(["Heat", "Cool"]) if i < 288 * 20 else str(i % 50)) for i, t in enumerate(minutes)],
+        },
+        # Merged into a stored day
+        {"Temp": [(datetime.datetime(2024, 1, 3, 12, 1), "1.5")], "Fan": [(minutes[-1] + datetime.timedelta(days=1), "On")]},
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [os.path.join(tmp_dir, name) for name in ["serial.db", "parallel.db"]]
+        for file in files:
+            stsd.init(file)
+        for trend_values in batches:
+            stsd.write_many(files[0], trend_values)
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            for trend_values in batches:
+                stsd.write_many(files[1], trend_values, executor)
+
+        with open(files[0], 'rb') as serial_file, open(files[1], 'rb') as parallel_file:
+            assert serial_file.read() == parallel_file.read()
+
+
+def test_server():
+    start = datetime.datetime(2024, 5, 1)
+
+    async def run(file: str, socket_path: str):
+        with stsd.use_database(file) as database:
+            server = stsd.Server(database)
+            await server.start(path=socket_path)
+            try:
+                async with await stsd.Client.connect(path=socket_path) as client, \
+                        await stsd.Client.connect(path=socket_path) as other_client:
+                    # Concurrent writes from both connections, coalesced into fewer commits
+                    writes = [
+                        (client if i % 2 else other_client).write_data(f"Trend {i % 4}", [(start + datetime.timedelta(minutes=i), str(i))])
+                        for i in range(40)
+                    ]
+                    await asyncio.gather(*writes)
+                    assert 1 <= server.commits < 40
+
+                    assert await client.list_trends("Trend *") == [f"Trend {i}" for i in range(4)]
+                    assert await client.aggregate("Trend 1", start.date(), start.date(), "max") == 37.0
+                    rows = await other_client.read_range("Trend 1", start.date(), start.date())
+                    assert rows == [(start + datetime.timedelta(minutes=i), str(i)) for i in range(1, 40, 4)]
+
+                    # A bad write fails alone
+                    results = await asyncio.gather(client.write_data("x" * 200, [(start, "1")]),
+                                                   other_client.write_data("Trend 0", [(start, "first")]),
+                                                   return_exceptions=True)
+                    assert isinstance(results[0], ValueError) and results[1] is None
+                    assert (await client.read_range("Trend 0", start.date(), start.date()))[0] == (start, "first")
+
+                    try:
+                        await client.request("drop")
+                        assert False, "Expected an error"
+                    except ValueError as error:
+                        assert "Unknown op" in str(error)
+            finally:
+                await server.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+        asyncio.run(run(file, os.path.join(tmp_dir, "stsd.sock")))
+
+        # Committed like any other write
+        assert stsd.list_trends(file) == [f"Trend {i}" for i in range(4)]
+
+
+def test_stats():
+    start = datetime.datetime(2024, 2, 1)
+    events = []
+    stsd.stats.reset()
+    stsd.stats.callback = lambda event, seconds: events.append(event)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "test.db")
+            stsd.init(file)
+
+            # Newest first, so each day starts a page of its own, interleaved between the trends
+            for day in reversed(range(10)):
+                day_start = start + datetime.timedelta(days=day)
+                stsd.write_many(file, {
+                    "Temp": [(day_start + datetime.timedelta(minutes=15 * i), f"{70 + i % 9}.5") for i in range(96)],
+                    "Fan": [(day_start + datetime.timedelta(hours=i), "On" if i % 2 else "Off") for i in range(24)],
+                })
+            stsd.write_data(file, "Temp", [(start + datetime.timedelta(minutes=1), "1.0")])
+
+            assert stsd.stats.writes == 11
+            assert events.count("write") == 11 and "load" in events
+            assert sum(stsd.stats.encoded_days.values()) == 21
+            assert stsd.stats.encoded_days[stsd.numeric_encoding_type] == 11
+            assert stsd.stats.bytes_moved == 0  # The merged day was the only one in its page
+            assert stsd.stats.pages_written > 0 and stsd.stats.pages_grown > 0
+
+            storage = stsd.storage_stats(file)
+            assert storage.days == 20 and storage.data_pages == 20
+            assert 0 < storage.data_fill < 0.2
+            assert storage.fragmentation == 1.0
+
+            stsd.stats.reset()
+            with stsd.use_pager(file, writable=False) as pager:
+                database = stsd.Database(pager)
+                for _ in range(2):
+                    assert len(list(database.read_range("Temp", start.date(), start.date() + datetime.timedelta(days=9)))) == 961
+            assert stsd.stats.metadata_loads == 1 and stsd.stats.metadata_seconds > 0
+            assert stsd.stats.decoded_days[stsd.numeric_encoding_type] == 10
+            assert stsd.stats.day_cache_misses == 10 and stsd.stats.day_cache_hits == 10
+            assert stsd.stats.as_dict()["decoded_days"] == {"numeric": 10}
+
+            stsd.compact(file)
+            assert "compact" in events
+            storage = stsd.storage_stats(file)
+            assert storage.data_pages == 2 and storage.fragmentation == 0.0 and storage.free_pages == 0
+    finally:
+        stsd.stats.callback = None
+
+
+def test_compact():
+    start = datetime.datetime(2024, 2, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        # Days written newest first each start a page of their own, interleaved between the trends
+        for day in reversed(range(20)):
+            day_start = start + datetime.timedelta(days=day)
+            stsd.write_many(file, {
+                "Temp": [(day_start + datetime.timedelta(minutes=15 * i), f"{70 + i % 9}.5") for i in range(96)],
+                "Fan": [(day_start + datetime.timedelta(hours=i), "On" if i % 2 else "Off") for i in range(24)],
+            })
+        # Merging a value into a day moves it to a new day type, leaving the old 15 minute one unused
+        stsd.write_data(file, "Temp", [(start + datetime.timedelta(days=d, minutes=1), "1.0") for d in range(20)])
+
+        end_date = (start + datetime.timedelta(days=19)).date()
+        expected = {trend_name: list(stsd.read_range(file, trend_name, start.date(), end_date)) for trend_name in ["Temp", "Fan"]}
+
+        with stsd.use_database(file) as other:
+            list(other.read_range("Temp", start.date(), start.date()))
+            result = stsd.compact(file)
+
+            assert result.data_pages_before == 40 and result.data_pages_after < 10
+            assert result.index_records_after == result.data_pages_after
+            assert result.day_types_before == 3 and result.day_types_after == 2
+            assert result.bytes_reclaimed > 0 and result.size_after == os.path.getsize(file)
+            assert sum(result.trend_pages.values()) == result.data_pages_after
+
+            # A connection open from before moves to the new file
+            assert list(other.read_range("Fan", start.date(), end_date)) == expected["Fan"]
+            other.write_many({"Fan": [(start, "Auto")]})
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            # Each trend's pages are consecutive and in day order
+            for trend_name in ["Temp", "Fan"]:
+                indexes = [x for x in database.indexes if x.trend_id == database.catalog.id(trend_name)]
+                assert [x.page_index for x in indexes] == list(range(indexes[0].page_index, indexes[0].page_index + len(indexes)))
+                assert all(a.end_day < b.start_day for a, b in zip(indexes, indexes[1:]))
+        assert list(stsd.read_range(file, "Temp", start.date(), end_date)) == expected["Temp"]
+        assert list(stsd.read_range(file, "Fan", start.date(), end_date)) == [(start, "Auto")] + expected["Fan"][1:]
+
+
+def test_read_range():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 1, 1)
+        values = [(start + datetime.timedelta(minutes=5 * i), f"{400 + (i * 37) % 100}.{i % 10}") for i in range(288 * 60)]
+        stsd.write_data(file, "Trend 1", values)
+        stsd.write_data(file, "Trend 2", [(start, "On")])
+
+        read = list(stsd.read_range(file, "Trend 1", datetime.date(2024, 1, 10), datetime.date(2024, 1, 12)))
+        expected = [x for x in values if datetime.date(2024, 1, 10) <= x[0].date() <= datetime.date(2024, 1, 12)]
+        assert read == expected
+
+        assert list(stsd.read_range(file, "Trend 1", datetime.date(2023, 1, 1), datetime.date(2023, 12, 31))) == []
+        assert list(stsd.read_range(file, "Trend 2", datetime.date(2024, 1, 1), datetime.date(2024, 3, 1))) == [(start, "On")]
+
+        # Decoded a page at a time as the pairs are consumed
+        with stsd.Pager(file, writable=False) as pager:
+            database = stsd.Database(pager)
+            num_pages = len(database.index.trend(database.catalog.id("Trend 1")).records)
+            assert num_pages > 2
+            stsd.stats.reset()
+            rows = database.read_range("Trend 1", datetime.date(2024, 1, 1), datetime.date(2024, 3, 1))
+            assert next(rows) == values[0]
+            assert 0 < sum(stsd.stats.decoded_days.values()) < 60 / num_pages * 2
+            assert [next(rows)] + list(rows) == values[1:]
+            assert sum(stsd.stats.decoded_days.values()) == 60
+
+
+def test_read_range_arrays():
+    import numpy as np
+
+    random.seed(5)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 1, 1)
+        minutes = [start + datetime.timedelta(minutes=i) for i in range(1440 * 5)]
+        trends = {
+            # Numeric, with a spike too large for the packed deltas
+            "Analog": [(x, f"{500 + random.uniform(-5, 5):.2f}") for x in minutes],
+            # Dictionary
+            "Setpoint": [(x, "72" if x.hour < 12 else "68.5") for x in minutes[::15]],
+            # Not plain decimals, Huffman or dictionary
+            "Scientific": [(x, f"{random.randint(1, 9)}.{random.randint(0, 99)}e{random.randint(0, 3)}") for x in minutes[::5]],
+            "Status": [(x, random.choice(["On", "Off"])) for x in minutes[::60]],
+        }
+        trends["Analog"][1440 * 2 + 100] = (trends["Analog"][1440 * 2 + 100][0], "-90000.25")
+        stsd.write_many(file, trends)
+
+        for trend_name, values in trends.items():
+            timestamps, array_values = stsd.read_range_arrays(file, trend_name, datetime.date(2024, 1, 2), datetime.date(2024, 1, 4))
+            expected = list(stsd.read_range(file, trend_name, datetime.date(2024, 1, 2), datetime.date(2024, 1, 4)))
+            assert timestamps.dtype == np.int64
+            assert timestamps.tolist() == [int(x.replace(tzinfo=datetime.timezone.utc).timestamp()) for x, _ in expected]
+            if trend_name == "Status":
+                assert array_values.dtype == object
+                assert array_values.tolist() == [value for _, value in expected]
+            else:
+                assert array_values.dtype == np.float64
+                assert array_values.tolist() == [float(value) for _, value in expected]
+
+        timestamps, array_values = stsd.read_range_arrays(file, "Analog", datetime.date(2023, 1, 1), datetime.date(2023, 1, 2))
+        assert len(timestamps) == 0 and len(array_values) == 0
+
+
+def test_read_aligned():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 6, 1)
+        quarter_hours = [start + datetime.timedelta(minutes=15 * i) for i in range(96 * 3)]
+        trends = {
+            # Same schedule
+            "Supply Temp": [(x, f"{55 + i % 7}.5") for i, x in enumerate(quarter_hours)],
+            "Fan Speed": [(x, str(i % 100)) for i, x in enumerate(quarter_hours)],
+            # Hourly, and missing the last day
+            "Damper": [(x, str(i % 10)) for i, x in enumerate(quarter_hours[:96 * 2:4])],
+            # Off schedule minutes on one day only
+            "Setpoint": [(start + datetime.timedelta(days=1, minutes=7 * i), "72") for i in range(10)],
+        }
+        stsd.write_many(file, trends)
+        trend_names = list(trends)
+
+        def expected_rows(names: list[str], end: datetime.date):
+            by_time: dict[datetime.datetime, list] = defaultdict(lambda: [None] * len(names))
+            for column, trend_name in enumerate(names):
+                for timestamp, value in stsd.read_range(file, trend_name, start.date(), end):
+                    by_time[timestamp][column] = value
+            return sorted(by_time.items())
+
+        def check(names: list[str], end: datetime.date):
+            timestamps, values = stsd.read_aligned(file, names, start.date(), end)
+            expected = expected_rows(names, end)
+            assert timestamps.tolist() == [int(x.replace(tzinfo=datetime.timezone.utc).timestamp()) for x, _ in expected]
+            assert values.shape == (len(expected), len(names))
+            for row, (_, expected_values) in zip(values.tolist(), expected):
+                assert [None if x != x else x for x in row] == [None if x is None else float(x) for x in expected_values]
+
+        end_date = (start + datetime.timedelta(days=2)).date()
+        # A day with one schedule stacks, days with different ones merge
+        check(["Supply Temp", "Fan Speed"], end_date)
+        check(trend_names, end_date)
+
+        # Logged values are merged in
+        stsd.append(file, {"Damper": [(start + datetime.timedelta(days=2, minutes=15), "5")]})
+        check(trend_names, end_date)
+
+        # A non numeric trend makes the matrix hold objects
+        stsd.write_data(file, "Status", [(start, "On")])
+        timestamps, values = stsd.read_aligned(file, ["Status", "Fan Speed"], start.date(), start.date())
+        assert values.dtype == object
+        assert values[0].tolist() == ["On", 0.0] and values[1].tolist() == [None, 1.0]
+
+        timestamps, values = stsd.read_aligned(file, trend_names, datetime.date(2023, 1, 1), datetime.date(2023, 1, 2))
+        assert len(timestamps) == 0 and values.shape == (0, len(trend_names))
+
+
+def test_aggregate():
+    random.seed(6)
+    start = datetime.datetime(2024, 7, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        quarter_hours = [start + datetime.timedelta(minutes=15 * i) for i in range(96 * 10)]
+        stsd.write_many(file, {
+            "Demand": [(x, f"{random.uniform(100, 400):.1f}") for x in quarter_hours],
+            "Fan": [(x, "On" if 6 <= x.hour < 18 else "Off") for x in quarter_hours[::4]],
+            "Pump": [(x, "1" if 8 <= x.hour < 14 else "0") for x in quarter_hours[::4]],
+            # Not plain decimals, so states rather than numbers
+            "Odd": [(start + datetime.timedelta(hours=hour), value) for hour, value in enumerate(["1_000", "nan", "inf", "1e3"])],
+        })
+        # Merged into a stored day, the rollup follows
+        stsd.write_data(file, "Demand", [(start + datetime.timedelta(days=3, minutes=1), "999.5")])
+
+        def expected(trend_name: str, first_day: int, last_day: int) -> list[float]:
+            start_date = (start + datetime.timedelta(days=first_day)).date()
+            end_date = (start + datetime.timedelta(days=last_day)).date()
+            return [float(value) for _, value in stsd.read_range(file, trend_name, start_date, end_date)]
+
+        def check(first_day: int, last_day: int):
+            start_date = (start + datetime.timedelta(days=first_day)).date()
+            end_date = (start + datetime.timedelta(days=last_day)).date()
+            values = expected("Demand", first_day, last_day)
+            assert stsd.aggregate(file, "Demand", start_date, end_date, "count") == len(values)
+            assert stsd.aggregate(file, "Demand", start_date, end_date, "max") == max(values)
+            assert stsd.aggregate(file, "Demand", start_date, end_date, "min") == min(values)
+            assert abs(stsd.aggregate(file, "Demand", start_date, end_date, "mean") - sum(values) / len(values)) < 1e-9
+            assert stsd.aggregate(file, "Demand", start_date, end_date, "first") == values[0]
+            assert stsd.aggregate(file, "Demand", start_date, end_date, "last") == values[-1]
+
+        check(0, 9)
+        check(2, 4)
+        assert stsd.aggregate(file, "Demand", start.date(), start.date() + datetime.timedelta(days=9), "max") == 999.5
+        # Runtime, each state held until the next value
+        assert stsd.aggregate(file, "Fan", start.date(), start.date() + datetime.timedelta(days=1), "durations") == {"On": 2 * 720, "Off": 2 * 720}
+        # A 0/1 status is both numeric and states
+        assert stsd.aggregate(file, "Pump", start.date(), start.date() + datetime.timedelta(days=1), "durations") == {"1": 2 * 360, "0": 2 * 1080}
+        assert stsd.aggregate(file, "Pump", start.date(), start.date(), "mean") == 6 / 24
+        assert stsd.aggregate(file, "Odd", start.date(), start.date(), "durations") == {"1_000": 60, "nan": 60, "inf": 60, "1e3": 1260}
+
+        # Logged values are rolled up with the stored ones
+        stsd.append(file, {"Demand": [(start + datetime.timedelta(days=9, hours=23, minutes=59), "1.5")]})
+        check(8, 9)
+
+        stsd.checkpoint(file, force=True)
+        stsd.compact(file)
+        check(0, 9)
+
+        assert stsd.aggregate(file, "Demand", datetime.date(2023, 1, 1), datetime.date(2023, 1, 2), "max") is None
+        # Too many states to store in the rollup, the day is rolled up from its values instead
+        alarms = [(start + datetime.timedelta(minutes=3 * i), f"Alarm {i:04d}") for i in range(400)]
+        stsd.write_data(file, "Alarms", alarms)
+        durations = stsd.aggregate(file, "Alarms", start.date(), start.date(), "durations")
+        assert len(durations) == 400 and sum(durations.values()) == 1440 and durations["Alarm 0000"] == 3
+        assert stsd.aggregate(file, "Alarms", start.date(), start.date(), "count") == 400
+
+        for trend_name, function in [("Fan", "mean"), ("Odd", "sum"), ("Demand", "durations"), ("Demand", "median")]:
+            try:
+                stsd.aggregate(file, trend_name, start.date(), start.date(), function)
+                assert False, "Expected an error"
+            except ValueError:
+                pass
+
+
+def test_interval_index():
+    random.seed(1)
+    records = []
+    day = 0
+    for i in range(200):
+        day += random.randint(1, 5)
+        span = random.randint(0, 20)
+        records.append(stsd.DataIndex(1 + i % 3, i, day, day + span))
+        day += span
+    # An overlapping record, like a merged day moved to its own page
+    records.append(stsd.DataIndex(1, 500, records[30].start_day + 1, records[30].start_day + 1))
+
+    index = stsd.IntervalIndex(records)
+    index.trend(2).extend(records[1], records[1].end_day + 1)
+
+    for trend_id in [1, 2, 3]:
+        trend_records = [x for x in records if x.trend_id == trend_id]
+        for day_id in range(0, day + 10, 3):
+            assert index.trend(trend_id).containing(day_id) == sorted(
+                [x for x in trend_records if x.start_day <= day_id <= x.end_day], key=lambda x: (x.start_day, x.record_index))
+
+            before = [x for x in trend_records if x.end_day < day_id]
+            latest = index.trend(trend_id).latest_before(day_id)
+            assert (latest.end_day if latest else None) == max((x.end_day for x in before), default=None)
+
+        overlapping = index.trend(trend_id).overlapping(100, 300)
+        assert set(overlapping) == {x for x in trend_records if x.start_day <= 300 and x.end_day >= 100}
+
+
+def test_trend_catalog():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        values = [(datetime.datetime(2024, 3, 21), "1")]
+        stsd.write_many(file, {name: values for name in ["AHU-1/SAT", "AHU-1/Fan", "AHU-10/SAT", "AHU-2/SAT", "Chiller"]})
+
+        with stsd.Pager(file, writable=False) as pager:
+            database = stsd.Database(pager)
+            catalog = database.catalog
+            assert catalog.list("AHU-1/*") == ["AHU-1/Fan", "AHU-1/SAT"]
+            assert catalog.list("AHU-?/SAT") == ["AHU-1/SAT", "AHU-2/SAT"]
+            assert catalog.list("*SAT") == ["AHU-1/SAT", "AHU-10/SAT", "AHU-2/SAT"]
+            assert catalog.name(catalog.id("Chiller")) == "Chiller"
+
+            # Held open while another writer commits, then picked up through the generation counter
+            stsd.write_data(file, "Boiler", values)
+            assert "Boiler" not in database.catalog
+            assert stsd.list_trends(database, "B*") == ["Boiler"]
+
+
+def test_day_type_registry():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 3, 21)
+        every_15 = [(start + datetime.timedelta(minutes=15 * i), "1") for i in range(96 * 2)]
+        every_5 = [(start + datetime.timedelta(minutes=5 * i), "1") for i in range(288)]
+        stsd.write_many(file, {"A": every_15, "B": every_15, "C": every_5})
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            # Not read until first used
+            assert database.day_types.ids is None
+            assert len(database.day_types) == 2
+
+            bitmap_15 = bytes(stsd.to_day_entry([x[0] for x in every_15[:96]]))
+            assert database.day_types.bitmap(database.day_types.id(bitmap_15)) == bitmap_15
+            assert database.day_types.get_or_add(bitmap_15) == database.day_types.id(bitmap_15)
+
+            # New day types get an id straight away, and are written to the day type pages by write_new
+            new_id = database.day_types.get_or_add(bytes(stsd.to_day_entry([start])))
+            assert new_id == 2
+            assert stsd.Database(pager).day_types.id(bytes(stsd.to_day_entry([start]))) is None
+            database.day_types.write_new()
+            assert stsd.Database(pager).day_types.id(bytes(stsd.to_day_entry([start]))) == new_id
+
+
+def test_day_type_cache():
+    cache = stsd.LRUCache(2)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    assert cache.get(1) == "a"
+    cache.put(3, "c")
+    # 2 was the least recently used
+    assert cache.get(2) is None
+    assert len(cache) == 2
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 3, 21)
+        stsd.write_many(file, {"A": [(start + datetime.timedelta(minutes=15 * i), "1") for i in range(96)]})
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            offsets = database.day_offsets(0)
+            assert offsets == [datetime.timedelta(minutes=15 * i) for i in range(96)]
+            assert database.day_offsets(0) is offsets
+
+            seconds = database.day_offset_seconds(0)
+            assert seconds.tolist() == [900 * i for i in range(96)]
+            assert database.day_offset_seconds(0) is seconds
+            assert not seconds.flags.writeable
+
+            # Kept across reloads, a bitmap always expands the same way
+            database.load()
+            assert database.day_offsets(0) is offsets
+
+
+def test_day_cache():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 1, 1)
+        values = [(start + datetime.timedelta(minutes=15 * i), f"{i % 50}.5") for i in range(96 * 7)]
+        stsd.write_many(file, {"A": values, "B": values})
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            first_day, last_day = datetime.date(2024, 1, 1), datetime.date(2024, 1, 7)
+            assert list(database.read_range("A", first_day, last_day)) == values
+            assert (database.day_cache.hits, database.day_cache.misses) == (0, 7)
+            assert list(database.read_range("A", first_day, last_day)) == values
+            assert (database.day_cache.hits, database.day_cache.misses) == (7, 7)
+
+            # Only the written trend day is dropped
+            new_value = (start + datetime.timedelta(days=2, minutes=1), "99")
+            database.write_many({"A": [new_value]})
+            assert len(database.day_cache) == 6
+            assert new_value in list(database.read_range("A", first_day, last_day))
+            assert database.day_cache.hits == 13
+
+            # A write from another connection clears the cache on refresh
+            stsd.write_many(file, {"B": [new_value]})
+            with stsd.use_database(database) as refreshed:
+                assert len(refreshed.day_cache) == 0
+                assert new_value in list(refreshed.read_range("B", first_day, last_day))
+
+            # Days are dropped, least recently used first, to stay in the budget
+            small = stsd.Database(pager, day_cache_bytes=3 * stsd.decoded_day_size((0, [value for _, value in values[:96]])))
+            list(small.read_range("A", first_day, last_day))
+            assert 0 < small.day_cache.size <= small.day_cache.max_size
+            trend_id = small.catalog.id("A")
+            assert (trend_id, small.day_id(last_day)) in small.day_cache.entries
+            assert (trend_id, small.day_id(first_day)) not in small.day_cache.entries
+
+
+def test_write_ahead_log():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 1, 1)
+        stsd.write_many(file, {"A": [(start + datetime.timedelta(minutes=i), "1.5") for i in range(60)]})
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            # Group commit, appends from many threads at once
+            def collect(thread_index):
+                for i in range(20):
+                    timestamp = start + datetime.timedelta(minutes=30 + thread_index * 20 + i)
+                    database.append({"A": [(timestamp, f"{thread_index}.{i}")], "B": [(timestamp, "On")]})
+            threads = [threading.Thread(target=collect, args=(x,)) for x in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            database.append({"A": [(start + datetime.timedelta(days=1), "2")]})
+
+            expected = {start + datetime.timedelta(minutes=i): "1.5" for i in range(60)}
+            expected.update({start + datetime.timedelta(minutes=30 + t * 20 + i): f"{t}.{i}" for t in range(8) for i in range(20)})
+            expected[start + datetime.timedelta(days=1)] = "2"
+            expected_rows = sorted(expected.items())
+
+            # Visible straight away, on this connection and others
+            assert list(database.read_range("A", start.date(), datetime.date(2024, 1, 2))) == expected_rows
+            assert list(stsd.read_range(file, "A", start.date(), datetime.date(2024, 1, 2))) == expected_rows
+            assert len(list(stsd.read_range(file, "B", start.date(), start.date()))) == 160
+            assert stsd.list_trends(file) == ["A", "B"]
+            timestamps, values = database.read_range_arrays("A", start.date(), datetime.date(2024, 1, 2))
+            assert values.tolist() == [float(value) for _, value in expected_rows]
+            assert timestamps.tolist() == [int(x.replace(tzinfo=datetime.timezone.utc).timestamp()) for x, _ in expected_rows]
+
+            # Only finished days are checkpointed, unless aged
+            assert database.checkpoint() == 160
+            assert set(database.wal.days) == {("A", datetime.date(2024, 1, 2)), ("B", start.date())}
+            assert list(database.read_range("A", start.date(), datetime.date(2024, 1, 2))) == expected_rows
+            assert database.checkpoint(max_age=0) == 161
+            assert len(database.wal) == 0 and os.path.getsize(stsd.wal_path(file)) == 0
+            assert list(stsd.read_range(file, "A", start.date(), datetime.date(2024, 1, 2))) == expected_rows
+
+            # One connection writes to the log at a time
+            database.append({"A": [(start, "3")]})
+            try:
+                stsd.WriteAheadLog(stsd.wal_path(file))
+                assert False, "Expected the log to be locked"
+            except ValueError:
+                pass
+            database.wal.close()
+
+            # A torn record at the end is dropped on replay
+            with open(stsd.wal_path(file), 'ab') as log_file:
+                log_file.write(stsd.encode_wal_record({"A": [(start, "4")]})[:-2])
+            with stsd.WriteAheadLog(stsd.wal_path(file)) as log:
+                assert log.days == {("A", start.date()): {0: "3"}}
+            assert os.path.getsize(stsd.wal_path(file)) == len(stsd.encode_wal_record({"A": [(start, "3")]}))
+
+
+def test_write_ahead_log_sync_failure():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+        start = datetime.datetime(2024, 1, 1)
+
+        with stsd.Pager(file) as pager:
+            database = stsd.Database(pager)
+            database.append({"A": [(start, "1")]})
+            log = database.wal
+
+            # The first fsync holds on until two more appends have queued behind it, and the group commit of those fails
+            fsync = os.fsync
+            syncs = []
+            queued = threading.Event()
+
+            def failing_fsync(fd):
+                syncs.append(fd)
+                if len(syncs) == 1:
+                    queued.wait(5)
+                    return fsync(fd)
+                raise OSError(errno.EIO, "Input/output error")
+
+            errors = []
+
+            def append(value):
+                try:
+                    database.append({"A": [(start + datetime.timedelta(minutes=int(value)), value)], "B": [(start, value)]})
+                except OSError:
+                    errors.append(value)
+
+            os.fsync = failing_fsync
+            try:
+                threads = [threading.Thread(target=append, args=(value,)) for value in ["2", "3", "4"]]
+                threads[0].start()
+                while not syncs:
+                    time.sleep(0.001)
+                for thread in threads[1:]:
+                    thread.start()
+                while len(log.pending) < 2:
+                    time.sleep(0.001)
+                queued.set()
+                for thread in threads:
+                    thread.join()
+            finally:
+                os.fsync = fsync
+
+            # Both appends of the failed group raise, and none of their values are readable, queued, or on disk
+            assert sorted(errors) == ["3", "4"] and len(syncs) == 2
+            assert log.days == {("A", start.date()): {0: "1", 2: "2"}, ("B", start.date()): {0: "2"}}
+            assert log.pending == [] and log.failed_sequences == {}
+            with stsd.WriteAheadLog(stsd.wal_path(file), writable=False) as other:
+                assert other.days == log.days
+
+            # The next commit writes only its own values
+            database.append({"A": [(start + datetime.timedelta(minutes=5), "5")]})
+            assert [value for _, value in database.read_range("A", start.date(), start.date())] == ["1", "2", "5"]
+        with stsd.WriteAheadLog(stsd.wal_path(file), writable=False) as log:
+            assert log.days == {("A", start.date()): {0: "1", 2: "2", 5: "5"}, ("B", start.date()): {0: "2"}}
+
+
+def test_snapshot_reads():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 1, 1)
+        minutes = [start + datetime.timedelta(days=day, minutes=minute) for day in range(4) for minute in range(0, 1440, 2)]
+
+        def batch(trend_name, number):
+            # Text values, so each day fills most of a page and a batch rewrites many pages
+            return {trend_name: [(x, f"batch {number} {x.minute % 7}") for x in minutes]}
+        stsd.write_many(file, batch("A", 0))
+
+        stop = threading.Event()
+        errors = []
+
+        def writer(trend_name):
+            with stsd.Pager(file) as pager:
+                database = stsd.Database(pager)
+                number = 1
+                while not stop.is_set():
+                    database.write_many(batch(trend_name, number))
+                    number += 1
+
+        def reader():
+            with stsd.Pager(file, writable=False) as pager:
+                database = stsd.Database(pager)
+                for _ in range(10):
+                    rows = database.read_range_list("A", start.date(), datetime.date(2024, 1, 4))
+                    # Every value from the same batch, never a mix of a half written one or of two batches
+                    if len(rows) != len(minutes) or len({value.split()[1] for _, value in rows}) != 1:
+                        errors.append(rows)
+
+        # Switch threads often, so reads land in the middle of writes
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        try:
+            writers = [threading.Thread(target=writer, args=(x,)) for x in ["A", "B"]]
+            readers = [threading.Thread(target=reader) for _ in range(2)]
+            for thread in writers + readers:
+                thread.start()
+            for thread in readers:
+                thread.join()
+            stop.set()
+            for thread in writers:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        assert errors == []
+        # Two writers at once, both trends are intact
+        for trend_name in ["A", "B"]:
+            values = [value for _, value in stsd.read_range(file, trend_name, start.date(), datetime.date(2024, 1, 4))]
+            assert len(values) == len(minutes) and len({value.split()[1] for value in values}) == 1
+
+
+def test_read_range_changed():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.db")
+        stsd.init(file)
+
+        start = datetime.datetime(2024, 1, 1)
+        minutes = [start + datetime.timedelta(days=day, minutes=minute) for day in range(4) for minute in range(0, 1440, 2)]
+        # Text values, so each day takes most of a page and the range is read in several chunks
+        stsd.write_many(file, {"A": [(x, f"batch 0 {x.minute % 7}") for x in minutes]})
+
+        def writer():
+            stsd.write_many(file, {"A": [(x, f"batch 1 {x.minute % 7}") for x in minutes]})
+
+        with stsd.Pager(file, writable=False) as pager:
+            database = stsd.Database(pager)
+            rows = database.read_range("A", start.date(), datetime.date(2024, 1, 4))
+            assert next(rows)[1].startswith("batch 0")
+
+            # A commit between chunks ends the read rather than mix in days of the new batch
+            thread = threading.Thread(target=writer)
+            thread.start()
+            thread.join()
+            try:
+                list(rows)
+                assert False, "Expected an error"
+            except stsd.SnapshotChanged:
+                pass
+
+            values = [value for _, value in database.read_range_list("A", start.date(), datetime.date(2024, 1, 4))]
+            assert len(values) == len(minutes) and {value.split()[1] for value in values} == {"1"}
+
+
 def init_test():
     stsd.init(f"{datetime.datetime.now().isoformat()}.db")
 